@@ -0,0 +1,120 @@
+import re
+import json
+from django.db import transaction
+from django_redis import get_redis_connection
+from goods import sku_cache
+from cart.models import CartArchive
+from cart.utils import cart_key, cart_total_key, cart_batch, get_script, touch_cart, CART_TTL
+
+
+# 购物车的冷热分层: 活跃的购物车在redis中，长时间没有访问的购物车归档到数据库(df_cart_archive)
+# 每次访问都会把购物车的过期时间延长到CART_TTL，所以 CART_TTL - 剩余过期时间 就是购物车没有被访问的时间
+# 归档在购物车过期之前进行；用户登录或者打开购物车页面时，如果redis中没有购物车，从数据库恢复
+# 会话的有效期(SESSION_COOKIE_AGE)比ARCHIVE_AFTER短，购物车归档时用户的登录状态都已经失效，下次访问一定会经过登录
+ARCHIVE_AFTER = 30 * 24 * 3600  # 超过这个时间没有访问的购物车归档(秒)
+CART_KEY_RE = re.compile(r'^cart_(\d+)$')
+
+# 删除已经归档的购物车，归档期间购物车被访问过(过期时间被延长)时不删除
+# KEYS[1]: cart_用户id KEYS[2]: cart_total_用户id ARGV[1]: 允许的最大剩余过期时间
+ARCHIVE_DELETE_LUA = """
+local ttl = redis.call('TTL', KEYS[1])
+if ttl < 0 or ttl > tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+return 1
+"""
+
+
+def archive_idle(idle=ARCHIVE_AFTER, scan_count=1000):
+    """扫描所有购物车，把超过idle秒没有访问的购物车归档到数据库，返回归档的购物车数目
+
+    还没有过期时间的购物车(设置过期时间之前创建的)不归档，只设置过期时间
+    """
+
+    conn = get_redis_connection('default')
+    max_ttl = CART_TTL - idle
+    archived = 0
+    keys = []
+    for key in conn.scan_iter(match='cart_*', count=scan_count):
+        match = CART_KEY_RE.match(key.decode())
+        if match:
+            keys.append((int(match.group(1)), key))
+        if len(keys) >= scan_count:
+            archived += archive_keys(conn, keys, max_ttl)
+            keys = []
+    if keys:
+        archived += archive_keys(conn, keys, max_ttl)
+    return archived
+
+
+def archive_keys(conn, keys, max_ttl):
+    """归档一批购物车中空闲的购物车，keys: [(用户id, 键), ...]"""
+
+    pipe = conn.pipeline(transaction=False)
+    for user_id, key in keys:
+        pipe.ttl(key)
+    ttls = pipe.execute()
+
+    idle_ids = []
+    for (user_id, key), ttl in zip(keys, ttls):
+        if ttl == -1:
+            touch_cart(pipe, user_id)
+        elif 0 <= ttl <= max_ttl:
+            idle_ids.append(user_id)
+    for user_id in idle_ids:
+        pipe.hgetall(cart_key(user_id))
+    results = pipe.execute()
+    carts = results[len(results) - len(idle_ids):]
+
+    # 先写入数据库，再从redis删除
+    archives = [CartArchive(user_id=user_id, items=json.dumps({int(sku_id): int(count) for sku_id, count in cart.items()}))
+                for user_id, cart in zip(idle_ids, carts) if cart]
+    if not archives:
+        return 0
+    with transaction.atomic():
+        CartArchive.objects.filter(user_id__in=[archive.user_id for archive in archives]).delete()
+        CartArchive.objects.bulk_create(archives)
+
+    script = get_script(ARCHIVE_DELETE_LUA)
+    for archive in archives:
+        script(keys=[cart_key(archive.user_id), cart_total_key(archive.user_id)], args=[max_ttl], client=pipe)
+    deleted = pipe.execute()
+
+    # 归档期间被访问过的购物车还在redis中，删除数据库中的归档，避免恢复时重复累加
+    kept = [archive.user_id for archive, ok in zip(archives, deleted) if not ok]
+    if kept:
+        CartArchive.objects.filter(user_id__in=kept).delete()
+    return len(archives) - len(kept)
+
+
+def restore(user_id):
+    """把数据库中归档的购物车恢复到redis，返回恢复的商品条目数(没有归档时为0)"""
+
+    archive = CartArchive.objects.filter(user_id=user_id).first()
+    if archive is None:
+        return 0
+    # 只有删除成功的进程恢复，并发的请求不会重复累加
+    if not CartArchive.objects.filter(id=archive.id).delete()[0]:
+        return 0
+
+    cart = {int(sku_id): count for sku_id, count in json.loads(archive.items).items()}
+    # 已经下架删除的商品不恢复，数量不超过现在的库存
+    skus = sku_cache.get_many(cart)
+    lines = [(sku_id, count, skus[sku_id].stock) for sku_id, count in cart.items() if sku_id in skus]
+    if lines:
+        cart_batch(user_id, lines, 'merge')
+    return len(lines)
+
+
+def load_cart(user_id):
+    """读取用户的购物车{商品id: 数量}(bytes)并延长过期时间，购物车已经归档时先恢复"""
+
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline(transaction=False)
+    pipe.hgetall(cart_key(user_id))
+    touch_cart(pipe, user_id)
+    cart = pipe.execute()[0]
+    if not cart and restore(user_id):
+        cart = conn.hgetall(cart_key(user_id))
+    return cart
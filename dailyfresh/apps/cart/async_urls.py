@@ -0,0 +1,10 @@
+from django.urls import path
+from cart.async_views import AsyncCartAddView, AsyncCartUpdateView, AsyncCartDeleteView, AsyncCartBatchView
+
+
+urlpatterns = [
+    path('add/', AsyncCartAddView.as_view(), name='add'),  # 购物车记录添加
+    path('update/', AsyncCartUpdateView.as_view(), name='update'),  # 购物车记录更新
+    path('delete/', AsyncCartDeleteView.as_view(), name='delete'),  # 购物车记录删除
+    path('batch/', AsyncCartBatchView.as_view(), name='batch'),  # 购物车记录批量修改
+]
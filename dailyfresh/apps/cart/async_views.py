@@ -0,0 +1,171 @@
+from django.http import JsonResponse
+from django.views.generic import View
+from goods import sku_cache
+from cart.utils import cart_key, cart_total_key, CART_ADD_LUA, CART_UPDATE_LUA, CART_DELETE_LUA, CART_BATCH_LUA
+from cart.utils import batch_args, parse_batch, batch_lines, batch_results, get_cart_totals
+from cart.views import guest_add
+from utils.async_utils import get_async_redis, run_sync, get_user
+
+
+# 购物车ajax接口的异步版本(ASGI部署时使用)，参数和返回值与cart.views中的同步版本相同
+
+
+async def get_sku(sku_id):
+    """查询商品(从热点商品缓存中读取)，不存在时返回None"""
+
+    return await run_sync(sku_cache.get, sku_id)
+
+
+async def run_cart_script(source, user, args):
+    """执行购物车的lua脚本，返回(是否成功, 商品条目数, 商品总件数)"""
+
+    script = get_async_redis().register_script(source)
+    ok, line_count, total_count = await script(keys=[cart_key(user.id), cart_total_key(user.id)], args=args)
+    return bool(ok), line_count, total_count
+
+
+# /async/cart/add/
+class AsyncCartAddView(View):
+    """购物车记录添加(异步)"""
+
+    async def post(self, request):
+        """购物车记录添加"""
+
+        user = await get_user(request)
+
+        # 接收数据
+        sku_id = request.POST.get('sku_id')
+        count = request.POST.get('count')
+
+        # 数据校验
+        if not all([sku_id, count]):
+            return JsonResponse({'res': 1, 'errmsg': '数据不完整'})
+
+        # 校验添加的商品数量
+        try:
+            count = int(count)
+        except Exception as e:
+            # 数目出错
+            return JsonResponse({'res': 2, 'errmsg': '商品数目出错'})
+
+        # 校验商品是否存在
+        sku = await get_sku(sku_id)
+        if sku is None:
+            # 商品不存在
+            return JsonResponse({'res': 3, 'errmsg': '商品不存在'})
+
+        if user is None:
+            # 用户未登录，添加到cookie中的购物车(读写cookie不需要等待)
+            return guest_add(request, sku, count)
+
+        # 原子地累加购物车中商品的数目并校验库存，同时返回用户购物车商品的条目数
+        ok, total_count, total_quantity = await run_cart_script(CART_ADD_LUA, user, [sku.id, count, sku.stock])
+        if not ok:
+            return JsonResponse({'res': 4, 'errmsg': '商品库存不足'})
+
+        # 返回应答
+        return JsonResponse({'res': 5, 'total_count': total_count, 'message': '添加成功'})
+
+
+# /async/cart/update/
+class AsyncCartUpdateView(View):
+    """购物车记录更新(异步)"""
+
+    async def post(self, request):
+        """购物车记录更新"""
+
+        user = await get_user(request)
+        if user is None:
+            # 用户未登录
+            return JsonResponse({'res': 0, 'errmsg': '请先登录'})
+
+        # 接收数据
+        sku_id = request.POST.get('sku_id')
+        count = request.POST.get('count')
+
+        # 数据校验
+        if not all([sku_id, count]):
+            return JsonResponse({'res': 1, 'errmsg': '数据不完整'})
+
+        # 校验添加的商品数量
+        try:
+            count = int(count)
+        except Exception as e:
+            # 数目出错
+            return JsonResponse({'res': 2, 'errmsg': '商品数目出错'})
+
+        # 校验商品是否存在
+        sku = await get_sku(sku_id)
+        if sku is None:
+            # 商品不存在
+            return JsonResponse({'res': 3, 'errmsg': '商品不存在'})
+
+        # 原子地校验库存并更新，同时返回用户购物车中商品的总件数
+        ok, line_count, total_count = await run_cart_script(CART_UPDATE_LUA, user, [sku.id, count, sku.stock])
+        if not ok:
+            return JsonResponse({'res': 4, 'errmsg': '商品库存不足'})
+
+        # 返回应答
+        return JsonResponse({'res': 5, 'total_count': total_count, 'message': '更新成功'})
+
+
+# /async/cart/delete/
+class AsyncCartDeleteView(View):
+    """购物车记录删除(异步)"""
+
+    async def post(self, request):
+        """购物车记录删除"""
+
+        user = await get_user(request)
+        if user is None:
+            # 用户未登录
+            return JsonResponse({'res': 0, 'errmsg': '请先登录'})
+
+        # 接收参数
+        sku_id = request.POST.get('sku_id')
+
+        # 数据的校验
+        if not sku_id:
+            return JsonResponse({'res': 1, 'errmsg': '无效的商品id'})
+
+        # 校验商品是否存在
+        sku = await get_sku(sku_id)
+        if sku is None:
+            # 商品不存在
+            return JsonResponse({'res': 2, 'errmsg': '商品不存在'})
+
+        # 删除，同时返回用户购物车中商品的总件数
+        ok, line_count, total_count = await run_cart_script(CART_DELETE_LUA, user, [sku.id])
+
+        # 返回应答
+        return JsonResponse({'res': 3, 'total_count': total_count, 'message': '删除成功'})
+
+
+# /async/cart/batch/
+class AsyncCartBatchView(View):
+    """购物车记录批量修改(异步)"""
+
+    async def post(self, request):
+        user = await get_user(request)
+        if user is None:
+            return JsonResponse({'res': 0, 'errmsg': '请先登录'})
+
+        add = request.POST.get('mode') == 'add'
+        lines = parse_batch(request.POST.getlist('sku_id'), request.POST.getlist('count'), add)
+        if lines is None:
+            return JsonResponse({'res': 1, 'errmsg': '数据错误'})
+
+        # 一次查询出所有商品
+        skus = await run_sync(sku_cache.get_many, [sku_id for sku_id, count in lines])
+        script_lines, missing = batch_lines(lines, skus, add)
+
+        # 在一个脚本中修改所有商品
+        if script_lines:
+            script = get_async_redis().register_script(CART_BATCH_LUA)
+            result = await script(keys=[cart_key(user.id), cart_total_key(user.id)], args=batch_args(script_lines, 'add' if add else 'update'))
+            oks, line_count, total_count = [bool(ok) for ok in result[3:]], result[1], result[2]
+        else:
+            oks, (line_count, total_count) = [], await run_sync(get_cart_totals, user.id)
+
+        return JsonResponse({'res': 5, 'lines': batch_results(lines, missing, oks),
+                             'line_count': line_count, 'total_count': total_count, 'message': '修改成功'})
@@ -0,0 +1,54 @@
+from django.core import signing
+
+
+# 未登录用户的购物车，保存在签名的cookie中，登录时合并到redis的cart_用户id(见cart.utils.merge_guest_cart)
+# cookie的内容: 商品id:数量|商品id:数量... 按加入的顺序排列
+COOKIE_NAME = 'guest_cart'
+COOKIE_SALT = 'cart.guest'
+COOKIE_AGE = 30 * 24 * 3600
+GUEST_LIMIT = 50  # 最多保存的商品条目数，保证cookie不超过浏览器的4KB限制
+
+
+def load(request):
+    """从cookie中读取购物车，返回{商品id: 数量}，cookie不存在或者被篡改时返回空的购物车"""
+
+    value = request.get_signed_cookie(COOKIE_NAME, default='', salt=COOKIE_SALT, max_age=COOKIE_AGE)
+    cart = {}
+    for item in value.split('|'):
+        try:
+            sku_id, count = item.split(':')
+            sku_id, count = int(sku_id), int(count)
+        except ValueError:
+            continue
+        if count > 0:
+            cart[sku_id] = count
+    return cart
+
+
+def dumps(cart):
+    return '|'.join('%d:%d' % (sku_id, count) for sku_id, count in cart.items())
+
+
+def save(response, cart):
+    """保存购物车，购物车为空时删除cookie"""
+
+    if not cart:
+        clear(response)
+        return
+    response.set_signed_cookie(COOKIE_NAME, dumps(cart), salt=COOKIE_SALT, max_age=COOKIE_AGE, httponly=True)
+
+
+def clear(response):
+    response.delete_cookie(COOKIE_NAME)
+
+
+def add(cart, sku_id, count, stock=None):
+    """在购物车中累加商品的数目，超过库存或者条目数超过GUEST_LIMIT时不修改，返回是否成功"""
+
+    count += cart.get(sku_id, 0)
+    if stock is not None and count > stock:
+        return False
+    if sku_id not in cart and len(cart) >= GUEST_LIMIT:
+        return False
+    cart[sku_id] = count
+    return True
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from cart import archive
+
+
+class Command(BaseCommand):
+    """归档长时间没有访问的购物车: python manage.py archive_carts [--idle-days 30]"""
+
+    help = '把超过指定天数没有访问的购物车从redis移到数据库(用户再次访问时自动恢复)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=int, default=archive.ARCHIVE_AFTER // (24 * 3600),
+                            help='没有访问的天数(默认%(default)s)')
+
+    def handle(self, *args, **options):
+        count = archive.archive_idle(idle=options['idle_days'] * 24 * 3600)
+        self.stdout.write('已归档%d个购物车' % count)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from utils.redis_memory import memory_report
+
+
+class Command(BaseCommand):
+    """按键的类别统计redis的内存: python manage.py redis_memory_report"""
+
+    help = '显示每类键(购物车、浏览记录、会话、缓存等)的键数、内存、编码和没有过期时间的键数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--match', default='*', help='只统计匹配的键')
+        parser.add_argument('--samples', type=int, default=5, help='MEMORY USAGE的抽样元素数(0为全部)')
+
+    def handle(self, *args, **options):
+        report = memory_report(match=options['match'], samples=options['samples'])
+        total = sum(stats['bytes'] for stats in report.values())
+        for name, stats in sorted(report.items(), key=lambda item: -item[1]['bytes']):
+            encodings = ' '.join('%s=%d' % item for item in stats['encodings'].most_common())
+            self.stdout.write('%-12s keys=%d bytes=%d avg=%d share=%.1f%% no_ttl=%d %s' % (
+                name, stats['keys'], stats['bytes'], stats['bytes'] // stats['keys'],
+                stats['bytes'] / total * 100 if total else 0, stats['no_ttl'], encodings))
+        self.stdout.write('total bytes=%d' % total)
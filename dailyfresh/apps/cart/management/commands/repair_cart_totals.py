@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from cart.utils import repair_cart_totals
+
+
+class Command(BaseCommand):
+    """从购物车重新计算商品总件数: python manage.py repair_cart_totals [--user 用户id]"""
+
+    help = '从cart_用户id重新计算cart_total_用户id(数据不一致或导入购物车之后使用)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='只修复这个用户的购物车')
+
+    def handle(self, *args, **options):
+        count = repair_cart_totals(options['user'])
+        self.stdout.write('已修复%d个购物车的总件数' % count)
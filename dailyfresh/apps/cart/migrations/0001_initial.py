@@ -0,0 +1,33 @@
+# Generated by Django 4.0 on 2026-10-18 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('user', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('create_time', models.DateField(auto_now_add=True, verbose_name='创建时间')),
+                ('update_time', models.DateField(auto_now=True, verbose_name='更新时间')),
+                ('is_delete', models.BooleanField(default=False, verbose_name='删除标记')),
+                ('items', models.TextField(verbose_name='购物车商品')),
+                ('archive_time', models.DateTimeField(auto_now=True, verbose_name='归档时间')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='user.user', verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '归档购物车',
+                'verbose_name_plural': '归档购物车',
+                'db_table': 'df_cart_archive',
+            },
+        ),
+    ]
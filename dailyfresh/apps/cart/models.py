@@ -1,3 +1,15 @@
 from django.db import models
+from db.base_model import BaseModel
 
-# Create your models here.
+
+class CartArchive(BaseModel):
+    """归档的购物车模型类(长时间没有访问的购物车从redis移到数据库，用户再次访问时恢复)"""
+
+    user = models.OneToOneField('user.User', verbose_name='用户', on_delete=models.CASCADE)
+    items = models.TextField(verbose_name='购物车商品')  # json {'商品id': 商品数量, ...}
+    archive_time = models.DateTimeField(auto_now=True, verbose_name='归档时间')
+
+    class Meta:
+        db_table = 'df_cart_archive'
+        verbose_name = '归档购物车'
+        verbose_name_plural = verbose_name
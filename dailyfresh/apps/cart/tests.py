@@ -1,3 +1,263 @@
-from django.test import TestCase
+import json
+import threading
+from django.core import signing
+from django.test import SimpleTestCase, TestCase, RequestFactory
+from django_redis import get_redis_connection
+
+from user.models import User
+from goods.models import GoodsType, Goods, GoodsSKU
+from goods import sku_cache
+from cart import guest, archive
+from cart.models import CartArchive
+from cart.utils import cart_key, cart_total_key, cart_add, cart_update, cart_delete, get_cart_totals, repair_cart_total, \
+    cart_batch, parse_batch, batch_lines, batch_results, BATCH_LIMIT
+
 
 # Create your tests here.
+
+
+class CartScriptTest(SimpleTestCase):
+    """购物车lua脚本的测试(需要redis)"""
+
+    user_id = 2 ** 31 - 1  # 不会和真实用户冲突的用户id
+    sku_id = 1
+
+    def setUp(self):
+        self.conn = get_redis_connection('default')
+        self.conn.delete(cart_key(self.user_id), cart_total_key(self.user_id))
+
+    def tearDown(self):
+        self.conn.delete(cart_key(self.user_id), cart_total_key(self.user_id))
+
+    def run_threads(self, target, threads=20):
+        workers = [threading.Thread(target=target) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def test_add_update_delete_return_totals(self):
+        """一次调用返回修改之后的商品条目数和总件数"""
+
+        self.assertEqual(cart_add(self.user_id, 1, 2), (True, 1, 2))
+        self.assertEqual(cart_add(self.user_id, 2, 3), (True, 2, 5))
+        self.assertEqual(cart_add(self.user_id, 1, 1), (True, 2, 6))
+        self.assertEqual(cart_update(self.user_id, 2, 1), (True, 2, 4))
+        self.assertEqual(cart_delete(self.user_id, 1), (1, 1))
+
+    def test_stock_ceiling(self):
+        """超过库存时不修改购物车"""
+
+        self.assertEqual(cart_add(self.user_id, self.sku_id, 3, stock=5), (True, 1, 3))
+        self.assertEqual(cart_add(self.user_id, self.sku_id, 3, stock=5), (False, 1, 3))
+        self.assertEqual(cart_update(self.user_id, self.sku_id, 6, stock=5), (False, 1, 3))
+        self.assertEqual(cart_update(self.user_id, self.sku_id, 5, stock=5), (True, 1, 5))
+
+    def test_concurrent_adds_are_not_lost(self):
+        """并发累加同一件商品，不会丢失任何一次累加"""
+
+        def add():
+            for i in range(50):
+                cart_add(self.user_id, self.sku_id, 1)
+
+        self.run_threads(add, threads=20)
+        self.assertEqual(int(self.conn.hget(cart_key(self.user_id), self.sku_id)), 20 * 50)
+
+    def test_concurrent_adds_respect_stock(self):
+        """并发累加时库存上限依然有效: 成功累加的数量之和等于购物车中的数量，并且不超过库存"""
+
+        succeeded = []
+
+        def add():
+            for i in range(10):
+                ok, line_count, total_count = cart_add(self.user_id, self.sku_id, 3, stock=100)
+                if ok:
+                    succeeded.append(3)
+
+        self.run_threads(add, threads=20)
+        count = int(self.conn.hget(cart_key(self.user_id), self.sku_id))
+        self.assertEqual(count, sum(succeeded))
+        self.assertEqual(count, 99)
+
+    def test_total_key_follows_mutations(self):
+        """总件数和购物车一起修改，购物车为空时删除"""
+
+        cart_add(self.user_id, 1, 2)
+        cart_add(self.user_id, 2, 3)
+        self.assertEqual(int(self.conn.get(cart_total_key(self.user_id))), 5)
+        self.assertEqual(get_cart_totals(self.user_id), (2, 5))
+        cart_delete(self.user_id, 1, 2)
+        self.assertFalse(self.conn.exists(cart_total_key(self.user_id)))
+        self.assertEqual(get_cart_totals(self.user_id), (0, 0))
+
+    def test_repair_total(self):
+        """没有总件数或总件数错误时从购物车重新计算"""
+
+        self.conn.hset(cart_key(self.user_id), mapping={1: 2, 2: 3})
+        self.assertEqual(get_cart_totals(self.user_id), (2, 5))
+        self.conn.set(cart_total_key(self.user_id), 100)
+        self.assertEqual(repair_cart_total(self.user_id), 5)
+        self.assertEqual(cart_add(self.user_id, 1, 1), (True, 2, 6))
+
+    def test_batch_merge_clamps_to_stock(self):
+        """合并时超过库存的部分不加入，购物车中原有的数量不减少"""
+
+        cart_add(self.user_id, 1, 4)
+        cart_add(self.user_id, 2, 6)
+        oks, line_count, total_count = cart_batch(self.user_id, [(1, 3, 5), (2, 2, 5), (3, 5, 2), (4, 1, None)], 'merge')
+        self.assertEqual(oks, [True, False, True, True])
+        counts = {int(sku_id): int(count) for sku_id, count in self.conn.hgetall(cart_key(self.user_id)).items()}
+        # 商品2原来的数量已经超过了现在的库存，保持不变
+        self.assertEqual(counts, {1: 5, 2: 6, 3: 2, 4: 1})
+        self.assertEqual((line_count, total_count), (4, 14))
+
+    def test_batch_update_and_add(self):
+        """批量设置数量(0表示删除)和累加，库存不足的行不修改，其他行照常修改"""
+
+        cart_add(self.user_id, 1, 2)
+        cart_add(self.user_id, 2, 3)
+        self.assertEqual(cart_batch(self.user_id, [(1, 0, None), (2, 4, 3), (3, 2, 5)]), ([True, False, True], 2, 5))
+        self.assertEqual(cart_batch(self.user_id, [(2, 1, 10), (3, 4, 5)], 'add'), ([True, False], 2, 6))
+
+
+class CartBatchParamsTest(SimpleTestCase):
+    """批量修改购物车的参数校验和结果组织"""
+
+    class SKU(object):
+        def __init__(self, stock):
+            self.stock = stock
+
+    def test_parse_batch(self):
+        self.assertEqual(parse_batch(['1', '2'], ['3', '0']), [(1, 3), (2, 0)])
+        # 长度不一致、为空、超过上限、不是整数、负数
+        self.assertIsNone(parse_batch(['1', '2'], ['3']))
+        self.assertIsNone(parse_batch([], []))
+        self.assertIsNone(parse_batch(['1'] * (BATCH_LIMIT + 1), ['1'] * (BATCH_LIMIT + 1)))
+        self.assertIsNone(parse_batch(['a'], ['1']))
+        self.assertIsNone(parse_batch(['1'], ['-1']))
+        # 累加时数量不能为0
+        self.assertIsNone(parse_batch(['1'], ['0'], add=True))
+
+    def test_batch_lines(self):
+        lines = [(1, 2), (2, 0), (3, 1)]
+        skus = {1: self.SKU(5)}
+        # 设置数量为0(删除)时不要求商品存在
+        self.assertEqual(batch_lines(lines, skus), ([(1, 2, 5), (2, 0, None)], {2}))
+        self.assertEqual(batch_lines(lines, skus, add=True), ([(1, 2, 5)], {1, 2}))
+
+    def test_batch_results(self):
+        lines = [(1, 2), (2, 1), (3, 1)]
+        self.assertEqual(batch_results(lines, {1}, [True, False]),
+                         [{'sku_id': 1, 'res': 1},
+                          {'sku_id': 2, 'res': 0, 'errmsg': '商品不存在'},
+                          {'sku_id': 3, 'res': 0, 'errmsg': '商品库存不足'}])
+
+
+class GuestCartTest(SimpleTestCase):
+    """未登录用户的cookie购物车"""
+
+    def make_request(self, value=None, signed=True):
+        request = RequestFactory().get('/')
+        if value is not None:
+            if signed:
+                value = signing.get_cookie_signer(salt=guest.COOKIE_NAME + guest.COOKIE_SALT).sign(value)
+            request.COOKIES[guest.COOKIE_NAME] = value
+        return request
+
+    def test_load_dumps(self):
+        cart = {3: 1, 1: 2}
+        self.assertEqual(guest.dumps(cart), '3:1|1:2')
+        self.assertEqual(guest.load(self.make_request(guest.dumps(cart))), cart)
+        self.assertEqual(guest.load(self.make_request()), {})
+
+    def test_load_ignores_invalid_items(self):
+        """格式错误和数量不大于0的条目被忽略"""
+        self.assertEqual(guest.load(self.make_request('1:2|x:1|2|3:0|4:-1|5:1')), {1: 2, 5: 1})
+
+    def test_tampered_cookie(self):
+        """没有签名或者签名错误时返回空的购物车"""
+        self.assertEqual(guest.load(self.make_request('1:2', signed=False)), {})
+        value = signing.get_cookie_signer(salt=guest.COOKIE_NAME + guest.COOKIE_SALT).sign('1:2')
+        self.assertEqual(guest.load(self.make_request(value.replace('1:2', '1:9'), signed=False)), {})
+
+    def test_add(self):
+        cart = {}
+        self.assertTrue(guest.add(cart, 1, 2, stock=3))
+        self.assertFalse(guest.add(cart, 1, 2, stock=3))
+        self.assertTrue(guest.add(cart, 1, 1, stock=3))
+        self.assertEqual(cart, {1: 3})
+
+    def test_add_limit(self):
+        """条目数达到GUEST_LIMIT时不能添加新商品，已有的商品可以累加"""
+
+        cart = {sku_id: 1 for sku_id in range(guest.GUEST_LIMIT)}
+        self.assertFalse(guest.add(cart, guest.GUEST_LIMIT, 1))
+        self.assertTrue(guest.add(cart, 0, 1))
+        self.assertEqual(len(cart), guest.GUEST_LIMIT)
+
+
+class CartArchiveTest(TestCase):
+    """购物车归档和恢复的测试(需要redis)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('archive_test', 'archive_test@example.com', 'password')
+        typ = GoodsType.objects.create(name='水果', logo='fruit', image='type/fruit.jpg')
+        goods = Goods.objects.create(name='草莓')
+        self.skus = [GoodsSKU.objects.create(type=typ, goods=goods, name='商品%d' % i, desc='简介', price=10,
+                                             unite='500g', image='goods/%d.jpg' % i, stock=stock)
+                     for i, stock in enumerate([5, 10])]
+        # 测试中事务不会提交，手动删除之前的测试留下的热点商品缓存
+        sku_cache.invalidate([sku.id for sku in self.skus])
+        self.conn = get_redis_connection('default')
+        self.key = cart_key(self.user.id)
+        self.max_ttl = archive.CART_TTL - archive.ARCHIVE_AFTER
+        self.clear_cart()
+
+    def tearDown(self):
+        self.clear_cart()
+
+    def clear_cart(self):
+        self.conn.delete(self.key, cart_total_key(self.user.id))
+
+    def cart(self):
+        return {int(sku_id): int(count) for sku_id, count in self.conn.hgetall(self.key).items()}
+
+    def test_archive_idle_cart(self):
+        """空闲的购物车写入数据库并从redis删除"""
+
+        cart_add(self.user.id, self.skus[0].id, 2)
+        self.conn.expire(self.key, 100)
+        self.assertEqual(archive.archive_keys(self.conn, [(self.user.id, self.key)], self.max_ttl), 1)
+        self.assertFalse(self.conn.exists(self.key))
+        self.assertFalse(self.conn.exists(cart_total_key(self.user.id)))
+        items = json.loads(CartArchive.objects.get(user=self.user).items)
+        self.assertEqual(items, {str(self.skus[0].id): 2})
+
+    def test_active_cart_not_archived(self):
+        """最近访问过的购物车不归档，没有过期时间的购物车只设置过期时间"""
+
+        cart_add(self.user.id, self.skus[0].id, 2)
+        self.assertEqual(archive.archive_keys(self.conn, [(self.user.id, self.key)], self.max_ttl), 0)
+        self.conn.persist(self.key)
+        self.assertEqual(archive.archive_keys(self.conn, [(self.user.id, self.key)], self.max_ttl), 0)
+        self.assertGreater(self.conn.ttl(self.key), self.max_ttl)
+        self.assertFalse(CartArchive.objects.exists())
+        self.assertEqual(self.cart(), {self.skus[0].id: 2})
+
+    def test_restore(self):
+        """恢复时合并到redis中的购物车，数量不超过库存，已经删除的商品不恢复，归档只恢复一次"""
+
+        missing_id = self.skus[-1].id + 1000
+        CartArchive.objects.create(user=self.user, items=json.dumps({self.skus[0].id: 7, self.skus[1].id: 3, missing_id: 1}))
+        cart_add(self.user.id, self.skus[1].id, 1)
+        self.assertEqual(archive.restore(self.user.id), 2)
+        self.assertEqual(self.cart(), {self.skus[0].id: 5, self.skus[1].id: 4})
+        self.assertEqual(get_cart_totals(self.user.id), (2, 9))
+        self.assertFalse(CartArchive.objects.exists())
+        self.assertEqual(archive.restore(self.user.id), 0)
+
+    def test_load_cart_restores(self):
+        """redis中没有购物车时从归档恢复"""
+
+        CartArchive.objects.create(user=self.user, items=json.dumps({self.skus[0].id: 2}))
+        self.assertEqual(archive.load_cart(self.user.id), {str(self.skus[0].id).encode(): b'2'})
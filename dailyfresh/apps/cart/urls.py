@@ -1,5 +1,5 @@
 from django.urls import path, re_path
-from cart.views import CartAddView, CartInfoView, CartUpdateView, CartDeleteView
+from cart.views import CartAddView, CartInfoView, CartUpdateView, CartDeleteView, CartBatchView
 
 
 urlpatterns = [
@@ -7,4 +7,5 @@ urlpatterns = [
     path('', CartInfoView.as_view(), name='show'),  # 购物车页面显示
     path('update/', CartUpdateView.as_view(), name='update'),  # 购物车记录更新
     path('delete/', CartDeleteView.as_view(), name='delete'),  # 购物车记录删除
+    path('batch/', CartBatchView.as_view(), name='batch'),  # 购物车记录批量修改
 ]
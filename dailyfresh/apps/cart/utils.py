@@ -0,0 +1,364 @@
+import re
+from django_redis import get_redis_connection
+from utils.redis_batch import LazyResult, get_redis_batch
+from goods import sku_cache
+from cart import guest
+
+
+# 用户的购物车 hash cart_用户id {'商品id': 商品数量, ...}
+# 购物车中商品的总件数 string cart_total_用户id
+# 用户的浏览记录 list history_用户id [商品id, ...] 最新浏览的在左侧
+# 这些键都有过期时间，每次访问时延长(滑动过期)，长时间不访问的购物车由cart.archive归档到数据库
+# 商品id和数量都是小整数，购物车的条目数和浏览记录条数都远小于hash-max-listpack-entries(128)，redis使用紧凑的listpack编码
+HISTORY_COUNT = 5  # 只保存用户最新浏览的5条信息
+CART_TTL = 60 * 24 * 3600  # 购物车的过期时间(秒)
+HISTORY_TTL = 30 * 24 * 3600  # 浏览记录的过期时间(秒)
+BATCH_LIMIT = 100  # 批量修改购物车时一次最多的商品数目
+
+
+def cart_key(user_id):
+    return 'cart_%d' % user_id
+
+
+def cart_total_key(user_id):
+    return 'cart_total_%d' % user_id
+
+
+def history_key(user_id):
+    return 'history_%d' % user_id
+
+
+# 添加浏览记录并返回购物车中商品的条目数，同时延长浏览记录和购物车的过期时间，一次往返完成
+# KEYS[1]: cart_用户id KEYS[2]: history_用户id KEYS[3]: cart_total_用户id
+# ARGV[1]: 商品id ARGV[2]: 保存的浏览记录条数 ARGV[3]: 浏览记录的过期时间 ARGV[4]: 购物车的过期时间
+RECORD_VIEW_LUA = """
+redis.call('LREM', KEYS[2], 0, ARGV[1])
+redis.call('LPUSH', KEYS[2], ARGV[1])
+redis.call('LTRIM', KEYS[2], 0, tonumber(ARGV[2]) - 1)
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+if redis.call('EXPIRE', KEYS[1], ARGV[4]) == 1 then
+    redis.call('EXPIRE', KEYS[3], ARGV[4])
+end
+return redis.call('HLEN', KEYS[1])
+"""
+
+# 购物车的修改在redis中用lua脚本原子地执行，并发的修改不会丢失，一次往返同时返回商品条目数和总件数
+# 商品总件数保存在cart_total_用户id中，和购物车在同一个脚本里修改，读取时不需要遍历hash
+# KEYS[1]: cart_用户id KEYS[2]: cart_total_用户id
+# 返回 {是否成功(库存不足时为0), 商品条目数, 商品总件数}
+CART_TOTALS_LUA = ("local CART_TTL = %d\n" % CART_TTL) + """
+-- 总件数不存在时(旧的购物车)从hash中计算
+local function load_total(cart, total_key)
+    local total = redis.call('GET', total_key)
+    if total then
+        return tonumber(total)
+    end
+    total = 0
+    for _, count in ipairs(redis.call('HVALS', cart)) do
+        total = total + tonumber(count)
+    end
+    return total
+end
+
+-- 保存总件数并延长过期时间，购物车为空时一起删除
+local function result(ok, cart, total_key, total)
+    local lines = redis.call('HLEN', cart)
+    if lines == 0 then
+        redis.call('DEL', total_key)
+        total = 0
+    else
+        redis.call('SET', total_key, total, 'EX', CART_TTL)
+        redis.call('EXPIRE', cart, CART_TTL)
+    end
+    return {ok, lines, total}
+end
+"""
+
+# 添加: 在原有数量上累加 ARGV[1]: 商品id ARGV[2]: 数量 ARGV[3]: 库存上限(-1表示不检查)
+CART_ADD_LUA = CART_TOTALS_LUA + """
+local total = load_total(KEYS[1], KEYS[2])
+local old = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or 0)
+local count = old + tonumber(ARGV[2])
+local stock = tonumber(ARGV[3])
+local ok = 0
+if stock < 0 or count <= stock then
+    redis.call('HSET', KEYS[1], ARGV[1], count)
+    total = total + count - old
+    ok = 1
+end
+return result(ok, KEYS[1], KEYS[2], total)
+"""
+
+# 更新: 设置为新的数量 ARGV[1]: 商品id ARGV[2]: 数量 ARGV[3]: 库存上限(-1表示不检查)
+CART_UPDATE_LUA = CART_TOTALS_LUA + """
+local total = load_total(KEYS[1], KEYS[2])
+local old = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or 0)
+local count = tonumber(ARGV[2])
+local stock = tonumber(ARGV[3])
+local ok = 0
+if stock < 0 or count <= stock then
+    redis.call('HSET', KEYS[1], ARGV[1], count)
+    total = total + count - old
+    ok = 1
+end
+return result(ok, KEYS[1], KEYS[2], total)
+"""
+
+# 删除 ARGV: 商品id, ...
+CART_DELETE_LUA = CART_TOTALS_LUA + """
+local total = load_total(KEYS[1], KEYS[2])
+for i = 1, #ARGV do
+    local old = redis.call('HGET', KEYS[1], ARGV[i])
+    if old then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+        total = total - tonumber(old)
+    end
+end
+return result(1, KEYS[1], KEYS[2], total)
+"""
+
+# 批量修改 ARGV[1]: 'add'累加/'update'设置(数量为0时删除)/'merge'累加并截断到库存
+# 之后每三个一组: 商品id, 数量, 库存上限(-1表示不检查)
+# 返回 {1, 商品条目数, 商品总件数, 每一组是否成功, ...}，库存不足的组不修改，其他组照常修改
+CART_BATCH_LUA = CART_TOTALS_LUA + """
+local total = load_total(KEYS[1], KEYS[2])
+local mode = ARGV[1]
+local results = {}
+for i = 2, #ARGV, 3 do
+    local old = tonumber(redis.call('HGET', KEYS[1], ARGV[i]) or 0)
+    local count = tonumber(ARGV[i + 1])
+    local stock = tonumber(ARGV[i + 2])
+    if mode ~= 'update' then
+        count = old + count
+    end
+    if mode == 'merge' and stock >= 0 and count > stock then
+        -- 合并时超过库存的部分不加入，购物车中原有的数量不减少
+        count = math.max(stock, old)
+    end
+    local ok = 0
+    if stock < 0 or count <= stock then
+        if count > 0 then
+            redis.call('HSET', KEYS[1], ARGV[i], count)
+        else
+            redis.call('HDEL', KEYS[1], ARGV[i])
+            count = 0
+        end
+        total = total + count - old
+        ok = 1
+    end
+    results[#results + 1] = ok
+end
+local reply = result(1, KEYS[1], KEYS[2], total)
+for _, ok in ipairs(results) do
+    reply[#reply + 1] = ok
+end
+return reply
+"""
+
+# 修复: 从hash重新计算总件数，过期时间和购物车相同(修复不算访问，不延长过期时间)
+CART_REPAIR_LUA = """
+local total = 0
+for _, count in ipairs(redis.call('HVALS', KEYS[1])) do
+    total = total + tonumber(count)
+end
+local pttl = redis.call('PTTL', KEYS[1])
+if pttl == -2 then
+    redis.call('DEL', KEYS[2])
+elseif pttl > 0 then
+    redis.call('SET', KEYS[2], total, 'PX', pttl)
+else
+    redis.call('SET', KEYS[2], total)
+end
+return total
+"""
+
+_scripts = {}
+
+
+def get_script(source):
+    """注册lua脚本(只在本地计算sha1)，执行时使用EVALSHA，redis中没有缓存脚本时自动改用EVAL"""
+
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = get_redis_connection('default').register_script(source)
+    return script
+
+
+def get_cart_count(request):
+    """获取用户购物车中商品的条目数(购物车角标)，返回LazyResult"""
+
+    user = request.user
+    if not user.is_authenticated:
+        # 未登录时是cookie中购物车的条目数
+        return LazyResult.resolved(len(guest.load(request)))
+    batch = get_redis_batch(request)
+    touch_cart(batch, user.id)
+    return batch.hlen(cart_key(user.id))
+
+
+def touch_cart(pipe, user_id):
+    """在pipeline(或RedisBatch)中加入延长购物车过期时间的命令"""
+
+    pipe.expire(cart_key(user_id), CART_TTL)
+    pipe.expire(cart_total_key(user_id), CART_TTL)
+
+
+def record_view(request, sku_id):
+    """记录用户浏览了商品，同时返回购物车中商品的条目数(LazyResult)，未登录时是cookie中购物车的条目数(不记录浏览)"""
+
+    user = request.user
+    if not user.is_authenticated:
+        return LazyResult.resolved(len(guest.load(request)))
+    return get_redis_batch(request).eval(RECORD_VIEW_LUA, [cart_key(user.id), history_key(user.id), cart_total_key(user.id)],
+                                         [sku_id, HISTORY_COUNT, HISTORY_TTL, CART_TTL])
+
+
+def _run_cart_script(source, user_id, args):
+    return get_script(source)(keys=[cart_key(user_id), cart_total_key(user_id)], args=args)
+
+
+def cart_add(user_id, sku_id, count, stock=None):
+    """购物车中的商品数量增加count，超过库存stock时不修改
+
+    返回(是否成功, 商品条目数, 商品总件数)
+    """
+    ok, line_count, total_count = _run_cart_script(CART_ADD_LUA, user_id, [sku_id, count, -1 if stock is None else stock])
+    return bool(ok), line_count, total_count
+
+
+def cart_update(user_id, sku_id, count, stock=None):
+    """购物车中的商品数量设置为count，超过库存stock时不修改
+
+    返回(是否成功, 商品条目数, 商品总件数)
+    """
+    ok, line_count, total_count = _run_cart_script(CART_UPDATE_LUA, user_id, [sku_id, count, -1 if stock is None else stock])
+    return bool(ok), line_count, total_count
+
+
+def cart_delete(user_id, *sku_ids):
+    """删除购物车中的商品，返回(商品条目数, 商品总件数)"""
+    ok, line_count, total_count = _run_cart_script(CART_DELETE_LUA, user_id, list(sku_ids))
+    return line_count, total_count
+
+
+def parse_batch(sku_ids, counts, add=False):
+    """校验批量修改的参数，返回[(商品id, 数量), ...]，参数错误时返回None"""
+
+    if not sku_ids or len(sku_ids) != len(counts) or len(sku_ids) > BATCH_LIMIT:
+        return None
+    try:
+        lines = [(int(sku_id), int(count)) for sku_id, count in zip(sku_ids, counts)]
+    except (TypeError, ValueError):
+        return None
+    if any(count < 0 or (add and count == 0) for sku_id, count in lines):
+        return None
+    return lines
+
+
+def batch_lines(lines, skus, add=False):
+    """把要修改的行分为(交给脚本执行的行[(商品id, 数量, 库存)], 商品不存在的行号集合)
+
+    skus: {商品id: GoodsSKU}；设置数量为0(删除)时不要求商品存在，已经下架删除的商品也可以从购物车中删除
+    """
+
+    script_lines, missing = [], set()
+    for i, (sku_id, count) in enumerate(lines):
+        sku = skus.get(sku_id)
+        if sku is not None:
+            script_lines.append((sku_id, count, sku.stock))
+        elif not add and count == 0:
+            script_lines.append((sku_id, count, None))
+        else:
+            missing.add(i)
+    return script_lines, missing
+
+
+def batch_results(lines, missing, oks):
+    """组织每一行的结果"""
+
+    oks = iter(oks)
+    results = []
+    for i, (sku_id, count) in enumerate(lines):
+        if i in missing:
+            results.append({'sku_id': sku_id, 'res': 0, 'errmsg': '商品不存在'})
+        elif next(oks):
+            results.append({'sku_id': sku_id, 'res': 1})
+        else:
+            results.append({'sku_id': sku_id, 'res': 0, 'errmsg': '商品库存不足'})
+    return results
+
+
+def batch_args(lines, mode='update'):
+    """CART_BATCH_LUA的参数"""
+
+    args = [mode]
+    for sku_id, count, stock in lines:
+        args.extend([sku_id, count, -1 if stock is None else stock])
+    return args
+
+
+def cart_batch(user_id, lines, mode='update'):
+    """在一个脚本中修改购物车中的多件商品
+
+    lines: [(商品id, 数量, 库存上限或None), ...]
+    mode: 'update'设置数量(数量为0时删除)，'add'累加，'merge'累加并且超过库存的部分不加入
+    返回(每一行是否成功的列表, 商品条目数, 商品总件数)
+    """
+
+    result = _run_cart_script(CART_BATCH_LUA, user_id, batch_args(lines, mode))
+    return [bool(ok) for ok in result[3:]], result[1], result[2]
+
+
+def merge_guest_cart(request, user_id):
+    """登录时把cookie中的购物车合并到用户的购物车，返回合并的商品条目数
+
+    商品一次查询，所有商品在一个脚本中累加(一次往返)，耗时和cookie中的商品数目无关(最多GUEST_LIMIT个)
+    调用之后需要用guest.clear删除cookie
+    """
+
+    cart = guest.load(request)
+    if not cart:
+        return 0
+    # 已经下架删除的商品不合并
+    skus = sku_cache.get_many(cart)
+    lines = [(sku_id, count, skus[sku_id].stock) for sku_id, count in cart.items() if sku_id in skus]
+    if lines:
+        cart_batch(user_id, lines, 'merge')
+    return len(lines)
+
+
+def get_cart_totals(user_id):
+    """获取购物车的商品条目数和总件数(不遍历购物车)"""
+
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline(transaction=False)
+    pipe.hlen(cart_key(user_id))
+    pipe.get(cart_total_key(user_id))
+    line_count, total_count = pipe.execute()
+    if total_count is None:
+        # 旧的购物车还没有总件数
+        total_count = repair_cart_total(user_id) if line_count else 0
+    return line_count, int(total_count)
+
+
+def repair_cart_total(user_id):
+    """从购物车重新计算商品的总件数，返回总件数"""
+    return _run_cart_script(CART_REPAIR_LUA, user_id, [])
+
+
+def repair_cart_totals(user_id=None):
+    """重新计算所有(或指定用户)购物车的总件数，返回修复的购物车数目"""
+
+    if user_id is not None:
+        repair_cart_total(user_id)
+        return 1
+
+    conn = get_redis_connection('default')
+    count = 0
+    # cart_*也会匹配到cart_total_*，只处理购物车本身
+    for key in conn.scan_iter(match='cart_*', count=1000):
+        match = re.match(r'^cart_(\d+)$', key.decode())
+        if match:
+            repair_cart_total(int(match.group(1)))
+            count += 1
+    return count
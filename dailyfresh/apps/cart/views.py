@@ -3,6 +3,10 @@ from django.views.generic import View
 from django.http import JsonResponse
 
 from goods.models import GoodsSKU
+from goods.loaders import SKULoader
+from goods import sku_cache
+from cart import guest, archive
+from cart.utils import cart_add, cart_update, cart_delete, cart_batch, parse_batch, batch_lines, batch_results, get_cart_totals
 from django_redis import get_redis_connection
 from utils.mixin import LoginRequiredMixin
 from django.core.exceptions import ObjectDoesNotExist
@@ -25,9 +29,6 @@ class CartAddView(View):
         """购物车记录添加"""
 
         user = request.user
-        if not user.is_authenticated:
-            # 用户未登录
-            return JsonResponse({'res': 0, 'errmsg': '请先登录'})
 
         # 接收数据
         sku_id = request.POST.get('sku_id')
@@ -44,38 +45,43 @@ class CartAddView(View):
             # 数目出错
             return JsonResponse({'res': 2, 'errmsg': '商品数目出错'})
 
-        # 校验商品是否存在
-        try:
-            sku = GoodsSKU.objects.get(id=sku_id)
-        except ObjectDoesNotExist:
+        # 校验商品是否存在(库存用作购物车数量的上限，直接查询数据库，不使用热点商品缓存中可能过期的库存)
+        sku = sku_cache.get(sku_id, fresh=True)
+        if sku is None:
             # 商品不存在
             return JsonResponse({'res': 3, 'errmsg': '商品不存在'})
 
+        if not user.is_authenticated:
+            # 用户未登录，添加到cookie中的购物车，登录时合并
+            return guest_add(request, sku, count)
+
         # 业务处理:添加购物车记录
-        conn = get_redis_connection('default')
-        cart_key = 'cart_%d' % user.id
-        # 先尝试获取sku_id的值 -> hget cart_key 属性
-        # 如果sku_id在hash中不存在，hget返回None
-        cart_count = conn.hget(cart_key, sku_id)
-        if cart_count:
-            # 累加购物车中商品的数目
-            count += int(cart_count)
-
-        # 校验商品的库存
-        if count > sku.stock:
+        # 在redis中原子地累加购物车中商品的数目并校验库存，同时返回用户购物车商品的条目数(一次往返)
+        ok, total_count, total_quantity = cart_add(user.id, sku.id, count, sku.stock)
+        if not ok:
+            # 累加之后超过了商品的库存
             return JsonResponse({'res': 4, 'errmsg': '商品库存不足'})
 
-        # 设置hash中sku_id对应的值
-        # hset->如果sku_id已经存在，更新数据， 如果sku_id不存在，添加数据
-        conn.hset(cart_key, sku_id, count)
-
-        # 计算用户购物车商品的条目数
-        total_count = conn.hlen(cart_key)
-
         # 返回应答
         return JsonResponse({'res': 5, 'total_count': total_count, 'message': '添加成功'})
 
 
+def guest_add(request, sku, count):
+    """未登录时添加购物车记录，返回的条目数是cookie中购物车的条目数"""
+
+    if count <= 0:
+        return JsonResponse({'res': 2, 'errmsg': '商品数目出错'})
+    cart = guest.load(request)
+    if not guest.add(cart, sku.id, count, sku.stock):
+        if sku.id in cart or len(cart) < guest.GUEST_LIMIT:
+            return JsonResponse({'res': 4, 'errmsg': '商品库存不足'})
+        # cookie中的购物车已满
+        return JsonResponse({'res': 0, 'errmsg': '请先登录'})
+    response = JsonResponse({'res': 5, 'total_count': len(cart), 'message': '添加成功'})
+    guest.save(response, cart)
+    return response
+
+
 # /cart/
 class CartInfoView(LoginRequiredMixin, View):
     """购物车页面显示"""
@@ -85,20 +91,24 @@ class CartInfoView(LoginRequiredMixin, View):
 
         # 获取登录的用户
         user = request.user
-        # 获取用户购物车中商品的信息
-        conn = get_redis_connection('default')
-        cart_key = 'cart_%d' % user.id
+        # 获取用户购物车中商品的信息(同时延长过期时间，已经归档到数据库时先恢复)
         # {'商品id':商品数量, ...}
-        cart_dict = conn.hgetall(cart_key)
+        cart_dict = archive.load_cart(user.id)
 
         skus = []
         # 保存用户购物车中商品的总数目和总价格
         total_count = 0
         total_price = 0
+        # 一次查询出购物车中所有商品的信息
+        loader = SKULoader(cached=True)
+        items = [(loader.load(sku_id), count) for sku_id, count in cart_dict.items()]
+
         # 遍历获取商品的信息
-        for sku_id, count in cart_dict.items():
-            # 根据商品的id获取商品的信息
-            sku = GoodsSKU.objects.get(id=sku_id)
+        for sku, count in items:
+            sku = sku.value
+            if sku is None:
+                # 商品已经下架删除，不显示
+                continue
             # 计算商品的小计
             amount = sku.price * int(count)
             # 动态给sku对象增加一个属性amount, 保存商品的小计
@@ -132,7 +142,7 @@ class CartUpdateView(View):
         """购物车记录更新"""
 
         user = request.user
-        if not user.is_authenticated():
+        if not user.is_authenticated:
             # 用户未登录
             return JsonResponse({'res': 0, 'errmsg': '请先登录'})
 
@@ -151,30 +161,19 @@ class CartUpdateView(View):
             # 数目出错
             return JsonResponse({'res': 2, 'errmsg': '商品数目出错'})
 
-        # 校验商品是否存在
-        try:
-            sku = GoodsSKU.objects.get(id=sku_id)
-        except GoodsSKU.DoesNotExist:
+        # 校验商品是否存在(库存用作购物车数量的上限，直接查询数据库，不使用热点商品缓存中可能过期的库存)
+        sku = sku_cache.get(sku_id, fresh=True)
+        if sku is None:
             # 商品不存在
             return JsonResponse({'res': 3, 'errmsg': '商品不存在'})
 
         # 业务处理:更新购物车记录
-        conn = get_redis_connection('default')
-        cart_key = 'cart_%d' % user.id
-
-        # 校验商品的库存
-        if count > sku.stock:
+        # 在redis中原子地校验库存并更新，同时返回用户购物车中商品的总件数(一次往返)
+        ok, line_count, total_count = cart_update(user.id, sku.id, count, sku.stock)
+        if not ok:
+            # 校验商品的库存
             return JsonResponse({'res': 4, 'errmsg': '商品库存不足'})
 
-        # 更新
-        conn.hset(cart_key, sku_id, count)
-
-        # 计算用户购物车中商品的总件数 {'1':5, '2':3}
-        total_count = 0
-        vals = conn.hvals(cart_key)
-        for val in vals:
-            total_count += int(val)
-
         # 返回应答
         return JsonResponse({'res': 5, 'total_count': total_count, 'message': '更新成功'})
 
@@ -201,25 +200,52 @@ class CartDeleteView(View):
         if not sku_id:
             return JsonResponse({'res': 1, 'errmsg': '无效的商品id'})
 
-        # 校验商品是否存在
-        try:
-            sku = GoodsSKU.objects.get(id=sku_id)
-        except ObjectDoesNotExist:
+        # 校验商品是否存在(从热点商品缓存中读取)
+        sku = sku_cache.get(sku_id)
+        if sku is None:
             # 商品不存在
             return JsonResponse({'res': 2, 'errmsg': '商品不存在'})
 
-        # 业务处理:删除购物车记录
-        conn = get_redis_connection('default')
-        cart_key = 'cart_%d' % user.id
+        # 业务处理:删除购物车记录，同时返回用户购物车中商品的总件数(一次往返)
+        line_count, total_count = cart_delete(user.id, sku.id)
 
-        # 删除 hdel
-        conn.hdel(cart_key, sku_id)
+        # 返回应答
+        return JsonResponse({'res': 3, 'total_count': total_count, 'message': '删除成功'})
 
-        # 计算用户购物车中商品的总件数 {'1':5, '2':3}
-        total_count = 0
-        vals = conn.hvals(cart_key)
-        for val in vals:
-            total_count += int(val)
+
+# 批量修改购物车记录(再次购买、全选等一次修改多件商品)
+# 采用ajax post请求
+# 前端需要传递的参数:商品id(sku_id，多个) 商品数量(count，多个，和sku_id一一对应) 方式(mode: update设置数量，数量为0时删除；add累加，默认update)
+# /cart/batch/
+class CartBatchView(View):
+    """购物车记录批量修改"""
+
+    def post(self, request):
+        """购物车记录批量修改"""
+
+        user = request.user
+        if not user.is_authenticated:
+            # 用户未登录
+            return JsonResponse({'res': 0, 'errmsg': '请先登录'})
+
+        # 接收数据
+        add = request.POST.get('mode') == 'add'
+        lines = parse_batch(request.POST.getlist('sku_id'), request.POST.getlist('count'), add)
+
+        # 数据校验
+        if lines is None:
+            return JsonResponse({'res': 1, 'errmsg': '数据错误'})
+
+        # 一次查询出所有商品(库存用作购物车数量的上限，直接查询数据库)
+        skus = sku_cache.get_many([sku_id for sku_id, count in lines], fresh=True)
+        script_lines, missing = batch_lines(lines, skus, add)
+
+        # 业务处理:在一个脚本中修改所有商品，库存不足或商品不存在的行不修改，同时返回用户购物车的条目数和总件数(一次往返)
+        if script_lines:
+            oks, line_count, total_count = cart_batch(user.id, script_lines, 'add' if add else 'update')
+        else:
+            oks, (line_count, total_count) = [], get_cart_totals(user.id)
 
         # 返回应答
-        return JsonResponse({'res': 3, 'total_count': total_count, 'message': '删除成功'})
+        return JsonResponse({'res': 5, 'lines': batch_results(lines, missing, oks),
+                             'line_count': line_count, 'total_count': total_count, 'message': '修改成功'})
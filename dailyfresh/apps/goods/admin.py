@@ -1,6 +1,8 @@
 from django.contrib import admin
+from django.db import transaction
 from goods.models import GoodsType, IndexTypeGoodsBanner, IndexPromotionBanner, IndexGoodsBanner, GoodsSKU
-from django.core.cache import cache
+from goods.contexts import index_cache
+from utils.local_cache import local_cache
 
 
 class BaseModelAdmin(admin.ModelAdmin):
@@ -8,24 +10,28 @@ class BaseModelAdmin(admin.ModelAdmin):
         """新增或更新表中的数据时调用"""
 
         super().save_model(request, obj, form, change)
-
-        # 发出任务，让celery worker重新生成首页静态页
-        from celery_tasks.tasks import generate_static_index_html
-        generate_static_index_html.delay()
-
-        # 清除首页的缓存数据
-        cache.delete('index_page_data')
+        # admin在事务中调用save_model，提交之后再更新缓存和静态页，避免用提交之前的数据重新生成
+        transaction.on_commit(self.data_changed)
 
     def delete_model(self, request, obj):
         """删除表中的数据时调用"""
         
         super().delete_model(request, obj)
-        # 发出任务，让celery worker重新生成首页静态页
-        from celery_tasks.tasks import generate_static_index_html
+        transaction.on_commit(self.data_changed)
+
+    def data_changed(self):
+        """数据变化的事务提交之后调用"""
+
+        # 发出任务，让celery worker重新生成首页、详情页、列表页的静态页
+        from celery_tasks.tasks import generate_static_index_html, generate_static_pages
         generate_static_index_html.delay()
+        generate_static_pages.delay()
+
+        # 使首页的缓存数据失效
+        index_cache.invalidate()
 
-        # 清除首页的缓存数据
-        cache.delete('index_page_data')
+        # 通知所有进程删除进程内缓存的分类等数据(提交之前通知的话，其他进程会立即重新加载提交之前的数据)
+        local_cache.invalidate()
 
 
 @admin.register(GoodsType)
@@ -0,0 +1,8 @@
+from django.urls import path, re_path
+from goods.async_views import AsyncIndexView, AsyncDetailView, AsyncListView
+
+urlpatterns = [
+    path('index/', AsyncIndexView.as_view(), name='index'),
+    re_path(r'goods/(?P<goods_id>\d+)$', AsyncDetailView.as_view(), name='detail'),  # 商品详情页
+    re_path(r'list/(?P<type_id>\d+)/(?P<page>\d+)$', AsyncListView.as_view(), name='list'),  # 列表页
+]
@@ -0,0 +1,108 @@
+import asyncio
+from django.shortcuts import render, redirect
+from django.urls import reverse
+from django.views.generic import View
+from goods.models import GoodsSKU
+from goods import facets
+from goods.contexts import index_cache, detail_cache, get_goods_types, build_list_context
+from cart import guest
+from cart.utils import cart_key, cart_total_key, history_key, RECORD_VIEW_LUA, HISTORY_COUNT, HISTORY_TTL, CART_TTL, touch_cart
+from utils.async_utils import get_async_redis, run_sync, get_user
+
+
+# 首页、详情页、列表页的异步版本(ASGI部署时使用)
+# 数据库查询在线程池中执行，redis使用异步客户端，互不依赖的I/O用asyncio.gather并发执行
+
+
+async def get_cart_count(request, user):
+    """获取用户购物车中商品的数目"""
+
+    if user is None:
+        # 未登录时是cookie中购物车的条目数
+        return len(guest.load(request))
+    # 同时延长购物车的过期时间
+    async with get_async_redis().pipeline(transaction=False) as pipe:
+        touch_cart(pipe, user.id)
+        pipe.hlen(cart_key(user.id))
+        results = await pipe.execute()
+    return results[-1]
+
+
+# /async/index/
+class AsyncIndexView(View):
+    """首页(异步)"""
+
+    async def get(self, request):
+        """显示首页"""
+
+        # 同时获取首页数据和登录的用户
+        context, user = await asyncio.gather(run_sync(index_cache.get), get_user(request))
+
+        # 获取用户购物车中商品的数目
+        cart_count = await get_cart_count(request, user)
+
+        # 组织模板上下文
+        context.update(cart_count=cart_count)
+
+        # 使用模板
+        return await run_sync(render, request, 'index.html', context)
+
+
+# /async/goods/商品id
+class AsyncDetailView(View):
+    """详情页(异步)"""
+
+    async def get(self, request, goods_id):
+        """显示详情页"""
+
+        # 同时获取详情页数据、分类信息和登录的用户
+        try:
+            context, types, user = await asyncio.gather(run_sync(detail_cache.get, goods_id),
+                                                        run_sync(get_goods_types),
+                                                        get_user(request))
+        except GoodsSKU.DoesNotExist:
+            # 商品不存在则跳转回首页
+            return redirect(reverse('goods:index'))
+
+        if user is None:
+            # 未登录时是cookie中购物车的条目数
+            cart_count = len(guest.load(request))
+        else:
+            # 用户已登录: 添加用户的历史记录，同时获取购物车中商品的数目(一次redis往返)
+            conn = get_async_redis()
+            script = conn.register_script(RECORD_VIEW_LUA)
+            cart_count = await script(keys=[cart_key(user.id), history_key(user.id), cart_total_key(user.id)],
+                                      args=[goods_id, HISTORY_COUNT, HISTORY_TTL, CART_TTL])
+
+        # 组织模板上下文
+        context.update(types=types, cart_count=cart_count)
+
+        # 使用模板
+        return await run_sync(render, request, 'detail.html', context)
+
+
+# /async/list/种类id/页码?sort=排序方式
+class AsyncListView(View):
+    """列表页(异步)"""
+
+    async def get(self, request, type_id, page):
+        """显示列表页"""
+
+        # 同时获取列表页数据和登录的用户
+        context, user = await asyncio.gather(
+            run_sync(build_list_context, type_id, request.GET.get('sort'), page,
+                     after=request.GET.get('after'), before=request.GET.get('before'),
+                     filters=facets.parse_filters(request.GET)),
+            get_user(request))
+        if context is None:
+            # 种类不存在
+            return redirect(reverse('goods:index'))
+
+        # 获取用户购物车中商品的数目
+        cart_count = await get_cart_count(request, user)
+
+        # 组织模板上下文
+        context.update(cart_count=cart_count)
+
+        # 使用模板
+        return await run_sync(render, request, 'list.html', context)
@@ -0,0 +1,203 @@
+from utils.cache import VersionedCache
+from utils.local_cache import local_cache
+from django.core.cache import cache
+from urllib.parse import urlencode
+from utils.paginator import KeysetPaginator, KeysetPage
+from goods.models import GoodsType, GoodsSKU, IndexGoodsBanner, IndexPromotionBanner, IndexTypeGoodsBanner
+from goods import sku_index, facets
+from order.models import OrderGoods
+
+
+def get_goods_types():
+    """获取商品的分类信息(导航菜单)，保存在进程内缓存中，后台修改时通过redis通知所有进程删除"""
+    return local_cache.get_or_set('goods_types', lambda: list(GoodsType.objects.all()))
+
+
+def build_index_context():
+    """组织首页的模板上下文(首页视图和celery生成静态首页共用)
+
+    固定4条查询，不随商品种类的数量增长；返回的都是已经求值的列表，可以直接pickle存入缓存
+    """
+
+    # 获取商品的种类信息
+    types = list(GoodsType.objects.all())
+
+    # 获取首页轮播商品信息(模板中会用到banner.sku，一起查出来)
+    goods_banners = list(IndexGoodsBanner.objects.select_related('sku').order_by('index'))
+
+    # 获取首页促销活动信息
+    promotion_banners = list(IndexPromotionBanner.objects.all().order_by('index'))
+
+    # 获取首页分类商品展示信息:一次查出所有种类的展示商品，再按种类和展示类型分组
+    image_banners = {}
+    title_banners = {}
+    type_banners = IndexTypeGoodsBanner.objects.select_related('sku').order_by('index')
+    for banner in type_banners:
+        if banner.display_type == 1:
+            # 图片展示信息
+            image_banners.setdefault(banner.type_id, []).append(banner)
+        else:
+            # 文字展示信息
+            title_banners.setdefault(banner.type_id, []).append(banner)
+
+    # 动态给type增加属性，分别保存首页分类商品的图片展示信息和文字展示信息
+    for typ in types:  # GoodsType
+        typ.image_banners = image_banners.get(typ.id, [])
+        typ.title_banners = title_banners.get(typ.id, [])
+
+    # 组织模板上下文
+    context = {'types': types,
+               'goods_banners': goods_banners,
+               'promotion_banners': promotion_banners}
+
+    return context
+
+
+# 首页数据的缓存，有效时间1个小时；后台修改首页相关数据时调用index_cache.invalidate()
+index_cache = VersionedCache('index_page_data', build_index_context, timeout=3600)
+
+
+# 每次加载的评论条数
+COMMENTS_PER_PAGE = 10
+
+
+def get_comment_page(sku_id, after=None):
+    """按评论时间倒序获取商品的一页评论，after是上一页最后一条评论的游标(模板中会用到order.order.user)"""
+
+    comments = OrderGoods.objects.filter(sku_id=sku_id).exclude(comment='').select_related('order__user')
+    paginator = KeysetPaginator(comments, ('-create_time', '-id'), COMMENTS_PER_PAGE)
+    return paginator.page(1, after=after)
+
+
+def build_detail_context(goods_id):
+    """组织详情页中与用户无关的模板上下文(不包括分类菜单)，商品不存在时抛出GoodsSKU.DoesNotExist"""
+
+    sku = GoodsSKU.objects.select_related('type', 'goods').get(id=goods_id)
+
+    # 获取商品评论的第一页，后面的评论由页面通过ajax分页获取
+    sku_orders = get_comment_page(sku.id)
+
+    # 获取新品信息
+    new_skus = list(GoodsSKU.objects.filter(type=sku.type).order_by('-create_time')[:2])
+
+    # 获取同一个SPU的其他规格商品
+    same_spu_skus = list(GoodsSKU.objects.filter(goods=sku.goods).exclude(id=goods_id))
+
+    context = {'sku': sku,
+               'sku_orders': sku_orders,
+               'new_skus': new_skus,
+               'same_spu_skus': same_spu_skus}
+
+    return context
+
+
+# 详情页数据的缓存，按商品id保存，由goods.signals在商品、种类、评论变化时使其失效
+detail_cache = VersionedCache('detail_page_data', build_detail_context, timeout=24*3600, stale_timeout=7*24*3600)
+
+
+def build_list_context(type_id, sort, page, after=None, before=None, filters=None):
+    """组织列表页的模板上下文(不包括购物车数目)，种类不存在时返回None
+
+    sort: 排序方式 page: 页码 after/before: 键集分页的游标(点击下一页/上一页时传递)
+    filters: 分面过滤条件(见facets.parse_filters)
+    """
+
+    filters = filters or {}
+
+    # 获取商品的分类信息
+    types = get_goods_types()
+
+    # 获取种类信息
+    type = None
+    for typ in types:
+        if typ.id == int(type_id):
+            type = typ
+            break
+    if type is None:
+        # 种类不存在
+        return None
+
+    # 获取分类商品的信息
+    # sort=default 按照默认id排序
+    # sort=price 按照商品价格排序
+    # sort=hot 按照商品销量排序
+    # 排序字段的最后一个是id，保证排序唯一，才能用(排序字段, id)作为翻页的游标
+    # 对应的联合索引见GoodsSKU.Meta.indexes
+    if sort == 'price':
+        ordering = ('price', 'id')
+    elif sort == 'hot':
+        ordering = ('-sales', '-id')
+    else:
+        sort = 'default'
+        ordering = ('-id',)
+
+    # 获取第page页的内容(做一些容错处理)
+    try:
+        page = int(page)
+    except Exception as e:
+        page = 1
+
+    # 优先从redis中种类商品的有序集合里取出满足过滤条件的第page页的商品id和各个过滤选项的数目，再一次查询出商品
+    result = facets.list_page(type.id, sort, filters, page, 1)
+    if result is not None and not result[0] and page > 1:
+        # 页码超出范围
+        page = 1
+        result = facets.list_page(type.id, sort, filters, page, 1)
+
+    facet_counts = None
+    if result is not None:
+        sku_ids, count, facet_counts = result
+        skus = sku_index.hydrate(sku_ids)
+        num_pages = max(count, 1)  # 每页1件商品
+        skus_page = KeysetPage(skus, page, page < num_pages, ordering)
+    else:
+        # 索引还没有建立，从数据库中查询(不显示过滤选项的数目)
+        skus = facets.filter_queryset(GoodsSKU.objects.filter(type=type), filters)
+
+        # 种类商品的数目只用来显示页码，使用缓存的近似值，避免每次翻页都COUNT(*)
+        count_key = 'list_sku_count_%d' % type.id
+        if filters:
+            count_key += '_' + urlencode(sorted(filters.items()))
+        count = cache.get_or_set(count_key, skus.count, 600)
+
+        # 对数据进行分页(每页显示1件商品)
+        # 点击上一页/下一页时根据游标(after/before)直接定位，不使用OFFSET
+        paginator = KeysetPaginator(skus, ordering, 1, count)
+
+        # 获取第page页的Page实例对象
+        skus_page = paginator.page(page, after=after, before=before)
+        if not skus_page.object_list and page > 1:
+            # 页码超出范围
+            page = 1
+            skus_page = paginator.page(page)
+        num_pages = paginator.num_pages
+
+    # todo: 进行页码的控制，页面上最多显示5个页码
+    # 1.总页数小于5页，页面上显示所有页码
+    # 2.如果当前页是前3页，显示1-5页
+    # 3.如果当前页是后3页，显示后5页
+    # 4.其他情况，显示当前页的前2页，当前页，当前页的后2页
+    if num_pages < 5:
+        pages = range(1, num_pages + 1)
+    elif page <= 3:
+        pages = range(1, 6)
+    elif num_pages - page <= 2:
+        pages = range(num_pages - 4, num_pages + 1)
+    else:
+        pages = range(page - 2, page + 3)
+
+    # 获取新品信息
+    new_skus = sku_index.new_skus(type.id, 2)
+    if new_skus is None:
+        new_skus = GoodsSKU.objects.filter(type=type).order_by('-create_time')[:2]
+
+    # 组织模板上下文
+    context = {'type': type, 'types': types,
+               'skus_page': skus_page,
+               'new_skus': new_skus,
+               'pages': pages,
+               'sort': sort,
+               'facets': facets.build_facets(facet_counts, filters) if facet_counts else None,
+               'filter_query': urlencode(filters)}
+
+    return context
@@ -0,0 +1,212 @@
+import uuid
+import hashlib
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from goods import sku_index, search_cache
+from goods.sku_index import PRICE_BUCKETS, STOCK_KEY, index_key, price_key
+
+
+# 分面过滤: 按种类、价格区间、是否有库存过滤列表页和搜索结果，并显示每个选项的商品数目
+# 过滤条件和计数都是redis中预先维护的商品id集合(见sku_index)的交集，一个请求一次往返，不需要COUNT ... GROUP BY
+# 某个维度的计数使用其他维度的过滤条件，例如选择了"有货"之后，价格区间显示的是有货商品的数目
+# 查询参数: type=种类id price=价格区间序号 stock=1
+# 列表页的计数按(种类, 过滤条件)、搜索结果的计数按(规范化的搜索词, 过滤条件)缓存FACET_TIMEOUT秒，
+# 库存、价格变化之后计数最多延迟这么久
+FACET_TIMEOUT = 60
+
+
+def parse_filters(params, with_type=False):
+    """从查询参数中获取过滤条件，非法的参数忽略"""
+
+    filters = {}
+    if with_type:
+        try:
+            filters['type'] = int(params.get('type'))
+        except (TypeError, ValueError):
+            pass
+    try:
+        bucket = int(params.get('price'))
+        if 0 <= bucket < len(PRICE_BUCKETS):
+            filters['price'] = bucket
+    except (TypeError, ValueError):
+        pass
+    if params.get('stock') == '1':
+        filters['stock'] = 1
+    return filters
+
+
+def filter_keys(filters, exclude=None):
+    """过滤条件对应的集合，exclude: 不使用的维度"""
+
+    keys = []
+    if 'type' in filters and exclude != 'type':
+        keys.append(index_key('new', filters['type']))
+    if 'price' in filters and exclude != 'price':
+        keys.append(price_key(filters['price']))
+    if 'stock' in filters and exclude != 'stock':
+        keys.append(STOCK_KEY)
+    return keys
+
+
+def filter_queryset(skus, filters):
+    """数据库中的过滤(redis索引还没有建立时使用)"""
+
+    if 'type' in filters:
+        skus = skus.filter(type_id=filters['type'])
+    if 'price' in filters:
+        low, high = PRICE_BUCKETS[filters['price']]
+        skus = skus.filter(price__gte=low)
+        if high is not None:
+            skus = skus.filter(price__lt=high)
+    if 'stock' in filters:
+        skus = skus.filter(stock__gt=0)
+    return skus
+
+
+def tmp_key():
+    return 'goods_facet_tmp_%s' % uuid.uuid4().hex
+
+
+def queue_counts(pipe, tmp, base_keys, filters, type_ids=()):
+    """在pipeline中加入计数命令(ZINTERSTORE返回交集的元素个数)，返回加入的命令数"""
+
+    for type_id in type_ids:
+        pipe.zinterstore(tmp, base_keys + filter_keys(filters, 'type') + [index_key('new', type_id)])
+    for bucket in range(len(PRICE_BUCKETS)):
+        pipe.zinterstore(tmp, base_keys + filter_keys(filters, 'price') + [price_key(bucket)])
+    pipe.zinterstore(tmp, base_keys + filter_keys(filters, 'stock') + [STOCK_KEY])
+    return len(type_ids) + len(PRICE_BUCKETS) + 1
+
+
+def parse_counts(results, type_ids=()):
+    """把queue_counts的结果整理成{'type': {种类id: 数目}, 'price': [数目, ...], 'stock': 数目}"""
+
+    n_types = len(type_ids)
+    return {'type': dict(zip(type_ids, results[:n_types])),
+            'price': results[n_types:n_types + len(PRICE_BUCKETS)],
+            'stock': results[n_types + len(PRICE_BUCKETS)]}
+
+
+def list_page(type_id, sort, filters, number, per_page):
+    """获取种类中满足过滤条件的第number页商品和各个选项的数目
+
+    返回(商品id列表, 满足条件的商品总数, 计数)；种类的索引不存在时返回None
+    计数有缓存时不再执行每个选项的ZINTERSTORE
+    """
+
+    type_key = index_key('new', type_id)
+    if sort == 'price':
+        sort_key = index_key('price', type_id)
+    elif sort == 'hot':
+        sort_key = index_key('sales', type_id)
+    else:
+        sort_key = type_key
+    start = (number - 1) * per_page
+    end = start + per_page - 1
+
+    counts_key = 'list_facets_%d_%s' % (type_id, urlencode(sorted(filters.items())))
+    counts = cache.get(counts_key)
+
+    conn = get_redis_connection('default')
+    tmp, count_tmp = tmp_key(), tmp_key()
+    pipe = conn.pipeline(transaction=False)
+    pipe.zcard(type_key)
+    # 过滤条件的集合权重为0，交集中的分数还是排序的分数
+    weights = {sort_key: 1}
+    weights.update({key: 0 for key in filter_keys(filters)})
+    pipe.zinterstore(tmp, weights)
+    if sort == 'price':
+        pipe.zrange(tmp, start, end)
+    else:
+        pipe.zrevrange(tmp, start, end)
+    if counts is None:
+        queue_counts(pipe, count_tmp, [type_key], filters)
+    pipe.delete(tmp, count_tmp)
+    results = pipe.execute()
+
+    if not results[0]:
+        return None
+    if counts is None:
+        counts = parse_counts(results[3:-1])
+        cache.set(counts_key, counts, FACET_TIMEOUT)
+    return results[2], results[1], counts
+
+
+def search(sku_ids, filters, type_ids):
+    """过滤搜索结果并计数，返回(满足条件的商品id列表(保持搜索结果的顺序), 计数)"""
+
+    if not sku_ids:
+        return [], parse_counts([0] * (len(type_ids) + len(PRICE_BUCKETS) + 1), type_ids)
+
+    conn = get_redis_connection('default')
+    base, tmp, count_tmp = tmp_key(), tmp_key(), tmp_key()
+    pipe = conn.pipeline(transaction=False)
+    pipe.sadd(base, *sku_ids)
+    pipe.expire(base, 60)
+    pipe.zinterstore(tmp, [base] + filter_keys(filters))
+    pipe.zrange(tmp, 0, -1)
+    queue_counts(pipe, count_tmp, [base], filters, type_ids)
+    pipe.delete(base, tmp, count_tmp)
+    results = pipe.execute()
+
+    matched = {int(sku_id) for sku_id in results[3]}
+    return [sku_id for sku_id in sku_ids if sku_id in matched], parse_counts(results[4:-1], type_ids)
+
+
+def search_cached(query, filters, type_ids):
+    """过滤搜索结果并计数(有缓存)
+
+    返回(满足条件的商品id列表, 满足条件的商品总数, 计数, 是否只统计了前MAX_RESULTS条结果)；
+    id列表和计数来自同一次搜索(search_cache.search_all)，没有过滤条件时前MAX_RESULTS条结果的分页也使用这个列表，
+    总数是搜索结果的总数(可能多于列表中的id)
+    """
+
+    normalized = search_cache.normalize(query)
+    if not normalized:
+        return [], 0, parse_counts([0] * (len(type_ids) + len(PRICE_BUCKETS) + 1), type_ids), False
+
+    digest = hashlib.md5(('%s?%s' % (normalized, urlencode(sorted(filters.items())))).encode()).hexdigest()
+    key = 'search_counts_%d_%s' % (search_cache.get_generation(), digest)
+    result = cache.get(key)
+    if result is None:
+        all_ids, total = search_cache.search_all(query)
+        sku_ids, counts = search(all_ids, filters, type_ids)
+        result = (sku_ids, len(sku_ids) if filters else total, counts, total > len(all_ids))
+        cache.set(key, result, FACET_TIMEOUT)
+    return result
+
+
+def price_label(bucket):
+    low, high = PRICE_BUCKETS[bucket]
+    if high is None:
+        return '%d元以上' % low
+    if not low:
+        return '%d元以下' % high
+    return '%d-%d元' % (low, high)
+
+
+def toggle(filters, name, value):
+    """点击一个选项之后的查询参数: 已经选中时取消，否则选中"""
+
+    filters = dict(filters)
+    if filters.get(name) == value:
+        del filters[name]
+    else:
+        filters[name] = value
+    return urlencode(filters)
+
+
+def build_facets(counts, filters, types=()):
+    """组织模板中显示的过滤选项"""
+
+    return {
+        'types': [{'name': typ.name, 'count': counts['type'].get(typ.id, 0),
+                   'selected': filters.get('type') == typ.id, 'query': toggle(filters, 'type', typ.id)}
+                  for typ in types],
+        'prices': [{'name': price_label(bucket), 'count': count,
+                    'selected': filters.get('price') == bucket, 'query': toggle(filters, 'price', bucket)}
+                   for bucket, count in enumerate(counts['price'])],
+        'stock': {'name': '仅显示有货', 'count': counts['stock'],
+                  'selected': 'stock' in filters, 'query': toggle(filters, 'stock', 1)},
+    }
@@ -0,0 +1,47 @@
+from goods.models import GoodsSKU
+from goods import sku_cache
+from utils.redis_batch import LazyResult
+
+
+class SKULoader(object):
+    """商品批量加载器
+
+    load()只记录商品id并返回LazyResult，第一次读取结果时把记录的所有id用一条id__in查询一起查出，
+    查询过的商品会缓存在加载器中；商品不存在时结果为None，不会抛出DoesNotExist
+    cached=True时从热点商品缓存中读取(只加载了sku_cache.FIELDS中的字段)
+    """
+
+    def __init__(self, related=(), cached=False):
+        self.related = related  # 模板中需要的关联对象，例如('type', 'goods')
+        self.cached = cached
+        self.pending = {}  # {商品id: LazyResult}
+        self.loaded = {}  # {商品id: LazyResult}
+
+    def load(self, sku_id):
+        """记录要查询的商品id，返回LazyResult"""
+
+        sku_id = int(sku_id)
+        result = self.loaded.get(sku_id) or self.pending.get(sku_id)
+        if result is None:
+            result = self.pending[sku_id] = LazyResult(self)
+        return result
+
+    def load_many(self, sku_ids):
+        """查询多个商品，保持id的顺序，跳过不存在的商品"""
+
+        results = [self.load(sku_id) for sku_id in sku_ids]
+        return [result.value for result in results if result.value is not None]
+
+    def flush(self):
+        """一次查询出所有记录的商品"""
+
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        if self.cached:
+            skus = sku_cache.get_many(list(pending))
+        else:
+            skus = GoodsSKU.objects.select_related(*self.related).in_bulk(list(pending))
+        for sku_id, result in pending.items():
+            result._value = skus.get(sku_id)
+        self.loaded.update(pending)
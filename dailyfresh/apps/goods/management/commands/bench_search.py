@@ -0,0 +1,57 @@
+import time
+from django.core.management.base import BaseCommand
+from haystack.query import SearchQuerySet
+from goods.models import GoodsSKU
+
+
+class Command(BaseCommand):
+    """对比whoosh索引和内存倒排索引的搜索性能
+
+    先生成两个索引: python manage.py rebuild_search_index; python manage.py rebuild_search_index --using memory
+    再执行: python manage.py bench_search [--queries 草莓 葡萄] [--repeat 100]
+    """
+
+    help = '压测whoosh_cn_backend和内存倒排索引，输出p50/p99延迟、每秒查询数和前10条结果的重合率'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', nargs='+', help='搜索词，默认使用前20件商品的名称')
+        parser.add_argument('--repeat', type=int, default=100, help='每个搜索词的查询次数')
+        parser.add_argument('--using', nargs='+', default=['default', 'memory'], help='对比的索引')
+
+    def search(self, using, query):
+        """搜索并取出第一页，返回商品id列表"""
+        return [result.pk for result in SearchQuerySet(using=using).models(GoodsSKU).auto_query(query)[:10]]
+
+    def handle(self, *args, **options):
+        queries = options['queries'] or list(GoodsSKU.objects.order_by('id').values_list('name', flat=True)[:20])
+        repeat = options['repeat']
+
+        results = {}
+        self.stdout.write('%-10s %10s %10s %10s' % ('backend', 'p50(ms)', 'p99(ms)', 'query/s'))
+        for using in options['using']:
+            # 预热(加载索引文件/映射快照)
+            results[using] = {query: self.search(using, query) for query in queries}
+
+            latencies = []
+            start = time.perf_counter()
+            for i in range(repeat):
+                for query in queries:
+                    query_start = time.perf_counter()
+                    self.search(using, query)
+                    latencies.append(time.perf_counter() - query_start)
+            elapsed = time.perf_counter() - start
+
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            self.stdout.write('%-10s %10.2f %10.2f %10.1f' % (using, p50, p99, len(latencies) / elapsed))
+
+        # 相关度排序不同，只比较前10条结果的集合
+        base, others = options['using'][0], options['using'][1:]
+        for using in others:
+            same = total = 0
+            for query in queries:
+                expected, actual = set(results[base][query]), set(results[using][query])
+                same += len(expected & actual)
+                total += len(expected | actual)
+            self.stdout.write('%s与%s前10条结果的重合率: %.1f%%' % (using, base, same / total * 100 if total else 100))
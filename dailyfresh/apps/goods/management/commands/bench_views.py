@@ -0,0 +1,64 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """对比同步视图(wsgi)和异步视图(asgi)在并发请求下的延迟和吞吐量
+
+    先分别启动两个服务，例如:
+    uwsgi --http 127.0.0.1:8000 --wsgi-file dailyfresh/wsgi.py --processes 4 --threads 2
+    uvicorn dailyfresh.asgi:application --port 8001 --workers 4
+    再执行: python manage.py bench_views --wsgi http://127.0.0.1:8000 --asgi http://127.0.0.1:8001
+    """
+
+    help = '压测首页、详情页、列表页的wsgi同步版本和asgi异步版本，输出p50/p99延迟和每秒请求数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi', default='http://127.0.0.1:8000', help='wsgi服务的地址')
+        parser.add_argument('--asgi', default='http://127.0.0.1:8001', help='asgi服务的地址')
+        parser.add_argument('--paths', nargs='+', default=['/index/', '/goods/1', '/list/1/1'],
+                            help='压测的页面，asgi服务访问/async前缀下的异步版本')
+        parser.add_argument('--concurrency', type=int, default=50, help='并发数')
+        parser.add_argument('--requests', type=int, default=1000, help='每个页面的请求数')
+        parser.add_argument('--sessionid', default='', help='登录用户的sessionid(测试购物车数目和浏览记录)')
+
+    def bench(self, url, concurrency, total, sessionid):
+        """并发请求url，返回(每个请求的延迟列表, 总耗时, 失败次数)"""
+
+        local = threading.local()
+        errors = []
+
+        def fetch(i):
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+                if sessionid:
+                    session.cookies.set('sessionid', sessionid)
+            start = time.perf_counter()
+            try:
+                response = session.get(url, allow_redirects=False)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+            except requests.RequestException as e:
+                errors.append(e)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            latencies = list(executor.map(fetch, range(total)))
+        return latencies, time.perf_counter() - start, len(errors)
+
+    def handle(self, *args, **options):
+        self.stdout.write('%-8s %-24s %10s %10s %10s %8s' % ('server', 'path', 'p50(ms)', 'p99(ms)', 'req/s', 'errors'))
+        for path in options['paths']:
+            for server, url in (('wsgi', options['wsgi'] + path), ('asgi', options['asgi'] + '/async' + path)):
+                latencies, elapsed, errors = self.bench(url, options['concurrency'], options['requests'],
+                                                        options['sessionid'])
+                latencies.sort()
+                p50 = latencies[len(latencies) // 2] * 1000
+                p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+                self.stdout.write('%-8s %-24s %10.1f %10.1f %10.1f %8d' % (
+                    server, path, p50, p99, len(latencies) / elapsed, errors))
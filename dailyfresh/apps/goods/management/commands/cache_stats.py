@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from goods.contexts import index_cache, detail_cache
+from goods import search_cache
+
+
+class Command(BaseCommand):
+    """查看页面缓存的命中情况: python manage.py cache_stats"""
+
+    help = '显示页面缓存的命中/旧数据/未命中/重新生成次数和搜索结果缓存的命中率'
+
+    def handle(self, *args, **options):
+        for page_cache in [index_cache, detail_cache]:
+            stats = page_cache.stats()
+            total = stats['hit'] + stats['stale'] + stats['miss']
+            hit_rate = stats['hit'] / total if total else 0
+            self.stdout.write('%s: hit=%d stale=%d miss=%d rebuild=%d hit_rate=%.2f%%' % (
+                page_cache.name, stats['hit'], stats['stale'], stats['miss'], stats['rebuild'], hit_rate * 100))
+
+        stats = search_cache.stats()
+        total = stats['hit'] + stats['miss']
+        hit_rate = stats['hit'] / total if total else 0
+        self.stdout.write('search_cache: hit=%d miss=%d hit_rate=%.2f%%' % (stats['hit'], stats['miss'], hit_rate * 100))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from goods import static_pages
+
+
+class Command(BaseCommand):
+    """生成详情页和列表页的静态页面: python manage.py generate_static_pages [--full] [--workers 4]"""
+
+    help = '增量生成详情页和列表页的静态页面，只重新生成上次生成之后有修改的商品和种类'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='全部重新生成')
+        parser.add_argument('--workers', type=int, default=4, help='进程池的进程数目')
+        parser.add_argument('--list-pages', type=int, default=1, help='每个种类生成列表页的前几页')
+
+    def handle(self, *args, **options):
+        count = static_pages.generate_static_pages(full=options['full'], workers=options['workers'],
+                                                   list_pages=options['list_pages'])
+        self.stdout.write('已生成%d个页面' % count)
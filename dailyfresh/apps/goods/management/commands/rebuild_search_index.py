@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from goods import search_rebuild
+
+
+class Command(BaseCommand):
+    """重建商品的全文检索索引: python manage.py rebuild_search_index [--workers 4] [--chunk-size 1000] [--using memory]"""
+
+    help = '按主键分块读取商品，多进程分词，全部重建whoosh索引并输出每秒处理的文档数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='分词的进程数目')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='每次查询的商品数目')
+        parser.add_argument('--limitmb', type=int, default=128, help='每个进程的内存缓冲区大小(MB)')
+        parser.add_argument('--using', default='default', help='HAYSTACK_CONNECTIONS中的索引(memory为内存倒排索引)')
+
+    def handle(self, *args, **options):
+        def progress(count, seconds):
+            self.stdout.write('已处理%d件商品 %.0f docs/sec' % (count, count / seconds if seconds else 0))
+
+        count, seconds = search_rebuild.rebuild(workers=options['workers'], chunk_size=options['chunk_size'],
+                                                limitmb=options['limitmb'], progress=progress,
+                                                using=options['using'])
+        self.stdout.write('已重建%d件商品的索引，用时%.1f秒，%.0f docs/sec' % (count, seconds, count / seconds if seconds else 0))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from goods import sku_index
+
+
+class Command(BaseCommand):
+    """重建redis中种类商品的排序索引: python manage.py rebuild_sku_index [--type 种类id]"""
+
+    help = '从数据库重建列表页使用的种类商品有序集合(价格/销量/新品)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', type=int, dest='type_id', help='只重建指定种类的索引')
+
+    def handle(self, *args, **options):
+        total = sku_index.rebuild(options['type_id'])
+        self.stdout.write('已重建%d件商品的索引' % total)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from goods import suggest
+
+
+class Command(BaseCommand):
+    """重建搜索框的输入提示词: python manage.py rebuild_suggest"""
+
+    help = '从数据库重建商品和SPU名称的搜索提示词(热门搜索词不变)'
+
+    def handle(self, *args, **options):
+        count = suggest.rebuild()
+        self.stdout.write('已重建%d个提示词' % count)
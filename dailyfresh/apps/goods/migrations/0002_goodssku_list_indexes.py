@@ -0,0 +1,21 @@
+# Generated by Django 4.0 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='goodssku',
+            index=models.Index(fields=['type', 'price', 'id'], name='df_goods_sku_type_price'),
+        ),
+        migrations.AddIndex(
+            model_name='goodssku',
+            index=models.Index(fields=['type', 'sales', 'id'], name='df_goods_sku_type_sales'),
+        ),
+    ]
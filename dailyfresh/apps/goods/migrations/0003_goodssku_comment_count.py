@@ -0,0 +1,29 @@
+# Generated by Django 4.0 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+def count_comments(apps, schema_editor):
+    """统计已有的评论数目"""
+    GoodsSKU = apps.get_model('goods', 'GoodsSKU')
+    OrderGoods = apps.get_model('order', 'OrderGoods')
+    counts = OrderGoods.objects.exclude(comment='').values('sku_id').annotate(count=models.Count('id'))
+    for item in counts:
+        GoodsSKU.objects.filter(id=item['sku_id']).update(comment_count=item['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0002_goodssku_list_indexes'),
+        ('order', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='goodssku',
+            name='comment_count',
+            field=models.IntegerField(default=0, verbose_name='评论数目'),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
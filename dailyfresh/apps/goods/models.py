@@ -40,11 +40,17 @@ class GoodsSKU(BaseModel):
     stock = models.IntegerField(default=1, verbose_name='商品库存')
     sales = models.IntegerField(default=0, verbose_name='商品销量')
     status = models.SmallIntegerField(default=1, choices=status_choices, verbose_name='商品状态')
+    comment_count = models.IntegerField(default=0, verbose_name='评论数目')
 
     class Meta:
         db_table = 'df_goods_sku'
         verbose_name = '商品'
         verbose_name_plural = verbose_name
+        # 列表页按(排序字段, id)键集分页使用的联合索引，按id排序直接使用type的外键索引
+        indexes = [
+            models.Index(fields=['type', 'price', 'id'], name='df_goods_sku_type_price'),
+            models.Index(fields=['type', 'sales', 'id'], name='df_goods_sku_type_sales'),
+        ]
 
     def __str__(self):
         return self.name
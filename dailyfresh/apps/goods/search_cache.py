@@ -0,0 +1,104 @@
+import re
+import hashlib
+import jieba
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from haystack.query import SearchQuerySet
+from goods.models import GoodsSKU
+
+
+# 搜索结果缓存
+# 缓存的键由规范化之后的搜索词和页码组成，只保存这一页商品的id和结果总数
+# string search_index_generation 索引的版本号，每次索引提交之后加1，旧版本的缓存不会再被读取，等待过期
+# hash search_cache:stats {'hit': 命中次数, 'miss': 未命中次数}
+GENERATION_KEY = 'search_index_generation'
+STATS_KEY = 'search_cache:stats'
+TIMEOUT = 600
+MAX_RESULTS = 1000  # 分面过滤最多使用的搜索结果数目
+
+# 不参与搜索的词
+STOP_WORDS = {'的', '了', '和', '与', '及', '或', '在', '是', '有', '个', '把', '被', '之',
+              'a', 'an', 'the', 'and', 'or', 'of', 'to', 'in', 'for'}
+
+
+def normalize(query):
+    """规范化搜索词: 分词，转成小写，去掉停用词和标点，去重排序
+
+    "新鲜的草莓 " 和 "草莓 新鲜" 的结果相同，使用同一个缓存
+    """
+
+    tokens = set()
+    for token in jieba.lcut(query.lower()):
+        token = token.strip()
+        if token and token not in STOP_WORDS and re.search(r'\w', token):
+            tokens.add(token)
+    return ' '.join(sorted(tokens))
+
+
+def get_generation():
+    return int(get_redis_connection('default').get(GENERATION_KEY) or 0)
+
+
+def bump_generation():
+    """索引提交之后调用，使所有搜索结果缓存失效"""
+    get_redis_connection('default').incr(GENERATION_KEY)
+
+
+def incr_stat(field):
+    get_redis_connection('default').hincrby(STATS_KEY, field, 1)
+
+
+def stats():
+    """返回缓存的命中次数和未命中次数"""
+
+    stats = {'hit': 0, 'miss': 0}
+    for field, value in get_redis_connection('default').hgetall(STATS_KEY).items():
+        stats[field.decode()] = int(value)
+    return stats
+
+
+def search_all(query):
+    """搜索商品，返回(按相关度排序的前MAX_RESULTS件商品的id, 结果总数)(分面过滤和前MAX_RESULTS条结果的分页使用)"""
+
+    normalized = normalize(query)
+    if not normalized:
+        return [], 0
+
+    digest = hashlib.md5(normalized.encode()).hexdigest()
+    key = 'search_ids_%d_%s' % (get_generation(), digest)
+    result = cache.get(key)
+    if result is not None:
+        incr_stat('hit')
+        return result
+
+    incr_stat('miss')
+    sqs = SearchQuerySet().models(GoodsSKU).auto_query(normalized)
+    sku_ids = [int(item.pk) for item in sqs[:MAX_RESULTS]]
+    result = (sku_ids, sqs.count())
+    cache.set(key, result, TIMEOUT)
+    return result
+
+
+def search(query, number, per_page):
+    """搜索商品，返回(这一页商品的id列表, 结果总数)，number从1开始"""
+
+    if number < 1:
+        raise ValueError('页码从1开始: %r' % number)
+    normalized = normalize(query)
+    if not normalized:
+        return [], 0
+
+    digest = hashlib.md5(normalized.encode()).hexdigest()
+    key = 'search_%d_%s_%d_%d' % (get_generation(), digest, per_page, number)
+    result = cache.get(key)
+    if result is not None:
+        incr_stat('hit')
+        return result
+
+    incr_stat('miss')
+    sqs = SearchQuerySet().models(GoodsSKU).auto_query(normalized)
+    start = (number - 1) * per_page
+    sku_ids = [int(item.pk) for item in sqs[start:start + per_page]]
+    result = (sku_ids, sqs.count())
+    cache.set(key, result, TIMEOUT)
+    return result
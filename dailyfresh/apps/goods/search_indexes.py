@@ -14,6 +14,6 @@ class GoodsSKUIndex(indexes.SearchIndex, indexes.Indexable):
         # 返回你的模型类
         return GoodsSKU
 
-    # 建立索引的数据
+    # 建立索引的数据(模板中使用了object.goods.detail，同时查出SPU，避免每件商品再查询一次)
     def index_queryset(self, using=None):
-        return self.get_model().objects.all()
+        return self.get_model().objects.select_related('goods')
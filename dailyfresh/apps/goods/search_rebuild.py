@@ -0,0 +1,86 @@
+import time
+from haystack import connections
+from haystack.constants import DJANGO_CT, DJANGO_ID
+from haystack.exceptions import SkipDocument
+from goods.models import GoodsSKU
+from goods import search_cache
+from utils.memory_search_backend import MemorySearchBackend
+
+
+def iter_chunks(queryset, chunk_size=1000):
+    """按主键分块遍历查询集(where id > 上一块的最大id limit chunk_size)，不会一次把整张表读入内存"""
+
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def rebuild(workers=4, chunk_size=1000, limitmb=128, progress=None, using='default'):
+    """全部重建商品的全文检索索引，返回(文档数目, 用时秒数)
+
+    商品按主键分块查询(每块一次查询，select_related同时查出SPU的详情)，
+    whoosh的writer(procs=workers)在多个进程中分词(jieba)并各自写入临时段，提交时只合并一次
+    progress(文档数目, 用时秒数)在每一块写入之后调用
+    """
+
+    backend = connections[using].get_backend()
+    index = connections[using].get_unified_index().get_index(GoodsSKU)
+
+    if isinstance(backend, MemorySearchBackend):
+        return rebuild_snapshot(backend, index, chunk_size, progress)
+
+    # 删除旧的索引，重新创建空的索引
+    backend.clear()
+    backend.setup()
+
+    start = time.time()
+    count = 0
+    writer = backend.index.writer(procs=workers, limitmb=limitmb, multisegment=False)
+    try:
+        for chunk in iter_chunks(index.index_queryset(), chunk_size):
+            for obj in chunk:
+                try:
+                    doc = index.full_prepare(obj)
+                except SkipDocument:
+                    continue
+                # whoosh只接受字符串，和WhooshSearchBackend.update中的处理相同
+                for key in doc:
+                    doc[key] = backend._from_python(doc[key])
+                doc.pop('boost', None)
+                writer.add_document(**doc)
+                count += 1
+            if progress is not None:
+                progress(count, time.time() - start)
+    except Exception:
+        writer.cancel()
+        raise
+
+    # 合并各个进程写入的段
+    writer.commit()
+    search_cache.bump_generation()
+    return count, time.time() - start
+
+
+def rebuild_snapshot(backend, index, chunk_size=1000, progress=None):
+    """重建内存倒排索引的快照文件(分块查询、分词，最后一次写入)"""
+
+    start = time.time()
+    documents = {}
+    content_field = index.get_content_field()
+    for chunk in iter_chunks(index.index_queryset(), chunk_size):
+        for obj in chunk:
+            try:
+                doc = index.full_prepare(obj)
+            except SkipDocument:
+                continue
+            documents[(doc[DJANGO_CT], str(doc[DJANGO_ID]))] = backend.tokenize(doc[content_field])
+        if progress is not None:
+            progress(len(documents), time.time() - start)
+
+    backend.write(documents)
+    search_cache.bump_generation()
+    return len(documents), time.time() - start
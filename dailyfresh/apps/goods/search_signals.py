@@ -0,0 +1,163 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django_redis import get_redis_connection
+from haystack import connections, signals
+from haystack.exceptions import NotHandled
+from haystack.utils import get_identifier
+from redis.exceptions import LockError
+from goods import search_cache
+
+
+# 全文检索索引的异步更新
+# 模型保存、删除时只把对象的标识(app_label.model_name.pk)加入redis的集合，同一个对象多次修改只记录一次
+# 由celery任务批量更新whoosh索引(一个批次一次提交)，同一时间只有一个worker写索引
+# set search_index_pending {'goods.goodssku.1', ...}
+PENDING_KEY = 'search_index_pending'
+SCHEDULED_KEY = 'search_index_scheduled'  # 已经发出了更新任务，还没有开始执行
+LOCK_KEY = 'search_index_update:lock'
+
+# 只更新这些字段时不需要更新索引(索引中没有库存和销量)
+SEARCH_IGNORED_FIELDS = {'stock', 'sales', 'update_time'}
+
+
+class QueuedSignalProcessor(signals.BaseSignalProcessor):
+    """把需要更新索引的对象放入队列，代替RealtimeSignalProcessor在请求中直接写索引"""
+
+    def setup(self):
+        models.signals.post_save.connect(self.handle_save)
+        models.signals.post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        models.signals.post_save.disconnect(self.handle_save)
+        models.signals.post_delete.disconnect(self.handle_delete)
+
+    def handle_save(self, sender, instance, update_fields=None, **kwargs):
+        if update_fields and set(update_fields) <= SEARCH_IGNORED_FIELDS:
+            return
+        self.enqueue(sender, instance)
+
+    def handle_delete(self, sender, instance, **kwargs):
+        self.enqueue(sender, instance)
+
+    def enqueue(self, sender, instance):
+        """事务提交之后把对象加入队列"""
+
+        if sender not in self.connections['default'].get_unified_index().get_indexed_models():
+            # 没有建立索引的模型
+            return
+        identifier = get_identifier(instance)
+        transaction.on_commit(lambda: enqueue([identifier]))
+
+
+def enqueue(identifiers):
+    """把对象的标识加入队列，没有等待执行的更新任务时发出任务"""
+
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline(transaction=False)
+    pipe.sadd(PENDING_KEY, *identifiers)
+    pipe.set(SCHEDULED_KEY, 1, nx=True, ex=600)
+    scheduled = pipe.execute()[1]
+    if scheduled:
+        schedule()
+
+
+def schedule(countdown=None):
+    from celery_tasks.tasks import update_search_index
+    update_search_index.apply_async(countdown=countdown)
+
+
+class IndexBusy(Exception):
+    """其他worker正在更新索引"""
+
+
+def apply_pending(batch_size=500):
+    """批量更新队列中的对象的索引，返回更新的对象数目；其他worker正在更新时抛出IndexBusy(由任务稍后重试)"""
+
+    lock = cache.lock(LOCK_KEY, timeout=600)
+    if not lock.acquire(blocking=False):
+        raise IndexBusy()
+
+    conn = get_redis_connection('default')
+    applied = 0
+    failed = False
+    try:
+        # 之后加入的对象会发出新的任务
+        conn.delete(SCHEDULED_KEY)
+        while True:
+            identifiers = [identifier.decode() for identifier in conn.spop(PENDING_KEY, batch_size)]
+            if not identifiers:
+                break
+            try:
+                update_objects(identifiers)
+            except Exception:
+                # 放回队列，下次再更新
+                conn.sadd(PENDING_KEY, *identifiers)
+                failed = True
+                raise
+            applied += len(identifiers)
+            # 索引已经提交，使搜索结果缓存失效
+            search_cache.bump_generation()
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            pass
+
+        # 持有锁期间加入的对象和更新失败放回队列的对象:
+        # 其他请求设置的标记可能还在(它们发出的任务因为锁而重试)，不管标记是否存在都发出任务，失败时等待一分钟再更新
+        if conn.scard(PENDING_KEY):
+            conn.set(SCHEDULED_KEY, 1, ex=600)
+            schedule(countdown=60 if failed else None)
+    return applied
+
+
+def incremental_connections():
+    """需要增量更新的索引，HAYSTACK_CONNECTIONS中INCREMENTAL为False的索引只通过rebuild_search_index重建"""
+    return [using for using, options in settings.HAYSTACK_CONNECTIONS.items() if options.get('INCREMENTAL', True)]
+
+
+def update_objects(identifiers):
+    """更新一批对象在所有需要增量更新的索引中的数据，每个模型只查询一次数据库"""
+
+    pks = {}  # 模型 -> [pk, ...]
+    for identifier in identifiers:
+        app_label, model_name, pk = identifier.split('.', 2)
+        pks.setdefault(apps.get_model(app_label, model_name), []).append(pk)
+
+    usings = incremental_connections()
+    if not usings:
+        return
+    for model, model_pks in pks.items():
+        try:
+            index = connections[usings[0]].get_unified_index().get_index(model)
+        except NotHandled:
+            continue
+
+        objs = list(index.index_queryset().filter(pk__in=model_pks))
+        found = {str(obj.pk) for obj in objs}
+        removed = ['%s.%s.%s' % (model._meta.app_label, model._meta.model_name, pk) for pk in model_pks if pk not in found]
+        for using in usings:
+            update_connection(using, model, objs, removed)
+
+
+def update_connection(using, model, objs, removed):
+    """存在的对象一次写入并提交，已经删除的对象从索引中删除"""
+
+    backend = connections[using].get_backend()
+    try:
+        index = connections[using].get_unified_index().get_index(model)
+    except NotHandled:
+        return
+
+    if objs:
+        backend.update(index, objs)
+    if removed:
+        remove_many = getattr(backend, 'remove_many', None)
+        if remove_many is not None:
+            # 内存倒排索引一次删除，只重写一次快照
+            remove_many(removed)
+        else:
+            for identifier in removed:
+                backend.remove(identifier)
@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from goods.models import GoodsType, GoodsSKU, Goods
+from goods.contexts import detail_cache
+from goods import sku_index, sku_cache, suggest
+from order.models import OrderGoods
+
+
+# 详情页不显示库存和销量，只更新这两个字段时不需要使缓存失效
+# 所有缓存都在事务提交之后失效: 提交之前失效的话，并发的请求会用提交之前的数据重新生成缓存并当作新数据保存
+DETAIL_IGNORED_FIELDS = {'stock', 'sales', 'update_time'}
+
+
+@receiver([post_save, post_delete], sender=GoodsSKU)
+def sku_changed(sender, instance, update_fields=None, **kwargs):
+    """商品SKU变化: 使该商品、同SPU商品的详情页失效，如果是该种类的新品还要使同种类商品的详情页失效"""
+
+    if update_fields and set(update_fields) <= DETAIL_IGNORED_FIELDS:
+        return
+
+    query = Q(id=instance.id) | Q(goods_id=instance.goods_id)
+    new_sku_ids = GoodsSKU.objects.filter(type_id=instance.type_id).order_by('-create_time').values_list('id', flat=True)[:2]
+    if instance.id in new_sku_ids or kwargs.get('created'):
+        # 详情页中的新品推荐显示的是种类中最新的2个商品
+        query |= Q(type_id=instance.type_id)
+
+    sku_ids = set(GoodsSKU.objects.filter(query).values_list('id', flat=True))
+    sku_ids.add(instance.id)
+    transaction.on_commit(lambda: detail_cache.invalidate_many([(sku_id,) for sku_id in sku_ids]))
+
+
+@receiver(post_save, sender=GoodsSKU)
+def sku_saved_index(sender, instance, **kwargs):
+    """商品SKU保存: 更新种类的排序索引(事务提交之后再更新，回滚时不会留下错误的数据)"""
+
+    transaction.on_commit(lambda: sku_index.index_sku(instance))
+
+
+@receiver(post_delete, sender=GoodsSKU)
+def sku_deleted_index(sender, instance, **kwargs):
+    """商品SKU删除: 从种类的排序索引中移除"""
+
+    transaction.on_commit(lambda: sku_index.remove_sku(instance))
+
+
+@receiver([post_save, post_delete], sender=GoodsSKU)
+def sku_changed_cache(sender, instance, **kwargs):
+    """商品SKU变化(包括库存): 删除热点商品缓存"""
+
+    transaction.on_commit(lambda: sku_cache.invalidate([instance.id]))
+
+
+@receiver([post_save, post_delete], sender=GoodsSKU)
+def sku_changed_suggest(sender, instance, update_fields=None, **kwargs):
+    """商品SKU变化: 更新该商品和所属SPU的搜索提示词，只有销量、库存变化时不通知其他进程立即重新加载"""
+
+    reload = not (update_fields and set(update_fields) <= suggest.RANK_ONLY_FIELDS)
+    transaction.on_commit(lambda: suggest.update_skus([instance.id], [instance.goods_id], reload=reload))
+
+
+@receiver([post_save, post_delete], sender=Goods)
+def goods_changed(sender, instance, **kwargs):
+    """商品SPU变化: 使该SPU下所有商品的详情页失效(详情页显示SPU的商品详情)"""
+
+    sku_ids = list(GoodsSKU.objects.filter(goods_id=instance.id).values_list('id', flat=True))
+    transaction.on_commit(lambda: detail_cache.invalidate_many([(sku_id,) for sku_id in sku_ids]))
+
+
+@receiver([post_save, post_delete], sender=GoodsType)
+def type_changed(sender, instance, **kwargs):
+    """商品种类变化: 详情页显示了商品所属种类的名称，使全部详情页失效"""
+
+    transaction.on_commit(lambda: detail_cache.invalidate())
+
+
+@receiver([post_save, post_delete], sender=OrderGoods)
+def comment_changed(sender, instance, **kwargs):
+    """订单商品变化(添加、修改、清空评论或者删除): 使该商品的详情页失效"""
+
+    transaction.on_commit(lambda: detail_cache.invalidate(instance.sku_id))
+
+
+@receiver([post_save, post_delete], sender=Goods)
+def goods_changed_suggest(sender, instance, **kwargs):
+    """商品SPU变化: 更新SPU的搜索提示词"""
+
+    transaction.on_commit(lambda: suggest.update_goods([instance.id]))
@@ -0,0 +1,115 @@
+import json
+from decimal import Decimal
+from django_redis import get_redis_connection
+from goods.models import GoodsSKU
+from utils.local_cache import LRUCache, local_cache
+
+
+# 热点商品缓存(两级): 进程内LRU -> redis -> mysql
+# 只缓存购物车、下单页面用到的字段，按模型字段的顺序保存成json数组 string goods_sku_商品id '[id, type_id, ...]'
+# 读取时返回只加载了这些字段的GoodsSKU对象(访问其他字段会再查询数据库)，不要用来修改商品
+# 商品保存、删除或者库存变化后通过invalidate把redis中的数据换成墓碑(空字符串，保存TOMBSTONE_TIMEOUT秒)，并通知所有进程删除LRU中的数据
+# 从数据库加载之后用SET NX写回: 在invalidate之前查询了数据库、之后才写回的旧数据不会覆盖墓碑
+# 对库存要求准确的地方(购物车添加、更新、批量修改时校验库存上限)传fresh=True直接查询数据库(同时刷新本进程的LRU)
+FIELDS = ('id', 'type_id', 'goods_id', 'name', 'price', 'unite', 'image', 'stock', 'status')
+PRICE_INDEX = FIELDS.index('price')
+TIMEOUT = 3600  # redis中保存1小时
+TOMBSTONE_TIMEOUT = 10  # 墓碑保存的时间，这段时间内读取直接查询数据库，不写回redis
+
+_local = LRUCache(maxsize=1000, ttl=60)
+
+
+def sku_key(sku_id):
+    return 'goods_sku_%d' % sku_id
+
+
+def _invalidated(name):
+    """local_cache的删除通知"""
+
+    if name is None:
+        _local.clear()
+    elif name.startswith('goods_sku_'):
+        _local.delete(int(name[len('goods_sku_'):]))
+
+
+local_cache.add_handler(_invalidated)
+
+
+def _to_sku(values):
+    """根据缓存的字段创建GoodsSKU对象(每次创建新的对象，视图可以给它增加count、amount等属性)"""
+
+    values = list(values)
+    values[PRICE_INDEX] = Decimal(values[PRICE_INDEX])
+    return GoodsSKU.from_db('default', FIELDS, values)
+
+
+def _dumps(values):
+    values = list(values)
+    values[PRICE_INDEX] = str(values[PRICE_INDEX])
+    return values
+
+
+def get_many(sku_ids, fresh=False):
+    """查询多个商品，返回{商品id: GoodsSKU}，不存在的商品不在结果中"""
+
+    try:
+        sku_ids = list({int(sku_id) for sku_id in sku_ids})
+    except (TypeError, ValueError):
+        # 非法的商品id
+        return {}
+
+    found = {}
+    if not fresh:
+        local_cache.ensure_listener()
+        # 进程内LRU
+        for sku_id in sku_ids:
+            values = _local.get(sku_id)
+            if values is not None:
+                found[sku_id] = values
+
+        # redis
+        missing = [sku_id for sku_id in sku_ids if sku_id not in found]
+        if missing:
+            conn = get_redis_connection('default')
+            for sku_id, data in zip(missing, conn.mget([sku_key(sku_id) for sku_id in missing])):
+                # 墓碑是空字符串
+                if data:
+                    found[sku_id] = values = json.loads(data)
+                    _local.set(sku_id, values)
+
+    # mysql
+    missing = [sku_id for sku_id in sku_ids if sku_id not in found]
+    if missing:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        for values in GoodsSKU.objects.filter(id__in=missing).values_list(*FIELDS):
+            sku_id = values[0]
+            found[sku_id] = values = _dumps(values)
+            _local.set(sku_id, values)
+            pipe.set(sku_key(sku_id), json.dumps(values), ex=TIMEOUT, nx=True)
+        pipe.execute()
+
+    return {sku_id: _to_sku(values) for sku_id, values in found.items()}
+
+
+def get(sku_id, fresh=False):
+    """查询一个商品，不存在时返回None"""
+
+    try:
+        sku_id = int(sku_id)
+    except (TypeError, ValueError):
+        return None
+    return get_many([sku_id], fresh=fresh).get(sku_id)
+
+
+def invalidate(sku_ids):
+    """删除商品的缓存(写入墓碑)，并通知所有进程删除LRU中的数据(一次发布)"""
+
+    sku_ids = [int(sku_id) for sku_id in sku_ids]
+    if not sku_ids:
+        return
+    keys = [sku_key(sku_id) for sku_id in sku_ids]
+    pipe = get_redis_connection('default').pipeline(transaction=False)
+    for key in keys:
+        pipe.set(key, '', ex=TOMBSTONE_TIMEOUT)
+    pipe.execute()
+    local_cache.invalidate_many(keys)
@@ -0,0 +1,190 @@
+from django_redis import get_redis_connection
+from goods.models import GoodsSKU
+from goods.loaders import SKULoader
+
+
+# 每个种类3个有序集合，成员是商品id:
+# goods_index_price_种类id 分数是价格     -> 列表页按价格排序
+# goods_index_sales_种类id 分数是销量     -> 列表页按人气排序
+# goods_index_new_种类id   分数是商品id   -> 列表页默认排序、新品推荐(id随创建时间递增)
+# goods_index_type         hash 商品id:种类id，商品修改种类时用来从原种类中移除
+INDEX_KEYS = ('price', 'sales', 'new')
+TYPE_KEY = 'goods_index_type'
+
+# 分面过滤使用的集合，成员是商品id(种类直接使用goods_index_new_种类id):
+# goods_facet_price_区间序号 价格在PRICE_BUCKETS中对应区间的商品
+# goods_facet_in_stock       有库存的商品
+PRICE_BUCKETS = ((0, 10), (10, 30), (30, 50), (50, 100), (100, None))  # [最低价, 最高价)
+STOCK_KEY = 'goods_facet_in_stock'
+
+
+def index_key(name, type_id):
+    return 'goods_index_%s_%d' % (name, type_id)
+
+
+def price_key(bucket):
+    return 'goods_facet_price_%d' % bucket
+
+
+def price_bucket(price):
+    """商品价格所在的区间序号"""
+
+    for bucket, (low, high) in enumerate(PRICE_BUCKETS):
+        if price >= low and (high is None or price < high):
+            return bucket
+    return 0
+
+
+def update_facets(pipe, sku):
+    """在pipeline中更新商品所在的价格区间和库存集合"""
+
+    bucket = price_bucket(sku.price)
+    for i in range(len(PRICE_BUCKETS)):
+        if i == bucket:
+            pipe.sadd(price_key(i), sku.id)
+        else:
+            pipe.srem(price_key(i), sku.id)
+    if sku.stock > 0:
+        pipe.sadd(STOCK_KEY, sku.id)
+    else:
+        pipe.srem(STOCK_KEY, sku.id)
+
+
+def sku_scores(sku):
+    """商品在各个有序集合中的分数"""
+    return {'price': float(sku.price), 'sales': sku.sales, 'new': sku.id}
+
+
+def index_sku(sku):
+    """添加/更新一个商品的索引"""
+
+    conn = get_redis_connection('default')
+    old_type_id = conn.hget(TYPE_KEY, sku.id)
+
+    pipe = conn.pipeline()
+    if old_type_id is not None and int(old_type_id) != sku.type_id:
+        # 商品修改了种类，从原来的种类中移除
+        for name in INDEX_KEYS:
+            pipe.zrem(index_key(name, int(old_type_id)), sku.id)
+    for name, score in sku_scores(sku).items():
+        pipe.zadd(index_key(name, sku.type_id), {sku.id: score})
+    pipe.hset(TYPE_KEY, sku.id, sku.type_id)
+    update_facets(pipe, sku)
+    pipe.execute()
+
+
+def remove_sku(sku):
+    """删除一个商品的索引"""
+
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline()
+    for name in INDEX_KEYS:
+        pipe.zrem(index_key(name, sku.type_id), sku.id)
+    pipe.hdel(TYPE_KEY, sku.id)
+    for i in range(len(PRICE_BUCKETS)):
+        pipe.srem(price_key(i), sku.id)
+    pipe.srem(STOCK_KEY, sku.id)
+    pipe.execute()
+
+
+def incr_sales(sales):
+    """下单后累加商品的销量 sales: [(种类id, 商品id, 数量), ...]"""
+
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline()
+    for type_id, sku_id, count in sales:
+        # 只更新已经存在的成员(XX)，索引还没有建立时不添加残缺的数据
+        pipe.zadd(index_key('sales', type_id), {sku_id: count}, xx=True, incr=True)
+    pipe.execute()
+
+
+def set_stock(stocks):
+    """下单后更新有库存的商品集合 stocks: [(商品id, 新的库存), ...]"""
+
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline(transaction=False)
+    for sku_id, stock in stocks:
+        if stock > 0:
+            pipe.sadd(STOCK_KEY, sku_id)
+        else:
+            pipe.srem(STOCK_KEY, sku_id)
+    pipe.execute()
+
+
+def rebuild(type_id=None, chunk_size=1000):
+    """从数据库重建索引，返回建立索引的商品数目
+
+    先写入临时键，写完后用RENAME替换，重建过程中列表页依然可以使用旧的索引
+    """
+
+    conn = get_redis_connection('default')
+    skus = GoodsSKU.objects.all()
+    if type_id is not None:
+        skus = skus.filter(type_id=type_id)
+    skus = skus.only('id', 'type_id', 'price', 'sales', 'stock').order_by('id')
+
+    total = 0
+    type_ids = set()
+    last_id = 0
+    while True:
+        # 按主键分块读取，不一次性把整个表读到内存中
+        chunk = list(skus.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            break
+        pipe = conn.pipeline(transaction=False)
+        for sku in chunk:
+            for name, score in sku_scores(sku).items():
+                pipe.zadd(index_key(name, sku.type_id) + ':rebuild', {sku.id: score})
+            pipe.hset(TYPE_KEY, sku.id, sku.type_id)
+            type_ids.add(sku.type_id)
+            if type_id is None:
+                # 全部重建时分面集合也写入临时键
+                pipe.sadd(price_key(price_bucket(sku.price)) + ':rebuild', sku.id)
+                if sku.stock > 0:
+                    pipe.sadd(STOCK_KEY + ':rebuild', sku.id)
+            else:
+                update_facets(pipe, sku)
+        pipe.execute()
+        total += len(chunk)
+        last_id = chunk[-1].id
+
+    pipe = conn.pipeline()
+    if type_id is not None:
+        old_type_ids = {type_id}
+    else:
+        old_type_ids = {int(key.decode().rsplit('_', 1)[1]) for key in conn.scan_iter('goods_index_new_*')
+                        if not key.endswith(b':rebuild')}
+    for tid in old_type_ids | type_ids:
+        for name in INDEX_KEYS:
+            if tid in type_ids:
+                pipe.rename(index_key(name, tid) + ':rebuild', index_key(name, tid))
+            else:
+                # 种类下已经没有商品
+                pipe.delete(index_key(name, tid))
+    pipe.execute()
+
+    if type_id is None:
+        pipe = conn.pipeline()
+        for key in [price_key(i) for i in range(len(PRICE_BUCKETS))] + [STOCK_KEY]:
+            if conn.exists(key + ':rebuild'):
+                pipe.rename(key + ':rebuild', key)
+            else:
+                pipe.delete(key)
+        pipe.execute()
+    return total
+
+
+def hydrate(sku_ids):
+    """根据商品id列表一次查询出商品，保持id的顺序"""
+
+    return SKULoader().load_many(sku_ids)
+
+
+def new_skus(type_id, count=2):
+    """获取种类的新品，索引不存在时返回None"""
+
+    conn = get_redis_connection('default')
+    sku_ids = conn.zrevrange(index_key('new', type_id), 0, count - 1)
+    if not sku_ids:
+        return None
+    return hydrate(sku_ids)
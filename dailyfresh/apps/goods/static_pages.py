@@ -0,0 +1,193 @@
+import os
+import json
+import shutil
+import tempfile
+from datetime import date
+from billiard import Pool
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.template import loader
+from goods.models import GoodsType, GoodsSKU, Goods
+from goods.contexts import build_detail_context, build_list_context, get_goods_types
+from order.models import OrderGoods
+
+
+# 静态页面保存在static目录下，由nginx直接提供给未登录的用户:
+# static/index.html                 首页
+# static/goods/商品id.html           详情页
+# static/list/种类id/1_排序方式.html   列表页的前几页
+# static/static_manifest.json       记录上次生成的时间和生成了哪些页面
+LIST_SORTS = ('default', 'price', 'hot')
+LOCK_KEY = 'static_pages:lock'  # 同一时间只有一个任务生成页面和改写manifest
+
+
+def static_path(*parts):
+    return os.path.join(settings.BASE_DIR, 'static', *parts)
+
+
+def write_atomic(path, content):
+    """先写入同目录下的临时文件，再重命名为目标文件，nginx不会读到写了一半的页面"""
+
+    dirname = os.path.dirname(path)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp_', suffix='.html')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        # mkstemp创建的文件只有当前用户可读，nginx需要读取权限
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def render_detail(sku_id):
+    """生成一个商品的详情页，商品不存在时删除原来的页面"""
+
+    path = static_path('goods', '%d.html' % sku_id)
+    try:
+        context = build_detail_context(sku_id)
+    except GoodsSKU.DoesNotExist:
+        if os.path.exists(path):
+            os.unlink(path)
+        return None
+    # 用户信息和csrf token在页面加载之后获取(见base.html中的static_page)
+    context.update(types=get_goods_types(), cart_count=0, static_page=True)
+    write_atomic(path, loader.render_to_string('detail.html', context))
+    return path
+
+
+def render_list(type_id, pages):
+    """生成一个种类前pages页的列表页(每种排序方式)，删除种类不存在或者已经没有的页面"""
+
+    paths = []
+    for sort in LIST_SORTS:
+        for page in range(1, pages + 1):
+            context = build_list_context(type_id, sort, page)
+            if context is None or context['skus_page'].number != page:
+                # 种类不存在或者已经没有这么多页
+                break
+            context.update(cart_count=0, static_page=True)
+            path = static_path('list', str(type_id), '%d_%s.html' % (page, sort))
+            write_atomic(path, loader.render_to_string('list.html', context))
+            paths.append(path)
+
+    dirname = static_path('list', str(type_id))
+    if not paths:
+        shutil.rmtree(dirname, ignore_errors=True)
+    elif os.path.isdir(dirname):
+        for name in os.listdir(dirname):
+            path = os.path.join(dirname, name)
+            if path not in paths and not name.startswith('.tmp_'):
+                os.unlink(path)
+    return paths
+
+
+def render_task(task):
+    """进程池中执行的任务 ('detail', 商品id) 或者 ('list', 种类id, 页数)"""
+
+    if task[0] == 'detail':
+        return task, render_detail(task[1])
+    return task, render_list(task[1], task[2])
+
+
+def close_connections():
+    """子进程不能使用从父进程继承的数据库连接"""
+    connections.close_all()
+
+
+def load_manifest():
+    try:
+        with open(static_path('static_manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def changed_since(since):
+    """找出since(日期)之后需要重新生成的商品id和种类id，since为None时全部重新生成
+
+    update_time只精确到日期，since当天修改的数据也会重新生成
+    """
+
+    if since is None or GoodsType.objects.filter(update_time__gte=since).exists():
+        # 种类变化会影响所有页面的分类菜单
+        return set(GoodsSKU.objects.values_list('id', flat=True)), set(GoodsType.objects.values_list('id', flat=True))
+
+    changed = GoodsSKU.objects.filter(update_time__gte=since)
+    sku_ids = set(changed.values_list('id', flat=True))
+    type_ids = set(changed.values_list('type_id', flat=True))
+    goods_ids = set(changed.values_list('goods_id', flat=True))
+
+    # SPU的详情变化，以及有新评论的商品
+    goods_ids |= set(Goods.objects.filter(update_time__gte=since).values_list('id', flat=True))
+    sku_ids |= set(OrderGoods.objects.filter(update_time__gte=since).exclude(comment='').values_list('sku_id', flat=True))
+
+    # 同SPU商品的详情页显示了其他规格，同种类商品的详情页显示了新品
+    sku_ids |= set(GoodsSKU.objects.filter(goods_id__in=goods_ids).values_list('id', flat=True))
+    sku_ids |= set(GoodsSKU.objects.filter(type_id__in=type_ids).values_list('id', flat=True))
+    return sku_ids, type_ids
+
+
+def generate_static_pages(full=False, workers=4, list_pages=1):
+    """增量生成详情页和列表页的静态页面，返回生成的页面数目
+
+    full: 全部重新生成 workers: 进程池的进程数目 list_pages: 每个种类生成列表页的前几页
+    """
+
+    # 并发的任务依次执行，不会互相覆盖manifest
+    with cache.lock(LOCK_KEY, timeout=3600):
+        return _generate_static_pages(full, workers, list_pages)
+
+
+def _generate_static_pages(full, workers, list_pages):
+    manifest = load_manifest()
+    since = None
+    if not full and manifest is not None:
+        since = date.fromisoformat(manifest['built_at'])
+    else:
+        manifest = {'built_at': None, 'detail': [], 'list': []}
+    build_date = date.today()
+
+    sku_ids, type_ids = changed_since(since)
+
+    # 已经删除的商品也需要处理(删除静态页面)
+    old_sku_ids = set(manifest['detail'])
+    existing_sku_ids = set(GoodsSKU.objects.values_list('id', flat=True))
+    sku_ids |= old_sku_ids - existing_sku_ids
+
+    # 已经删除的种类也需要处理(删除列表页)
+    type_ids |= set(manifest['list']) - set(GoodsType.objects.values_list('id', flat=True))
+
+    tasks = [('detail', sku_id) for sku_id in sorted(sku_ids)]
+    tasks += [('list', type_id, list_pages) for type_id in sorted(type_ids)]
+
+    # 在创建子进程之前关闭数据库连接，子进程各自建立连接
+    close_connections()
+    if workers > 1 and len(tasks) > 1:
+        pool = Pool(workers, initializer=close_connections)
+        try:
+            results = pool.map(render_task, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [render_task(task) for task in tasks]
+
+    built_types = set(manifest['list'])
+    for task, result in results:
+        if task[0] == 'detail':
+            if result is None:
+                old_sku_ids.discard(task[1])
+            else:
+                old_sku_ids.add(task[1])
+        elif result:
+            built_types.add(task[1])
+
+    manifest = {'built_at': build_date.isoformat(),
+                'detail': sorted(old_sku_ids),
+                'list': sorted(built_types & set(GoodsType.objects.values_list('id', flat=True)))}
+    write_atomic(static_path('static_manifest.json'), json.dumps(manifest))
+    return len(tasks)
@@ -0,0 +1,229 @@
+import json
+import heapq
+from bisect import bisect_left
+from datetime import date, timedelta
+from django.db.models import Sum
+from django_redis import get_redis_connection
+from goods.models import GoodsSKU, Goods
+from goods import search_cache
+from utils.local_cache import local_cache
+
+
+# 搜索框的输入提示
+# 提示词来自上线商品的名称(按销量排序)、SPU名称(按SPU下所有商品的销量之和排序)和热门搜索词(按搜索次数排序)
+# hash search_suggest_sku {商品id: '[名称, 销量]'}
+# hash search_suggest_spu {SPU id: '[名称, 销量]'}
+# 热门搜索词按天记录，搜索词用search_cache.normalize规范化之后保存，"新鲜的草莓"和"草莓 新鲜"是同一个搜索词
+# zset search_popular_queries:日期 {规范化的搜索词: 当天的搜索次数} 保存QUERY_DAYS天
+# hash search_popular_queries:日期:display {规范化的搜索词: 用户最近输入的原始搜索词} 作为提示词显示
+# 定时任务(aggregate_queries)按天衰减合并最近QUERY_DAYS天的搜索次数，顺便裁剪每天的记录:
+# zset search_popular_queries {规范化的搜索词: 衰减之后的搜索次数} 只保存QUERY_COUNT个
+# hash search_popular_queries:display {规范化的搜索词: 原始搜索词}
+# 每个进程把提示词按小写排序保存在内存中(PrefixIndex)，输入时二分查找前缀，不访问数据库、redis和whoosh
+# 商品变化时只更新redis中这件商品和它的SPU的提示词；名称和状态变化时通知所有进程重新加载，只有销量变化时等待local_cache过期
+SKU_KEY = 'search_suggest_sku'
+SPU_KEY = 'search_suggest_spu'
+QUERY_KEY = 'search_popular_queries'
+QUERY_DISPLAY_KEY = 'search_popular_queries:display'
+QUERY_COUNT = 1000  # 最多保存的热门搜索词数目
+QUERY_DAY_COUNT = 10000  # 每天最多保存的搜索词数目
+QUERY_DAYS = 7  # 合并最近几天的搜索次数
+QUERY_DECAY = 0.5  # 每早一天搜索次数的权重减半
+LOCAL_NAME = 'search_suggest'
+
+# 只更新这些字段时提示词的内容不变，只是排序可能变化
+RANK_ONLY_FIELDS = {'stock', 'sales', 'update_time'}
+
+
+class PrefixIndex(object):
+    """按前缀查找提示词: 提示词按小写排序，前缀匹配的提示词在排序后的数组中是连续的一段"""
+
+    def __init__(self, weights):
+        # weights: {提示词: 权重}
+        entries = sorted((term.lower(), term, weight) for term, weight in weights.items())
+        self.keys = [key for key, term, weight in entries]
+        self.terms = [term for key, term, weight in entries]
+        self.weights = [weight for key, term, weight in entries]
+
+    def suggest(self, prefix, limit=10):
+        """返回以prefix开头的权重最高的limit个提示词"""
+
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + '\uffff', start)
+        top = heapq.nlargest(limit, range(start, end), key=self.weights.__getitem__)
+        return [self.terms[i] for i in top]
+
+
+def load():
+    """从redis加载所有提示词，合并同名的提示词"""
+
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline(transaction=False)
+    pipe.hvals(SKU_KEY)
+    pipe.hvals(SPU_KEY)
+    pipe.zrevrange(QUERY_KEY, 0, QUERY_COUNT - 1, withscores=True)
+    pipe.hgetall(QUERY_DISPLAY_KEY)
+    sku_values, spu_values, queries, display = pipe.execute()
+
+    weights = {}
+    for value in sku_values + spu_values:
+        name, sales = json.loads(value)
+        weights[name] = weights.get(name, 0) + sales
+    for query, count in queries:
+        query = display.get(query, query).decode()
+        weights[query] = weights.get(query, 0) + round(count)
+    return PrefixIndex(weights)
+
+
+def suggest(prefix, limit=10):
+    """获取输入提示"""
+    return local_cache.get_or_set(LOCAL_NAME, load).suggest(prefix, limit)
+
+
+def update_skus(sku_ids, goods_ids=(), reload=True):
+    """更新商品和它们所属SPU的提示词，reload为True时通知所有进程重新加载
+
+    goods_ids: 另外需要更新的SPU(例如已经删除的商品所属的SPU)
+    """
+
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline(transaction=False)
+
+    sku_ids = {int(sku_id) for sku_id in sku_ids}
+    goods_ids = set(goods_ids)
+    for sku_id, goods_id, name, sales, status in GoodsSKU.objects.filter(id__in=sku_ids).values_list(
+            'id', 'goods_id', 'name', 'sales', 'status'):
+        goods_ids.add(goods_id)
+        sku_ids.discard(sku_id)
+        if status == 1:
+            pipe.hset(SKU_KEY, sku_id, json.dumps([name, sales]))
+        else:
+            # 下线的商品不提示
+            pipe.hdel(SKU_KEY, sku_id)
+    if sku_ids:
+        # 已经删除的商品
+        pipe.hdel(SKU_KEY, *sku_ids)
+    pipe.execute()
+
+    update_goods(goods_ids, reload=reload)
+
+
+def update_goods(goods_ids, reload=True):
+    """更新SPU的提示词"""
+
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline(transaction=False)
+
+    goods_ids = set(goods_ids)
+    for goods_id, name, sales in Goods.objects.filter(id__in=goods_ids).annotate(
+            sales=Sum('goodssku__sales')).values_list('id', 'name', 'sales'):
+        goods_ids.discard(goods_id)
+        pipe.hset(SPU_KEY, goods_id, json.dumps([name, sales or 0]))
+    if goods_ids:
+        pipe.hdel(SPU_KEY, *goods_ids)
+    pipe.execute()
+
+    if reload:
+        local_cache.invalidate(LOCAL_NAME)
+
+
+def day_key(day):
+    return '%s:%s' % (QUERY_KEY, day.strftime('%Y%m%d'))
+
+
+def record_query(query):
+    """记录一次有结果的搜索(计入当天的搜索次数，裁剪由定时任务完成，新的搜索词不会被立即删除)"""
+
+    query = ' '.join(query.split())
+    normalized = search_cache.normalize(query)
+    if not normalized:
+        return
+    key = day_key(date.today())
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline(transaction=False)
+    pipe.zincrby(key, 1, normalized)
+    pipe.hset(key + ':display', normalized, query)
+    pipe.expire(key, (QUERY_DAYS + 1) * 24 * 3600)
+    pipe.expire(key + ':display', (QUERY_DAYS + 1) * 24 * 3600)
+    pipe.execute()
+
+
+def aggregate_queries():
+    """合并最近QUERY_DAYS天的搜索次数(越早的权重越低)，保存最多的QUERY_COUNT个热门搜索词，返回保存的数目
+
+    每天的记录只保留搜索次数最多的QUERY_DAY_COUNT个搜索词
+    """
+
+    conn = get_redis_connection('default')
+    today = date.today()
+    keys = [day_key(today - timedelta(days=i)) for i in range(QUERY_DAYS)]
+
+    for key in keys:
+        dropped = conn.zrange(key, 0, -QUERY_DAY_COUNT - 1)
+        if dropped:
+            pipe = conn.pipeline(transaction=False)
+            pipe.zrem(key, *dropped)
+            pipe.hdel(key + ':display', *dropped)
+            pipe.execute()
+
+    # 先写入临时的键，最后重命名，合并期间读取的是旧数据
+    tmp_key = QUERY_KEY + ':rebuild'
+    tmp_display_key = QUERY_DISPLAY_KEY + ':rebuild'
+    conn.delete(tmp_key, tmp_display_key)
+    conn.zunionstore(tmp_key, {key: QUERY_DECAY ** i for i, key in enumerate(keys)})
+    conn.zremrangebyrank(tmp_key, 0, -QUERY_COUNT - 1)
+    queries = conn.zrange(tmp_key, 0, -1)
+
+    if queries:
+        # 显示用户最近一次输入的原始搜索词
+        pipe = conn.pipeline(transaction=False)
+        for key in reversed(keys):
+            pipe.hmget(key + ':display', queries)
+        display = {}
+        for values in pipe.execute():
+            display.update((query, value) for query, value in zip(queries, values) if value is not None)
+        if display:
+            conn.hset(tmp_display_key, mapping=display)
+
+    pipe = conn.pipeline()
+    for key, tmp in ((QUERY_KEY, tmp_key), (QUERY_DISPLAY_KEY, tmp_display_key)):
+        if conn.exists(tmp):
+            pipe.rename(tmp, key)
+        else:
+            pipe.delete(key)
+    pipe.execute()
+
+    local_cache.invalidate(LOCAL_NAME)
+    return len(queries)
+
+
+def rebuild(chunk_size=1000):
+    """从数据库重建所有商品和SPU的提示词，返回提示词数目"""
+
+    conn = get_redis_connection('default')
+    count = 0
+    for key, queryset in ((SKU_KEY, GoodsSKU.objects.filter(status=1).values_list('id', 'name', 'sales')),
+                          (SPU_KEY, Goods.objects.annotate(sales=Sum('goodssku__sales')).values_list('id', 'name', 'sales'))):
+        # 先写入临时的键，最后重命名，重建期间读取的是旧数据
+        tmp_key = key + ':rebuild'
+        conn.delete(tmp_key)
+        mapping = {}
+        for obj_id, name, sales in queryset.order_by('id').iterator(chunk_size=chunk_size):
+            mapping[obj_id] = json.dumps([name, sales or 0])
+            if len(mapping) >= chunk_size:
+                conn.hset(tmp_key, mapping=mapping)
+                count += len(mapping)
+                mapping = {}
+        if mapping:
+            conn.hset(tmp_key, mapping=mapping)
+            count += len(mapping)
+        if conn.exists(tmp_key):
+            conn.rename(tmp_key, key)
+        else:
+            conn.delete(key)
+
+    local_cache.invalidate(LOCAL_NAME)
+    return count
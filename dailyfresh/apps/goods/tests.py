@@ -1,3 +1,83 @@
+from unittest import mock
+from django.core.cache import cache
+from django.db import transaction
 from django.test import TestCase
 
+from goods.models import GoodsType, Goods, GoodsSKU, IndexGoodsBanner, IndexPromotionBanner, IndexTypeGoodsBanner
+from goods.contexts import build_index_context, detail_cache
+
+
 # Create your tests here.
+
+
+class IndexContextTest(TestCase):
+    """首页上下文的查询次数测试"""
+
+    def create_type(self, index):
+        """创建一个商品种类以及它在首页的展示商品"""
+
+        typ = GoodsType.objects.create(name='种类%d' % index, logo='logo%d' % index, image='type/%d.jpg' % index)
+        goods = Goods.objects.create(name='SPU%d' % index)
+        sku = GoodsSKU.objects.create(type=typ, goods=goods, name='商品%d' % index, desc='简介',
+                                      price=10, unite='500g', image='goods/%d.jpg' % index)
+        IndexGoodsBanner.objects.create(sku=sku, image='banner/%d.jpg' % index, index=index)
+        IndexTypeGoodsBanner.objects.create(type=typ, sku=sku, display_type=1, index=0)
+        IndexTypeGoodsBanner.objects.create(type=typ, sku=sku, display_type=0, index=0)
+        return typ
+
+    def test_query_count_is_constant(self):
+        """查询次数不随商品种类的数量增长"""
+
+        IndexPromotionBanner.objects.create(name='活动', url='#', image='banner/p.jpg', index=0)
+        for i in range(2):
+            self.create_type(i)
+
+        with self.assertNumQueries(4):
+            build_index_context()
+
+        for i in range(2, 8):
+            self.create_type(i)
+
+        with self.assertNumQueries(4):
+            context = build_index_context()
+
+        # 模板中访问banner.sku不再产生查询
+        with self.assertNumQueries(0):
+            for typ in context['types']:
+                self.assertEqual(len(typ.image_banners), 1)
+                self.assertEqual(len(typ.title_banners), 1)
+                for banner in typ.image_banners + typ.title_banners:
+                    banner.sku.name
+            for banner in context['goods_banners']:
+                banner.sku.id
+
+
+class DetailCacheInvalidationTest(TestCase):
+    """详情页缓存在事务提交之后才失效(需要redis)"""
+
+    def setUp(self):
+        typ = GoodsType.objects.create(name='水果', logo='fruit', image='type/fruit.jpg')
+        goods = Goods.objects.create(name='草莓')
+        self.sku = GoodsSKU.objects.create(type=typ, goods=goods, name='旧名称', desc='简介',
+                                           price=10, unite='500g', image='goods/1.jpg')
+        # 删除之前的测试留下的同id的缓存
+        cache.delete(detail_cache.make_key(self.sku.id))
+
+    def tearDown(self):
+        cache.delete(detail_cache.make_key(self.sku.id))
+
+    def test_invalidate_after_commit(self):
+        self.assertEqual(detail_cache.get(self.sku.id)['sku'].name, '旧名称')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                self.sku.name = '新名称'
+                self.sku.save()
+            # 提交之前缓存没有失效
+            self.assertEqual(detail_cache.get(self.sku.id)['sku'].name, '旧名称')
+
+        # 提交之后(不发出全文检索的更新任务)
+        with mock.patch('goods.search_signals.schedule'):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(detail_cache.get(self.sku.id)['sku'].name, '新名称')
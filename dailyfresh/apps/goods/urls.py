@@ -1,8 +1,12 @@
 from django.urls import path, re_path
-from goods.views import IndexView, DetailView, ListView
+from goods.views import IndexView, DetailView, ListView, CommentListView, SearchView, SuggestView, HeaderView
 
 urlpatterns = [
     path('index/', IndexView.as_view(), name='index'),
     re_path(r'goods/(?P<goods_id>\d+)$', DetailView.as_view(), name='detail'),  # 商品详情页
+    re_path(r'goods/(?P<goods_id>\d+)/comments$', CommentListView.as_view(), name='comments'),  # 商品评论分页
     re_path(r'list/(?P<type_id>\d+)/(?P<page>\d+)$', ListView.as_view(), name='list'),  # 列表页
+    path('search/', SearchView.as_view(), name='search'),  # 商品搜索
+    path('search/suggest', SuggestView.as_view(), name='suggest'),  # 搜索框输入提示
+    path('header', HeaderView.as_view(), name='header'),  # 静态页面中的登录状态和购物车数目
 ]
@@ -1,13 +1,18 @@
 from django.shortcuts import render, redirect
+from django.http import JsonResponse, Http404
+from django.conf import settings
+from django.core.paginator import Paginator, InvalidPage
+from urllib.parse import urlencode
 # from django.core.urlresolvers import reverse
 from django.views.generic import View
-from django.core.cache import cache
-from django.core.paginator import Paginator
-from goods.models import GoodsType, GoodsSKU, IndexGoodsBanner, IndexPromotionBanner, IndexTypeGoodsBanner
-from django_redis import get_redis_connection
-from order.models import OrderGoods
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import ensure_csrf_cookie
+from goods.models import GoodsSKU
+from goods.contexts import index_cache, detail_cache, get_goods_types, get_comment_page, build_list_context
+from goods.loaders import SKULoader
+from goods import search_cache, suggest, facets
+from cart.utils import get_cart_count, record_view
 from django.urls import reverse
-from django.core.exceptions import ObjectDoesNotExist
 
 
 # http://127.0.0.1:8000
@@ -17,50 +22,14 @@ class IndexView(View):
     def get(self, request):
         """显示首页"""
 
-        # 尝试从缓存中获取数据
-        context = cache.get('index_page_data')
+        # 获取用户购物车中商品的数目(命令先排队，读取结果时和本次请求的其他redis命令一起发送)
+        cart_count = get_cart_count(request)
 
-        if context is None:
-            print('设置缓存')
-            # 缓存中没有数据
-            # 获取商品的种类信息
-            types = GoodsType.objects.all()
-
-            # 获取首页轮播商品信息
-            goods_banners = IndexGoodsBanner.objects.all().order_by('index')
-
-            # 获取首页促销活动信息
-            promotion_banners = IndexPromotionBanner.objects.all().order_by('index')
-
-            # 获取首页分类商品展示信息
-            for typ in types:  # GoodsType
-                # 获取type种类首页分类商品的图片展示信息
-                image_banners = IndexTypeGoodsBanner.objects.filter(type=typ, display_type=1).order_by('index')
-                # 获取type种类首页分类商品的文字展示信息
-                title_banners = IndexTypeGoodsBanner.objects.filter(type=typ, display_type=0).order_by('index')
-
-                # 动态给type增加属性，分别保存首页分类商品的图片展示信息和文字展示信息
-                typ.image_banners = image_banners
-                typ.title_banners = title_banners
-
-            context = {'types': types,
-                       'goods_banners': goods_banners,
-                       'promotion_banners': promotion_banners}
-            # 设置缓存
-            # key  value timeout
-            cache.set('index_page_data', context, 3600)  # 设置缓存过期时间1个小时
-
-        # 获取用户购物车中商品的数目
-        user = request.user
-        cart_count = 0
-        if user.is_authenticated:
-            # 用户已登录
-            conn = get_redis_connection('default')
-            cart_key = 'cart_%d' % user.id
-            cart_count = conn.hlen(cart_key)
+        # 从缓存中获取数据(缓存失效时只有一个请求重新生成，其余请求继续使用旧数据)
+        context = index_cache.get()
 
         # 组织模板上下文
-        context.update(cart_count=cart_count)
+        context.update(cart_count=cart_count.value)
 
         # 使用模板
         return render(request, 'index.html', context)
@@ -73,138 +42,156 @@ class DetailView(View):
     def get(self, request, goods_id):
         """显示详情页"""
 
+        # 从缓存中获取与用户无关的数据(商品、分类、评论、新品、同SPU商品)
         try:
-            sku = GoodsSKU.objects.get(id=goods_id)
-        except ObjectDoesNotExist:
+            context = detail_cache.get(goods_id)
+        except GoodsSKU.DoesNotExist:
             # 商品不存在则跳转回首页
             return redirect(reverse('goods:index'))
 
         # 获取商品的分类信息
-        types = GoodsType.objects.all()
-
-        # 获取商品的评论信息
-        sku_orders = OrderGoods.objects.filter(sku=sku).exclude(comment='')
+        context.update(types=get_goods_types())
 
-        # 获取新品信息（默认是升序）
-        new_skus = GoodsSKU.objects.filter(type=sku.type).order_by('-create_time')[:2]
-
-        # 获取同一个SPU的其他规格商品
-        same_spu_skus = GoodsSKU.objects.filter(goods=sku.goods).exclude(id=goods_id)
-
-        # 获取用户购物车中商品的数目
-        user = request.user
-        cart_count = 0
-        if user.is_authenticated:
-            # 用户已登录
-            conn = get_redis_connection('default')
-            cart_key = 'cart_%d' % user.id
-            cart_count = conn.hlen(cart_key)
-
-            # 添加用户的历史记录
-            conn = get_redis_connection('default')
-            history_key = 'history_%d' % user.id
-            # 移除列表中的goods_id
-            conn.lrem(history_key, 0, goods_id)
-            # 把goods_id插入到列表的左侧
-            conn.lpush(history_key, goods_id)
-            # 只保存用户最新浏览的5条信息
-            conn.ltrim(history_key, 0, 4)
+        # 添加用户的历史记录，同时获取用户购物车中商品的数目(一个lua脚本)
+        cart_count = record_view(request, goods_id)
 
         # 组织模板上下文
-        context = {'sku': sku, 'types': types,
-                   'sku_orders': sku_orders,
-                   'new_skus': new_skus,
-                   'same_spu_skus': same_spu_skus,
-                   'cart_count': cart_count}
+        context.update(cart_count=cart_count.value)
 
         # 使用模板
         return render(request, 'detail.html', context)
 
 
+# 采用ajax get请求
+# 前端传递的参数:上一页最后一条评论的游标(after)
+# /goods/商品id/comments?after=游标
+class CommentListView(View):
+    """商品评论分页"""
+
+    def get(self, request, goods_id):
+        """获取一页评论"""
+
+        comments_page = get_comment_page(goods_id, request.GET.get('after'))
+
+        comments = []
+        for order_goods in comments_page:
+            comments.append({'username': order_goods.order.user.username,
+                             'time': str(order_goods.update_time),
+                             'comment': order_goods.comment})
+
+        # 没有下一页时游标为空
+        next_cursor = comments_page.next_cursor if comments_page.has_next() else ''
+
+        # 返回应答
+        return JsonResponse({'res': 1, 'comments': comments, 'next_cursor': next_cursor})
+
+
 # 种类id 页码 排序方式
 # restful api -> 请求一种资源
 # /list?type_id=种类id&page=页码&sort=排序方式(?后面的值需要在request中用get方式获取到)
 # /list/种类id/页码/排序方式
-# /list/种类id/页码?sort=排序方式 <-- 使用这种url方式
+# /list/种类id/页码?sort=排序方式&price=价格区间&stock=1 <-- 使用这种url方式
 class ListView(View):
     """列表页"""
 
     def get(self, request, type_id, page):
         """显示列表页"""
 
-        # 获取种类信息
-        try:
-            type = GoodsType.objects.get(id=type_id)
-        except ObjectDoesNotExist:
+        # 获取用户购物车中商品的数目(命令先排队，读取结果时和本次请求的其他redis命令一起发送)
+        cart_count = get_cart_count(request)
+
+        # 获取种类、分页后的商品、页码、新品信息
+        context = build_list_context(type_id, request.GET.get('sort'), page,
+                                     after=request.GET.get('after'), before=request.GET.get('before'),
+                                     filters=facets.parse_filters(request.GET))
+        if context is None:
             # 种类不存在
             return redirect(reverse('goods:index'))
 
-        # 获取商品的分类信息
-        types = GoodsType.objects.all()
-
-        # 获取排序的方式 # 获取分类商品的信息
-        # sort=default 按照默认id排序
-        # sort=price 按照商品价格排序
-        # sort=hot 按照商品销量排序
-        sort = request.GET.get('sort')
-
-        if sort == 'price':
-            skus = GoodsSKU.objects.filter(type=type).order_by('price')
-        elif sort == 'hot':
-            skus = GoodsSKU.objects.filter(type=type).order_by('-sales')
-        else:
-            sort = 'default'
-            skus = GoodsSKU.objects.filter(type=type).order_by('-id')
+        # 组织模板上下文
+        context.update(cart_count=cart_count.value)
 
-        # 对数据进行分页(每页显示1件商品)
-        paginator = Paginator(skus, 1)
+        # 使用模板
+        return render(request, 'list.html', context)
 
-        # 获取第page页的内容(做一些容错处理)
-        try:
-            page = int(page)
-        except Exception as e:
-            page = 1
 
-        if page > paginator.num_pages:
-            page = 1
+# /search/?q=搜索词&page=页码&type=种类id&price=价格区间&stock=1
+class SearchView(View):
+    """商品搜索(代替haystack的SearchView，搜索结果按规范化之后的搜索词缓存)"""
 
-        # 获取第page页的Page实例对象
-        skus_page = paginator.page(page)
-
-        # todo: 进行页码的控制，页面上最多显示5个页码
-        # 1.总页数小于5页，页面上显示所有页码
-        # 2.如果当前页是前3页，显示1-5页
-        # 3.如果当前页是后3页，显示后5页
-        # 4.其他情况，显示当前页的前2页，当前页，当前页的后2页
-        num_pages = paginator.num_pages
-        if num_pages < 5:
-            pages = range(1, num_pages + 1)
-        elif page <= 3:
-            pages = range(1, 6)
-        elif num_pages - page <= 2:
-            pages = range(num_pages - 4, num_pages + 1)
+    def get(self, request):
+        """显示搜索结果"""
+
+        # 获取搜索词和页码
+        query = request.GET.get('q', '')
+        try:
+            page = int(request.GET.get('page', 1))
+        except ValueError:
+            page = 1
+        if page < 1:
+            # 0和负数的页码在切片时会变成负数下标
+            raise Http404('页码不存在')
+
+        # 获取分面过滤条件
+        filters = facets.parse_filters(request.GET, with_type=True)
+        types = get_goods_types()
+
+        # 过滤搜索结果并计算各个过滤选项的数目
+        per_page = settings.HAYSTACK_SEARCH_RESULTS_PER_PAGE
+        # 计数和过滤后的结果按搜索词和过滤条件缓存，只有缓存失效时才查询前MAX_RESULTS条结果(一次whoosh查询)
+        all_ids, total, facet_counts, capped = facets.search_cached(query, filters, [typ.id for typ in types])
+        if filters or page * per_page <= len(all_ids) or not capped:
+            # 在(过滤后的)前MAX_RESULTS条结果中分页
+            sku_ids = all_ids[(page - 1) * per_page:page * per_page]
         else:
-            pages = range(page - 2, page + 3)
+            # 没有过滤条件时超过前MAX_RESULTS条结果的页: 获取这一页商品的id(按页缓存)
+            sku_ids, total = search_cache.search(query, page, per_page)
 
-        # 获取新品信息
-        new_skus = GoodsSKU.objects.filter(type=type).order_by('-create_time')[:2]
+        # 分页(只需要结果总数)
+        paginator = Paginator(range(total), per_page)
+        try:
+            skus_page = paginator.page(page)
+        except InvalidPage:
+            raise Http404('页码不存在')
 
-        # 获取用户购物车中商品的数目
-        user = request.user
-        cart_count = 0
-        if user.is_authenticated:
-            # 用户已登录
-            conn = get_redis_connection('default')
-            cart_key = 'cart_%d' % user.id
-            cart_count = conn.hlen(cart_key)
+        # 一次查询出这一页的商品，保持搜索结果的顺序
+        skus_page.object_list = SKULoader().load_many(sku_ids)
+
+        if total and page == 1:
+            # 记录有结果的搜索词，作为搜索提示
+            suggest.record_query(query)
 
         # 组织模板上下文
-        context = {'type': type, 'types': types,
-                   'skus_page': skus_page,
-                   'new_skus': new_skus,
-                   'cart_count': cart_count,
-                   'pages': pages,
-                   'sort': sort}
+        context = {'query': query,
+                   'page': skus_page,
+                   'paginator': paginator,
+                   'facets': facets.build_facets(facet_counts, filters, types),
+                   'capped': capped,
+                   'max_results': search_cache.MAX_RESULTS,
+                   'filter_query': urlencode(filters)}
 
         # 使用模板
-        return render(request, 'list.html', context)
+        return render(request, 'search/search.html', context)
+
+
+# /header
+# 采用ajax get请求
+class HeaderView(View):
+    """静态页面中的用户信息: 用户名、购物车中商品的条目数，同时设置csrftoken cookie"""
+
+    @method_decorator(ensure_csrf_cookie)
+    def get(self, request):
+        user = request.user
+        username = user.username if user.is_authenticated else ''
+        return JsonResponse({'res': 1, 'username': username, 'cart_count': get_cart_count(request).value})
+
+
+# /search/suggest?q=输入的内容
+class SuggestView(View):
+    """搜索框输入提示"""
+
+    def get(self, request):
+        """返回以输入内容开头的提示词(按销量、搜索次数排序)"""
+
+        suggestions = suggest.suggest(request.GET.get('q', ''))
+        return JsonResponse({'res': 1, 'suggestions': suggestions})
@@ -0,0 +1,128 @@
+from datetime import datetime
+from django.db import transaction
+from django.db.models import F, Q, Case, When, Value, IntegerField
+from django_redis import get_redis_connection
+from goods.models import GoodsSKU
+from goods import sku_index, sku_cache, suggest
+from order.models import OrderInfo, OrderGoods
+from cart.utils import cart_key, cart_delete
+
+
+# 按集合创建订单: 不管订单中有几件商品，数据库和redis的往返次数都是固定的
+#   1. HMGET 一次取出所有商品在购物车中的数量
+#   2. 一次查询所有商品(悲观锁版本 SELECT ... FOR UPDATE)
+#   3. 一条UPDATE同时扣减所有商品的库存、累加销量，WHERE中每个商品都带有库存条件，
+#      受影响的行数小于商品数说明有商品的库存在查询之后被其他订单扣减了
+#   4. 一次查询读回更新之后的库存(用于更新有库存的商品集合)
+#   5. bulk_create插入所有订单商品，订单信息直接以最终的总数量和总价格插入
+# 乐观锁版本在库存条件不满足时回滚到保存点重新查询，最多尝试3次
+
+
+class OrderCommitError(Exception):
+    """创建订单失败，res和errmsg是返回给前端的错误码和错误信息"""
+
+    def __init__(self, res, errmsg):
+        super().__init__(errmsg)
+        self.res = res
+        self.errmsg = errmsg
+
+
+def read_counts(user_id, sku_ids):
+    """一次取出购物车中商品的数量，返回{商品id: 数量}"""
+
+    counts = get_redis_connection('default').hmget(cart_key(user_id), sku_ids)
+    result = {}
+    for sku_id, count in zip(sku_ids, counts):
+        if count is None:
+            # 商品不在购物车中
+            raise OrderCommitError(4, '商品不存在')
+        result[sku_id] = int(count)
+    return result
+
+
+def load_skus(sku_ids, lock):
+    """一次查询所有商品，lock为True时加锁(按id的顺序加锁，避免并发的订单互相等待造成死锁)"""
+
+    skus = GoodsSKU.objects.filter(id__in=sku_ids).order_by('id')
+    if lock:
+        skus = skus.select_for_update()
+    skus = {sku.id: sku for sku in skus}
+    if len(skus) != len(sku_ids):
+        raise OrderCommitError(4, '商品不存在')
+    return skus
+
+
+def apply_stock(skus, counts):
+    """一条UPDATE扣减所有商品的库存并累加销量，返回是否所有商品都更新成功
+
+    update df_goods_sku set stock=stock-case id when ... end, sales=sales+case id when ... end
+    where (id=1 and stock>=数量1) or (id=2 and stock>=数量2) ...
+    """
+
+    condition = Q()
+    whens = []
+    for sku_id, count in counts.items():
+        condition |= Q(id=sku_id, stock__gte=count)
+        whens.append(When(id=sku_id, then=Value(count)))
+    delta = Case(*whens, default=Value(0), output_field=IntegerField())
+    updated = GoodsSKU.objects.filter(condition).update(stock=F('stock') - delta, sales=F('sales') + delta,
+                                                        update_time=datetime.now().date())
+    return updated == len(counts)
+
+
+@transaction.atomic
+def create_order(user, addr, pay_method, sku_ids, transit_price=10, lock=True, retries=3):
+    """创建订单并扣减库存，返回订单；失败时抛出OrderCommitError，已经执行的修改全部回滚
+
+    事务提交之后更新商品的排序索引、有库存的商品集合、热点商品缓存和搜索提示词(UPDATE不会触发post_save信号)
+    """
+
+    # 去掉重复的商品id，保持顺序
+    try:
+        sku_ids = list(dict.fromkeys(int(sku_id) for sku_id in sku_ids))
+    except (TypeError, ValueError):
+        raise OrderCommitError(4, '商品不存在')
+    if not sku_ids:
+        raise OrderCommitError(1, '参数不完整')
+    counts = read_counts(user.id, sku_ids)
+
+    for i in range(retries):
+        try:
+            with transaction.atomic():
+                skus = load_skus(sku_ids, lock)
+                for sku_id, count in counts.items():
+                    if count > skus[sku_id].stock:
+                        raise OrderCommitError(6, '商品库存不足')
+                if not apply_stock(skus, counts):
+                    # 只有不加锁时才会发生: 查询之后库存被其他订单修改了，回滚已经更新的商品
+                    raise OrderCommitError(7, '下单失败2')
+                # 更新之后的库存(不加锁时其他订单可能同时扣减了库存，不能用查询时的库存计算)
+                stocks = list(GoodsSKU.objects.filter(id__in=sku_ids).values_list('id', 'stock'))
+        except OrderCommitError as e:
+            if e.res != 7 or i == retries - 1:
+                raise
+            continue
+        break
+
+    # 订单id: 20171122181630+用户id
+    order_id = datetime.now().strftime('%Y%m%d%H%M%S') + str(user.id)
+    total_count = sum(counts.values())
+    total_price = sum(skus[sku_id].price * count for sku_id, count in counts.items())
+    order = OrderInfo.objects.create(order_id=order_id,
+                                     user=user,
+                                     addr=addr,
+                                     pay_method=pay_method,
+                                     total_count=total_count,
+                                     total_price=total_price,
+                                     transit_price=transit_price)
+    OrderGoods.objects.bulk_create([OrderGoods(order=order, sku=skus[sku_id], count=count, price=skus[sku_id].price)
+                                    for sku_id, count in counts.items()])
+
+    sales = [(skus[sku_id].type_id, sku_id, count) for sku_id, count in counts.items()]
+    transaction.on_commit(lambda: sku_index.incr_sales(sales))
+    transaction.on_commit(lambda: sku_index.set_stock(stocks))
+    transaction.on_commit(lambda: sku_cache.invalidate(sku_ids))
+    transaction.on_commit(lambda: suggest.update_skus(sku_ids, reload=False))
+    # 清除用户购物车中对应的记录(同时更新购物车的总件数)
+    transaction.on_commit(lambda: cart_delete(user.id, *sku_ids))
+    return order
@@ -0,0 +1,72 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django_redis import get_redis_connection
+from user.models import User, Address
+from goods.models import GoodsSKU
+from cart.utils import cart_key
+from order.commit import create_order
+
+
+class Command(BaseCommand):
+    """按订单中的商品条目数压测订单创建
+
+    每次创建订单都在回滚的事务中执行，不会修改库存和订单；压测期间临时改写该用户的购物车，结束后恢复
+    python manage.py bench_order_commit --user 用户名 [--lines 1 5 10 20 50] [--repeat 20]
+    """
+
+    help = '压测不同商品条目数的订单创建，输出p50/p99延迟和每个订单的sql语句数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='下单的用户名(需要有收货地址)')
+        parser.add_argument('--lines', type=int, nargs='+', default=[1, 5, 10, 20, 50], help='订单中的商品条目数')
+        parser.add_argument('--repeat', type=int, default=20, help='每个条目数的下单次数')
+        parser.add_argument('--optimistic', action='store_true', help='使用乐观锁版本(默认悲观锁版本)')
+
+    def commit_once(self, user, addr, sku_ids, lock):
+        """在回滚的事务中创建一个订单，返回(耗时, sql语句数)"""
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            with transaction.atomic():
+                create_order(user, addr, 3, sku_ids, lock=lock)
+                elapsed = time.perf_counter() - start
+                transaction.set_rollback(True)
+        return elapsed, len(queries)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('用户不存在: %s' % options['user'])
+        addr = Address.objects.get_default_address(user) or Address.objects.filter(user=user).first()
+        if addr is None:
+            raise CommandError('用户没有收货地址')
+
+        lines = options['lines']
+        sku_ids = list(GoodsSKU.objects.filter(stock__gt=0).order_by('id').values_list('id', flat=True)[:max(lines)])
+        if len(sku_ids) < max(lines):
+            raise CommandError('有库存的商品只有%d件' % len(sku_ids))
+
+        conn = get_redis_connection('default')
+        key = cart_key(user.id)
+        backup = conn.dump(key)
+        try:
+            # 每件商品买1件
+            conn.delete(key)
+            conn.hset(key, mapping={sku_id: 1 for sku_id in sku_ids})
+
+            self.stdout.write('%8s %10s %10s %10s' % ('lines', 'p50(ms)', 'p99(ms)', 'queries'))
+            for n in lines:
+                results = [self.commit_once(user, addr, sku_ids[:n], not options['optimistic'])
+                           for i in range(options['repeat'])]
+                latencies = sorted(elapsed for elapsed, queries in results)
+                p50 = latencies[len(latencies) // 2] * 1000
+                p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+                self.stdout.write('%8d %10.2f %10.2f %10d' % (n, p50, p99, results[-1][1]))
+        finally:
+            # 恢复用户原来的购物车
+            conn.delete(key)
+            if backup is not None:
+                conn.restore(key, 0, backup)
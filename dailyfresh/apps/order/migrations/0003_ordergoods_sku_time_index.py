@@ -0,0 +1,18 @@
+# Generated by Django 4.0 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0002_goodssku_list_indexes'),
+        ('order', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ordergoods',
+            index=models.Index(fields=['sku', 'create_time'], name='df_order_goods_sku_time'),
+        ),
+    ]
@@ -77,3 +77,7 @@ class OrderGoods(BaseModel):
         db_table = 'df_order_goods'
         verbose_name = '订单商品'
         verbose_name_plural = verbose_name
+        # 详情页按时间倒序分页查询商品的评论
+        indexes = [
+            models.Index(fields=['sku', 'create_time'], name='df_order_goods_sku_time'),
+        ]
@@ -1,3 +1,110 @@
+from unittest import mock
 from django.test import TestCase
+from django_redis import get_redis_connection
+
+from user.models import User, Address
+from goods.models import GoodsType, Goods, GoodsSKU
+from order.models import OrderInfo, OrderGoods
+from order import commit
+from order.commit import create_order, OrderCommitError
+from cart.utils import cart_key, cart_total_key
 
 # Create your tests here.
+
+
+class CreateOrderTest(TestCase):
+    """按集合创建订单的测试(需要redis)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('order_test', 'order_test@example.com', 'password')
+        self.addr = Address.objects.create(user=self.user, receiver='收件人', addr='地址', phone='13800000000')
+        typ = GoodsType.objects.create(name='水果', logo='fruit', image='type/fruit.jpg')
+        goods = Goods.objects.create(name='草莓')
+        self.skus = [GoodsSKU.objects.create(type=typ, goods=goods, name='商品%d' % i, desc='简介', price=price,
+                                             unite='500g', image='goods/%d.jpg' % i, stock=stock)
+                     for i, (price, stock) in enumerate([(10, 5), (25.5, 3), (8, 10)])]
+        self.conn = get_redis_connection('default')
+        self.clear_cart()
+
+    def tearDown(self):
+        self.clear_cart()
+
+    def clear_cart(self):
+        self.conn.delete(cart_key(self.user.id), cart_total_key(self.user.id))
+
+    def set_cart(self, counts):
+        self.conn.hset(cart_key(self.user.id), mapping={sku.id: count for sku, count in zip(self.skus, counts)})
+
+    def stocks(self):
+        return [sku.stock for sku in GoodsSKU.objects.filter(id__in=[sku.id for sku in self.skus]).order_by('id')]
+
+    def test_multi_line_order(self):
+        """多件商品的订单: 总数量、总价格、订单商品和库存、销量都正确，提交后更新有库存的商品集合"""
+
+        self.set_cart([2, 3, 1])
+        with mock.patch('order.commit.sku_index.set_stock') as set_stock, \
+                self.captureOnCommitCallbacks(execute=True):
+            order = create_order(self.user, self.addr, 3, [sku.id for sku in self.skus], lock=False)
+
+        order = OrderInfo.objects.get(order_id=order.order_id)
+        self.assertEqual(order.total_count, 6)
+        self.assertEqual(order.total_price, 2 * 10 + 3 * 25.5 + 1 * 8)
+        lines = {line.sku_id: (line.count, line.price) for line in OrderGoods.objects.filter(order=order)}
+        self.assertEqual(lines, {self.skus[0].id: (2, 10), self.skus[1].id: (3, 25.5), self.skus[2].id: (1, 8)})
+        self.assertEqual(self.stocks(), [3, 0, 9])
+        self.assertEqual([sku.sales for sku in GoodsSKU.objects.filter(id__in=lines).order_by('id')], [2, 3, 1])
+        self.assertEqual(sorted(set_stock.call_args[0][0]), sorted(zip([sku.id for sku in self.skus], [3, 0, 9])))
+        # 购物车中的商品已经删除
+        self.assertFalse(self.conn.exists(cart_key(self.user.id)))
+
+    def test_insufficient_stock_rolls_back(self):
+        """有一件商品库存不足时整个订单回滚"""
+
+        self.set_cart([2, 4, 1])
+        for lock in (True, False):
+            with self.assertRaises(OrderCommitError) as cm:
+                create_order(self.user, self.addr, 3, [sku.id for sku in self.skus], lock=lock)
+            self.assertEqual(cm.exception.res, 6)
+        self.assertEqual(self.stocks(), [5, 3, 10])
+        self.assertFalse(OrderInfo.objects.exists())
+        self.assertFalse(OrderGoods.objects.exists())
+        self.assertEqual(self.conn.hlen(cart_key(self.user.id)), 3)
+
+    def test_optimistic_retry(self):
+        """查询之后库存被其他订单扣减时回滚并重新查询"""
+
+        load_skus = commit.load_skus
+        calls = []
+
+        def concurrent_load(sku_ids, lock):
+            skus = load_skus(sku_ids, lock)
+            calls.append(sku_ids)
+            if len(calls) == 1:
+                # 第一次查询之后其他订单买走了第二件商品的全部库存(会随第一次尝试一起回滚)
+                GoodsSKU.objects.filter(id=self.skus[1].id).update(stock=0)
+            return skus
+
+        self.set_cart([1, 1, 1])
+        with mock.patch('order.commit.load_skus', side_effect=concurrent_load):
+            order = create_order(self.user, self.addr, 3, [sku.id for sku in self.skus], lock=False)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.stocks(), [4, 2, 9])
+        self.assertEqual(OrderGoods.objects.filter(order=order).count(), 3)
+
+    def test_optimistic_gives_up_after_retries(self):
+        """每次尝试都失败时返回下单失败，库存不变"""
+
+        def always_stale(sku_ids, lock):
+            skus = {sku.id: sku for sku in GoodsSKU.objects.filter(id__in=sku_ids)}
+            # 查询到的库存比实际多: 条件更新总是失败
+            skus[self.skus[1].id].stock = 100
+            return skus
+
+        self.set_cart([1, 10, 1])
+        with mock.patch('order.commit.load_skus', side_effect=always_stale) as load:
+            with self.assertRaises(OrderCommitError) as cm:
+                create_order(self.user, self.addr, 3, [sku.id for sku in self.skus], lock=False)
+        self.assertEqual(cm.exception.res, 7)
+        self.assertEqual(load.call_count, 3)
+        self.assertEqual(self.stocks(), [5, 3, 10])
+        self.assertFalse(OrderInfo.objects.exists())
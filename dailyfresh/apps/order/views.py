@@ -2,16 +2,21 @@ from django.shortcuts import render, redirect
 from django.urls import reverse
 from django.http import JsonResponse
 from django.db import transaction
+from django.db.models import F
 from django.conf import settings
 from django.views.generic import View
 from django.core.exceptions import ObjectDoesNotExist
 
 from user.models import Address
 from goods.models import GoodsSKU
+from goods.loaders import SKULoader
+from cart.utils import touch_cart
+from order.commit import create_order, OrderCommitError
 from order.models import OrderInfo, OrderGoods
 
 from django_redis import get_redis_connection
 from utils.mixin import LoginRequiredMixin
+from utils.redis_batch import get_redis_batch
 from datetime import datetime
 # from alipay import AliPay
 import os
@@ -51,19 +56,29 @@ class OrderPlaceView(LoginRequiredMixin, View):
             # 跳转到购物车页面
             return redirect(reverse('cart:show'))
 
-        conn = get_redis_connection('default')
+        batch = get_redis_batch(request)
         cart_key = 'cart_%d' % user.id
 
+        # 获取用户所要购买的商品的数量(所有商品的命令排队，读取第一个结果时一次发送)
+        counts = [batch.hget(cart_key, sku_id) for sku_id in sku_ids]
+        touch_cart(batch, user.id)
+
+        # 一次查询出所有要购买的商品的信息
+        loader = SKULoader(cached=True)
+        items = [(loader.load(sku_id), count) for sku_id, count in zip(sku_ids, counts)]
+
         skus = []
         # 保存商品的总件数和总价格
         total_count = 0
         total_price = 0
         # 遍历sku_ids获取用户要购买的商品的信息
-        for sku_id in sku_ids:
-            # 根据商品的id获取商品的信息
-            sku = GoodsSKU.objects.get(id=sku_id)
+        for sku, count in items:
+            sku = sku.value
             # 获取用户所要购买的商品的数量
-            count = conn.hget(cart_key, sku_id)
+            count = count.value
+            if sku is None or count is None:
+                # 商品已经删除或者不在购物车中，跳过
+                continue
             # 计算商品的小计
             amount = sku.price * int(count)
             # 动态给sku增加属性count,保存购买商品的数量
@@ -85,8 +100,12 @@ class OrderPlaceView(LoginRequiredMixin, View):
         # 获取用户的收件地址
         addrs = Address.objects.filter(user=user)
 
+        if not skus:
+            # 没有可以购买的商品，跳转到购物车页面
+            return redirect(reverse('cart:show'))
+
         # 组织上下文
-        sku_ids = ','.join(sku_ids)  # [1,25]->1,25
+        sku_ids = ','.join(str(sku.id) for sku in skus)  # [1,25]->1,25
         context = {'skus': skus,
                    'total_count': total_count,
                    'total_price': total_price,
@@ -137,87 +156,14 @@ class OrderCommitView1(View):
             return JsonResponse({'res': 3, 'errmsg': '地址非法'})
 
         # todo: 创建订单核心业务
-
-        # 组织参数
-        # 订单id: 20171122181630+用户id
-        order_id = datetime.now().strftime('%Y%m%d%H%M%S') + str(user.id)
-
-        # 运费
-        transit_price = 10
-
-        # 总数目和总金额
-        total_count = 0
-        total_price = 0
-
-        # 设置事务保存点
-        save_id = transaction.savepoint()
+        # 一次读取购物车、一次查询并锁定商品、一条UPDATE扣减库存、一次插入所有订单商品(见order.commit)
         try:
-            # todo: 向df_order_info表中添加一条记录
-            order = OrderInfo.objects.create(order_id=order_id,
-                                             user=user,
-                                             addr=addr,
-                                             pay_method=pay_method,
-                                             total_count=total_count,
-                                             total_price=total_price,
-                                             transit_price=transit_price)
-
-            # todo: 用户的订单中有几个商品，需要向df_order_goods表中加入几条记录
-            conn = get_redis_connection('default')
-            cart_key = 'cart_%d' % user.id
-
-            sku_ids = sku_ids.split(',')
-            for sku_id in sku_ids:
-                # 获取商品的信息
-                try:
-                    # select * from df_goods_sku where id=sku_id for update;(加锁)
-                    sku = GoodsSKU.objects.select_for_update().get(id=sku_id)
-                except:
-                    # 商品不存在
-                    transaction.savepoint_rollback(save_id)
-                    return JsonResponse({'res': 4, 'errmsg': '商品不存在'})
-
-                print('user:%d stock:%d' % (user.id, sku.stock))
-                # import time
-                # time.sleep(10)
-
-                # 从redis中获取用户所要购买的商品的数量
-                count = conn.hget(cart_key, sku_id)
-
-                # todo: 判断商品的库存
-                if int(count) > sku.stock:
-                    transaction.savepoint_rollback(save_id)
-                    return JsonResponse({'res': 6, 'errmsg': '商品库存不足'})
-
-                # todo: 向df_order_goods表中添加一条记录
-                OrderGoods.objects.create(order=order,
-                                          sku=sku,
-                                          count=count,
-                                          price=sku.price)
-
-                # todo: 更新商品的库存和销量
-                sku.stock -= int(count)
-                sku.sales += int(count)
-                sku.save()
-
-                # todo: 累加计算订单商品的总数量和总价格
-                amount = sku.price * int(count)
-                total_count += int(count)
-                total_price += amount
-
-            # todo: 更新订单信息表中的商品的总数量和总价格
-            order.total_count = total_count
-            order.total_price = total_price
-            order.save()
+            create_order(user, addr, pay_method, sku_ids.split(','), lock=True)
+        except OrderCommitError as e:
+            return JsonResponse({'res': e.res, 'errmsg': e.errmsg})
         except Exception as e:
-            transaction.savepoint_rollback(save_id)
             return JsonResponse({'res': 7, 'errmsg': '下单失败'})
 
-        # 提交事务
-        transaction.savepoint_commit(save_id)
-
-        # todo: 清除用户购物车中对应的记录
-        conn.hdel(cart_key, *sku_ids)
-
         # 返回应答
         return JsonResponse({'res': 5, 'message': '创建成功'})
 
@@ -256,102 +202,14 @@ class OrderCommitView(View):
             return JsonResponse({'res': 3, 'errmsg': '地址非法'})
 
         # todo: 创建订单核心业务
-
-        # 组织参数
-        # 订单id: 20171122181630+用户id
-        order_id = datetime.now().strftime('%Y%m%d%H%M%S') + str(user.id)
-
-        # 运费
-        transit_price = 10
-
-        # 总数目和总金额
-        total_count = 0
-        total_price = 0
-
-        # 设置事务保存点
-        save_id = transaction.savepoint()
+        # 一次读取购物车、一次查询商品、一条UPDATE扣减库存、一次插入所有订单商品(见order.commit)
         try:
-            # todo: 向df_order_info表中添加一条记录
-            order = OrderInfo.objects.create(order_id=order_id,
-                                             user=user,
-                                             addr=addr,
-                                             pay_method=pay_method,
-                                             total_count=total_count,
-                                             total_price=total_price,
-                                             transit_price=transit_price)
-
-            # todo: 用户的订单中有几个商品，需要向df_order_goods表中加入几条记录
-            conn = get_redis_connection('default')
-            cart_key = 'cart_%d' % user.id
-
-            sku_ids = sku_ids.split(',')
-            for sku_id in sku_ids:
-                for i in range(3):
-                    # 获取商品的信息
-                    try:
-                        sku = GoodsSKU.objects.get(id=sku_id)
-                    except:
-                        # 商品不存在
-                        transaction.savepoint_rollback(save_id)
-                        return JsonResponse({'res': 4, 'errmsg': '商品不存在'})
-
-                    # 从redis中获取用户所要购买的商品的数量
-                    count = conn.hget(cart_key, sku_id)
-
-                    # todo: 判断商品的库存
-                    if int(count) > sku.stock:
-                        transaction.savepoint_rollback(save_id)
-                        return JsonResponse({'res': 6, 'errmsg': '商品库存不足'})
-
-                    # todo: 更新商品的库存和销量
-                    orgin_stock = sku.stock
-                    new_stock = orgin_stock - int(count)
-                    new_sales = sku.sales + int(count)
-
-                    # print('user:%d times:%d stock:%d' % (user.id, i, sku.stock))
-                    # import time
-                    # time.sleep(10)
-
-                    # update df_goods_sku set stock=new_stock, sales=new_sales
-                    # where id=sku_id and stock = orgin_stock
-
-                    # 返回受影响的行数
-                    res = GoodsSKU.objects.filter(id=sku_id, stock=orgin_stock).update(stock=new_stock, sales=new_sales)
-                    if res == 0:
-                        if i == 2:
-                            # 尝试的第3次
-                            transaction.savepoint_rollback(save_id)
-                            return JsonResponse({'res': 7, 'errmsg': '下单失败2'})
-                        continue
-
-                    # todo: 向df_order_goods表中添加一条记录
-                    OrderGoods.objects.create(order=order,
-                                              sku=sku,
-                                              count=count,
-                                              price=sku.price)
-
-                    # todo: 累加计算订单商品的总数量和总价格
-                    amount = sku.price * int(count)
-                    total_count += int(count)
-                    total_price += amount
-
-                    # 跳出循环
-                    break
-
-            # todo: 更新订单信息表中的商品的总数量和总价格
-            order.total_count = total_count
-            order.total_price = total_price
-            order.save()
+            create_order(user, addr, pay_method, sku_ids.split(','), lock=False)
+        except OrderCommitError as e:
+            return JsonResponse({'res': e.res, 'errmsg': e.errmsg})
         except Exception as e:
-            transaction.savepoint_rollback(save_id)
             return JsonResponse({'res': 7, 'errmsg': '下单失败'})
 
-        # 提交事务
-        transaction.savepoint_commit(save_id)
-
-        # todo: 清除用户购物车中对应的记录
-        conn.hdel(cart_key, *sku_ids)
-
         # 返回应答
         return JsonResponse({'res': 5, 'message': '创建成功'})
 
@@ -603,6 +461,12 @@ class CommentView(LoginRequiredMixin, View):
             except OrderGoods.DoesNotExist:
                 continue
 
+            # 更新商品的评论数目(先于保存评论，保存评论时会使详情页缓存失效)
+            if content and not order_goods.comment:
+                GoodsSKU.objects.filter(id=order_goods.sku_id).update(comment_count=F('comment_count') + 1)
+            elif order_goods.comment and not content:
+                GoodsSKU.objects.filter(id=order_goods.sku_id).update(comment_count=F('comment_count') - 1)
+
             order_goods.comment = content
             order_goods.save()
 
@@ -11,8 +11,11 @@ from django.core.mail import send_mail
 from celery_tasks.tasks import send_register_active_email, generate_static_index_html
 from django.contrib.auth import authenticate, login, logout
 from utils.mixin import LoginRequiredMixin
-from django_redis import get_redis_connection
+from utils.redis_batch import get_redis_batch
 from goods.models import GoodsSKU
+from goods.loaders import SKULoader
+from cart import guest, archive
+from cart.utils import merge_guest_cart, HISTORY_TTL
 from order.models import OrderInfo, OrderGoods
 from django.core.paginator import Paginator
 
@@ -255,6 +258,13 @@ class LoginView(View):
                 # 跳转到next_url
                 response = redirect(next_url)  # HttpResponseRedirect
 
+                # 把未登录时cookie中的购物车合并到用户的购物车(一次查询商品、一次redis往返)
+                # 先恢复长时间没有访问而归档到数据库的购物车
+                archive.restore(user.id)
+                if guest.COOKIE_NAME in request.COOKIES:
+                    merge_guest_cart(request, user.id)
+                    guest.clear(response)
+
                 # 判断是否需要记住用户名
                 remember = request.POST.get('remember')
 
@@ -300,12 +310,12 @@ class UserInfoView(LoginRequiredMixin, View):
         # 获取用户的历史浏览记录
         # from redis import StrictRedis
         # sr = StrictRedis(host='172.16.179.130', port='6379', db=9)
-        con = get_redis_connection('default')  # 使用setting.py中默认的redis配置
-
         history_key = 'history_%d' % user.id
 
-        # 获取用户最新浏览的5个商品的id
-        sku_ids = con.lrange(history_key, 0, 4)  # [2,3,1]
+        # 获取用户最新浏览的5个商品的id，同时延长浏览记录的过期时间(命令先排队，读取结果时一起发送)
+        batch = get_redis_batch(request)
+        sku_ids = batch.lrange(history_key, 0, 4)  # [2,3,1]
+        batch.expire(history_key, HISTORY_TTL)
 
         # 从数据库中查询用户浏览的商品的具体信息
         # goods_li = GoodsSKU.objects.filter(id__in=sku_ids)
@@ -316,11 +326,8 @@ class UserInfoView(LoginRequiredMixin, View):
         #         if a_id == goods.id:
         #             goods_res.append(goods)
 
-        # 遍历获取用户浏览的商品信息
-        goods_li = []
-        for id in sku_ids:
-            goods = GoodsSKU.objects.get(id=id)
-            goods_li.append(goods)
+        # 一次查询出用户浏览的商品信息，保持浏览的顺序，跳过已经删除的商品
+        goods_li = SKULoader().load_many(sku_ids.value)
 
         # 组织上下文
         context = {'page': 'user',
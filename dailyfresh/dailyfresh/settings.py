@@ -56,6 +56,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'utils.middleware.RedisBatchMiddleware',  # 请求范围内的redis命令批处理request.redis
 ]
 
 ROOT_URLCONF = 'dailyfresh.urls'
@@ -175,6 +176,8 @@ CACHES = {
 # 配置session存储
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "default"
+# 会话在redis中的过期时间(两周)，要短于购物车归档的时间(cart.archive.ARCHIVE_AFTER)
+SESSION_COOKIE_AGE = 14 * 24 * 3600
 
 
 # Django authenticate已经包含is_active判断后 无法单独再进行active判断问题
@@ -202,11 +205,21 @@ HAYSTACK_CONNECTIONS = {
         'ENGINE': 'haystack.backends.whoosh_cn_backend.WhooshEngine',  # 使用自定义用jieba中文分词库修改过的引擎
         # 索引文件路径
         'PATH': Path.joinpath(BASE_DIR, 'whoosh_index'),
-    }
+    },
+    # 内存倒排索引(mmap映射快照文件，各进程共享)，把default的ENGINE和PATH改成这里的配置即可切换
+    # 生成快照: python manage.py rebuild_search_index --using memory
+    'memory': {
+        'ENGINE': 'utils.memory_search_backend.MemoryEngine',
+        'PATH': Path.joinpath(BASE_DIR, 'search_snapshot', 'goods.idx'),
+        # 没有用来提供搜索时不随商品修改增量更新(每次更新都要重写整个快照)
+        'INCREMENTAL': False,
+    },
 }
 
 # 当添加、修改、删除数据时，自动生成索引
-HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
+# HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
+# 数据变化时放入队列，由celery批量更新索引(只修改库存、销量时不更新)
+HAYSTACK_SIGNAL_PROCESSOR = 'goods.search_signals.QueuedSignalProcessor'
 
 # 控制搜索结果每页显示的数量
 HAYSTACK_SEARCH_RESULTS_PER_PAGE = 1
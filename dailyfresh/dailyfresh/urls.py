@@ -23,6 +23,9 @@ urlpatterns = [
     path('cart/', include(('cart.urls', 'cart'), namespace='cart')),  # 购物车模块
     path('order/', include(('order.urls', 'order'), namespace='order')),  # 订单模块
     path('tinymce/', include('tinymce.urls')),  # 富文本编辑器
-    path('search/', include('haystack.urls')),  # 全文检索框架
+    # path('search/', include('haystack.urls')),  # 全文检索框架(改为goods.views.SearchView，缓存搜索结果)
+    # 商品和购物车接口的异步版本(使用asgi部署时)
+    path('async/cart/', include(('cart.async_urls', 'cart_async'), namespace='cart_async')),
+    path('async/', include(('goods.async_urls', 'goods_async'), namespace='goods_async')),
     path('', include(('goods.urls', 'goods'), namespace='goods')),  # 商品模块,作为主页
 ]
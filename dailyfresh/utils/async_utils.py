@@ -0,0 +1,49 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from redis import asyncio as aioredis
+
+
+# 每个事件循环一个异步redis客户端(连接池不能跨事件循环使用)
+_clients = {}
+
+
+def get_async_redis():
+    """获取异步redis客户端，使用和django缓存相同的redis配置"""
+
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        config = settings.CACHES['default']
+        client = aioredis.Redis.from_url(config['LOCATION'], password=config['OPTIONS'].get('PASSWORD'))
+        _clients[loop] = client
+    return client
+
+
+async def run_sync(func, *args, **kwargs):
+    """在线程池中执行同步代码(django4.0的ORM还不支持异步)
+
+    thread_sensitive=False: 每个调用使用线程池中的线程，多个查询可以用asyncio.gather并发执行
+    线程池中的线程各自持有数据库连接，不会经过request_started/request_finished，
+    所以在执行前后调用close_old_connections，关闭超过CONN_MAX_AGE或者已经不可用的连接
+    """
+
+    def call():
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return await sync_to_async(call, thread_sensitive=False)()
+
+
+async def get_user(request):
+    """获取登录的用户(request.user需要查询session和数据库)，未登录时返回None"""
+
+    def load_user():
+        user = request.user
+        return user if user.is_authenticated else None
+
+    return await run_sync(load_user)
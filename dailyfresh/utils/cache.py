@@ -0,0 +1,113 @@
+import time
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+
+class VersionedCache(object):
+    """带版本号的缓存(防止缓存击穿)
+
+    缓存的数据中记录了生成时的版本号和过期时间，数据本身比过期时间保存得更久:
+    1.版本号和数据用一次get_many取回，版本号一致并且没有过期就直接使用(hit)
+    2.版本号不一致或者已经过期时，只有拿到锁的一个请求重新生成数据(rebuild)，
+      其余请求继续使用上一个版本的数据(stale)，直到新版本的数据生成完毕
+    3.缓存中完全没有数据时，没拿到锁的请求等待拿到锁的请求生成完毕(miss)
+    """
+
+    def __init__(self, name, builder, timeout=3600, stale_timeout=24*3600, lock_timeout=30):
+        self.name = name
+        self.builder = builder  # 生成数据的函数
+        self.timeout = timeout  # 数据的有效时间
+        self.stale_timeout = stale_timeout  # 数据在缓存中的保存时间(过期后还可以作为旧数据使用)
+        self.lock_timeout = lock_timeout  # 重新生成数据的锁的超时时间
+        self.version_key = '%s:version' % name
+        self.stats_key = '%s:stats' % name
+
+    def make_key(self, *args):
+        """数据的缓存键 name:参数1:参数2"""
+        return ':'.join([self.name] + [str(arg) for arg in args])
+
+    def incr_stat(self, field):
+        """累加命中/未命中/重新生成的计数"""
+        conn = get_redis_connection('default')
+        conn.hincrby(self.stats_key, field, 1)
+
+    def stats(self):
+        """获取计数 {'hit': 10, 'stale': 1, 'miss': 1, 'rebuild': 2}"""
+        conn = get_redis_connection('default')
+        stats = {'hit': 0, 'stale': 0, 'miss': 0, 'rebuild': 0}
+        for field, value in conn.hgetall(self.stats_key).items():
+            stats[field.decode()] = int(value)
+        return stats
+
+    def rebuild(self, version, *args):
+        """生成数据，发布为version版本"""
+        self.incr_stat('rebuild')
+        data = self.builder(*args)
+        payload = {'version': version, 'expires': time.time() + self.timeout, 'data': data}
+        cache.set(self.make_key(*args), payload, self.stale_timeout)
+        return data
+
+    def get(self, *args):
+        """获取数据"""
+
+        key = self.make_key(*args)
+        values = cache.get_many([self.version_key, key])
+        version = values.get(self.version_key, 0)
+        payload = values.get(key)
+
+        if payload is not None and payload['version'] == version and payload['expires'] > time.time():
+            # 缓存命中
+            self.incr_stat('hit')
+            return payload['data']
+
+        # 只让一个请求去重新生成数据
+        lock = cache.lock('%s:lock' % key, timeout=self.lock_timeout)
+        if lock.acquire(blocking=False):
+            try:
+                return self.rebuild(version, *args)
+            finally:
+                try:
+                    lock.release()
+                except LockError:
+                    # 生成数据的时间超过了锁的超时时间，锁已经自动释放
+                    pass
+
+        if payload is not None:
+            # 其他请求正在重新生成数据，先返回旧版本的数据
+            self.incr_stat('stale')
+            return payload['data']
+
+        # 缓存中没有任何数据，等待拿到锁的请求生成完毕
+        self.incr_stat('miss')
+        if lock.acquire(blocking=True, blocking_timeout=self.lock_timeout):
+            lock.release()
+            payload = cache.get(key)
+            if payload is not None:
+                return payload['data']
+        return self.builder(*args)
+
+    def invalidate(self, *args):
+        """使缓存的数据失效(旧数据保留到新数据生成为止)
+
+        不传参数时把版本号加1，所有参数对应的数据都会失效
+        """
+
+        if not args:
+            if not cache.add(self.version_key, 1, None):
+                cache.incr(self.version_key)
+            return
+
+        self.invalidate_many([args])
+
+    def invalidate_many(self, args_list):
+        """使多组参数对应的数据失效 [(参数1, 参数2), ...]"""
+
+        keys = [self.make_key(*args) for args in args_list]
+        if not keys:
+            return
+        payloads = cache.get_many(keys)
+        for payload in payloads.values():
+            payload['expires'] = 0
+        if payloads:
+            cache.set_many(payloads, self.stale_timeout)
@@ -0,0 +1,150 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from django_redis import get_redis_connection
+
+
+class LocalCache(object):
+    """进程内缓存，用来保存商品种类这类很小并且几乎不变的数据
+
+    读取时不需要访问redis；数据变化时通过redis的发布订阅通知所有进程(uwsgi/celery worker)删除缓存，
+    另外每条数据最多保存ttl秒，即使漏掉了通知也能在ttl之后更新
+    """
+
+    channel = 'local_cache_invalidate'
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._data = {}  # 名称 -> (过期时间, 数据)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._handlers = []  # 收到删除通知时调用的函数，用来删除其他进程内缓存(例如LRUCache)中的数据
+        self._generation = 0  # 每次删除加1，生成数据期间收到了删除通知时不保存生成的数据
+
+    def get_or_set(self, name, builder):
+        """获取名称为name的数据，没有或已过期时调用builder()生成"""
+
+        self.ensure_listener()
+        item = self._data.get(name)
+        if item is not None and item[0] > time.time():
+            return item[1]
+
+        generation = self._generation
+        value = builder()
+        with self._lock:
+            # 生成期间收到了删除通知，value可能是删除之前的数据，只返回不保存
+            if self._generation == generation:
+                self._data[name] = (time.time() + self.ttl, value)
+        return value
+
+    def delete(self, name=None):
+        """删除本进程中的缓存，name为None时全部删除"""
+        with self._lock:
+            self._generation += 1
+            if name is None:
+                self._data.clear()
+            else:
+                self._data.pop(name, None)
+        for handler in self._handlers:
+            handler(name)
+
+    def add_handler(self, handler):
+        """注册删除通知的处理函数handler(name)，name为None时表示全部删除"""
+        self._handlers.append(handler)
+
+    def invalidate(self, name=None):
+        """通知所有进程删除缓存，name为None时全部删除"""
+        self.delete(name)
+        conn = get_redis_connection('default')
+        conn.publish(self.channel, name or '*')
+
+    def invalidate_many(self, names):
+        """通知所有进程删除多个缓存，只发布一条消息(名称之间用换行分隔)"""
+
+        names = list(names)
+        if not names:
+            return
+        for name in names:
+            self.delete(name)
+        conn = get_redis_connection('default')
+        conn.publish(self.channel, '\n'.join(names))
+
+    def ensure_listener(self):
+        """每个进程启动一个订阅线程(fork出来的子进程需要重新启动)"""
+
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            # 子进程从父进程继承的数据不一定是最新的
+            self._data.clear()
+            for handler in self._handlers:
+                handler(None)
+            thread = threading.Thread(target=self._listen, name='local-cache-listener', daemon=True)
+            thread.start()
+            self._pid = pid
+
+    def _listen(self):
+        """订阅删除缓存的通知"""
+
+        while True:
+            try:
+                pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    for name in message['data'].decode().split('\n'):
+                        self.delete(None if name == '*' else name)
+            except Exception as e:
+                # 连接断开期间可能漏掉了通知，清空缓存后重新订阅
+                self.delete()
+                time.sleep(1)
+
+
+class LRUCache(object):
+    """进程内的LRU缓存，最多保存maxsize条数据，每条数据最多保存ttl秒
+
+    和LocalCache配合使用: 通过local_cache.add_handler注册删除函数，由local_cache的订阅线程通知删除
+    """
+
+    def __init__(self, maxsize=1000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # 键 -> (过期时间, 数据)，最近使用的在末尾
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            if item[0] <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                # 删除最久没有使用的数据
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# 进程内的全局缓存对象
+local_cache = LocalCache()
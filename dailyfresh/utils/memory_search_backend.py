@@ -0,0 +1,299 @@
+import os
+import json
+import math
+import mmap
+import time
+import struct
+import tempfile
+import threading
+from array import array
+from collections import Counter
+from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query
+from haystack.constants import DJANGO_CT, DJANGO_ID
+from haystack.models import SearchResult
+from haystack.utils import get_identifier, get_model_ct
+from jieba.analyse import ChineseAnalyzer
+
+
+# 内存倒排索引的haystack后端，用于商品这种可以全部放入内存的小数据量
+# 索引保存在一个快照文件中，各个进程用mmap只读映射同一个文件，共享操作系统的页缓存
+#
+# 快照文件格式(小端):
+#   文件头 HEADER: 魔数 版本 文档数 词数 倒排项数 平均文档长度 元数据长度
+#   doc_norms   double[文档数]   BM25中每个文档的长度归一化 k1*(1-b+b*文档长度/平均文档长度)
+#   post_starts uint64[词数+1]   第i个词的倒排项在post_docs/post_tfs中的范围[post_starts[i], post_starts[i+1])
+#   post_docs   uint32[倒排项数] 文档序号，每个词内按序号升序
+#   post_tfs    uint32[倒排项数] 词频
+#   元数据       json {'terms': [词(按字典序)], 'docs': [[django_ct, django_id], ...]}
+# 词用整数id(在terms中的下标)表示，查询时在内存中只有词到id的字典和文档列表
+MAGIC = b'DFII'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIQdQ')
+K1 = 1.2
+B = 0.75
+
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
+
+
+def write_snapshot(path, documents):
+    """把文档写入快照文件(先写临时文件再重命名，正在读取的进程不受影响)
+
+    documents: {(django_ct, django_id): {词: 词频}}
+    """
+
+    docs = sorted(documents)
+    terms = sorted({term for key in docs for term in documents[key]})
+    term_ids = {term: tid for tid, term in enumerate(terms)}
+
+    # 倒排表: 按文档序号顺序追加，每个词内自然升序
+    postings = [[] for _ in terms]
+    doc_lens = []
+    for doc_idx, key in enumerate(docs):
+        tfs = documents[key]
+        doc_lens.append(sum(tfs.values()))
+        for term, tf in tfs.items():
+            postings[term_ids[term]].append((doc_idx, tf))
+
+    avgdl = sum(doc_lens) / len(doc_lens) if doc_lens else 0
+    doc_norms = array('d', (K1 * (1 - B + B * length / avgdl) if avgdl else K1 for length in doc_lens))
+    post_starts = array('Q', [0])
+    post_docs = array('I')
+    post_tfs = array('I')
+    for term_postings in postings:
+        for doc_idx, tf in term_postings:
+            post_docs.append(doc_idx)
+            post_tfs.append(tf)
+        post_starts.append(len(post_docs))
+
+    meta = json.dumps({'terms': terms, 'docs': [list(key) for key in docs]}, ensure_ascii=False).encode()
+
+    dirname = os.path.dirname(path)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(docs), len(terms), len(post_docs), avgdl, len(meta)))
+            for section in (doc_norms, post_starts, post_docs, post_tfs):
+                f.write(b'\0' * (_align(f.tell()) - f.tell()))
+                section.tofile(f)
+            f.write(meta)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+class Snapshot(object):
+    """mmap映射的只读快照"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_docs, n_terms, n_postings, self.avgdl, meta_len = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('不是有效的索引快照: %s' % path)
+
+        # 各个数组直接引用mmap中的内存，不复制
+        view = memoryview(self.mm)
+        offset = HEADER.size
+        sections = []
+        for typecode, itemsize, length in (('d', 8, n_docs), ('Q', 8, n_terms + 1), ('I', 4, n_postings), ('I', 4, n_postings)):
+            offset = _align(offset)
+            sections.append(view[offset:offset + itemsize * length].cast(typecode))
+            offset += itemsize * length
+        self.doc_norms, self.post_starts, self.post_docs, self.post_tfs = sections
+
+        meta = json.loads(bytes(view[offset:offset + meta_len]).decode())
+        self.terms = {term: tid for tid, term in enumerate(meta['terms'])}
+        self.docs = [tuple(key) for key in meta['docs']]
+
+    def postings(self, tid):
+        """返回词的(文档序号, 词频)两个只读数组"""
+
+        start, end = self.post_starts[tid], self.post_starts[tid + 1]
+        return self.post_docs[start:end], self.post_tfs[start:end]
+
+    def search(self, terms, doc_filter=None):
+        """查询同时包含所有词的文档，返回[(BM25得分, 文档序号), ...]，按得分从高到低排序"""
+
+        tids = []
+        for term in set(terms):
+            tid = self.terms.get(term)
+            if tid is None:
+                # 有一个词不存在就没有结果
+                return []
+            tids.append(tid)
+        if not tids:
+            return []
+
+        n_docs = len(self.docs)
+        # 从文档数最少的词开始求交集
+        tids.sort(key=lambda tid: self.post_starts[tid + 1] - self.post_starts[tid])
+        scores = None
+        for tid in tids:
+            docs, tfs = self.postings(tid)
+            df = len(docs)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            norms = self.doc_norms
+            if scores is None:
+                scores = {doc_idx: idf * tf * (K1 + 1) / (tf + norms[doc_idx]) for doc_idx, tf in zip(docs, tfs)
+                          if doc_filter is None or doc_filter(doc_idx)}
+            else:
+                matched = {}
+                for doc_idx, tf in zip(docs, tfs):
+                    score = scores.get(doc_idx)
+                    if score is not None:
+                        matched[doc_idx] = score + idf * tf * (K1 + 1) / (tf + norms[doc_idx])
+                scores = matched
+            if not scores:
+                return []
+        return sorted(((score, doc_idx) for doc_idx, score in scores.items()), key=lambda item: (-item[0], item[1]))
+
+    def documents(self):
+        """从倒排表还原出每个文档的词频，增量更新时使用(不需要重新查询数据库和分词)"""
+
+        terms = [None] * len(self.terms)
+        for term, tid in self.terms.items():
+            terms[tid] = term
+        documents = {key: {} for key in self.docs}
+        for tid, term in enumerate(terms):
+            docs, tfs = self.postings(tid)
+            for doc_idx, tf in zip(docs, tfs):
+                documents[self.docs[doc_idx]][term] = tf
+        return documents
+
+
+class MemorySearchBackend(BaseSearchBackend):
+    """内存倒排索引后端: 使用和whoosh_cn_backend相同的jieba分词，BM25计算相关度，多个词之间是AND关系"""
+
+    # 检查快照文件是否被其他进程更新的最小间隔(秒)
+    reload_interval = 1
+
+    def __init__(self, connection_alias, **connection_options):
+        super().__init__(connection_alias, **connection_options)
+        self.path = str(connection_options['PATH'])
+        self.analyzer = ChineseAnalyzer()
+        self._snapshot = None
+        self._mtime = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def tokenize(self, text):
+        """分词并统计词频"""
+        return Counter(token.text for token in self.analyzer(text or ''))
+
+    def snapshot(self):
+        """返回当前的快照，快照文件被替换之后重新映射"""
+
+        now = time.time()
+        if self._snapshot is not None and now - self._checked < self.reload_interval:
+            return self._snapshot
+        with self._lock:
+            self._checked = now
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._snapshot, self._mtime = None, None
+                return None
+            # 快照通过重命名替换，inode也会变化
+            mtime = (stat.st_mtime_ns, stat.st_ino)
+            if mtime != self._mtime:
+                # 旧的快照可能还有其他线程在使用，不主动关闭，没有引用之后由垃圾回收释放
+                self._snapshot, self._mtime = Snapshot(self.path), mtime
+            return self._snapshot
+
+    def documents(self):
+        snapshot = self.snapshot()
+        return snapshot.documents() if snapshot is not None else {}
+
+    def update(self, index, iterable, commit=True):
+        if self.snapshot() is None:
+            # 快照还没有生成(rebuild_search_index --using memory)，不生成只有部分文档的索引
+            return
+        documents = self.documents()
+        content_field = index.get_content_field()
+        for obj in iterable:
+            doc = index.full_prepare(obj)
+            documents[(doc[DJANGO_CT], str(doc[DJANGO_ID]))] = self.tokenize(doc[content_field])
+        self.write(documents)
+
+    def remove(self, obj_or_string, commit=True):
+        self.remove_many([obj_or_string])
+
+    def remove_many(self, objs_or_strings):
+        """删除多个文档，只重写一次快照"""
+
+        if self.snapshot() is None:
+            return
+        documents = self.documents()
+        removed = False
+        for obj_or_string in objs_or_strings:
+            app_label, model_name, pk = get_identifier(obj_or_string).split('.', 2)
+            removed |= documents.pop(('%s.%s' % (app_label, model_name), pk), None) is not None
+        if removed:
+            self.write(documents)
+
+    def clear(self, models=None, commit=True):
+        if models is None:
+            self.write({})
+            return
+        cts = {get_model_ct(model) for model in models}
+        documents = self.documents()
+        self.write({key: tfs for key, tfs in documents.items() if key[0] not in cts})
+
+    def write(self, documents):
+        write_snapshot(self.path, documents)
+        # 本进程立即读取新的快照
+        self._checked = 0
+
+    @log_query
+    def search(self, query_string, **kwargs):
+        result_class = kwargs.get('result_class') or SearchResult
+        start_offset = kwargs.get('start_offset', 0)
+        end_offset = kwargs.get('end_offset')
+
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return {'results': [], 'hits': 0}
+
+        doc_filter = None
+        models = kwargs.get('models')
+        if models:
+            cts = {get_model_ct(model) for model in models}
+            doc_filter = lambda doc_idx: snapshot.docs[doc_idx][0] in cts
+
+        if query_string.strip() in ('', '*', '*:*'):
+            # 查询全部文档
+            matches = [(0, doc_idx) for doc_idx in range(len(snapshot.docs)) if doc_filter is None or doc_filter(doc_idx)]
+        else:
+            matches = snapshot.search(self.tokenize(query_string), doc_filter)
+
+        results = []
+        for score, doc_idx in matches[start_offset:end_offset]:
+            django_ct, django_id = snapshot.docs[doc_idx]
+            app_label, model_name = django_ct.split('.')
+            results.append(result_class(app_label, model_name, django_id, score))
+        return {'results': results, 'hits': len(matches), 'facets': {}, 'spelling_suggestion': None}
+
+
+class MemorySearchQuery(BaseSearchQuery):
+    """只支持全文检索的查询(auto_query/content)，所有条件都当作要匹配的词"""
+
+    def matching_all_fragment(self):
+        return '*'
+
+    def build_query_fragment(self, field, filter_type, value):
+        if hasattr(value, 'prepare'):
+            # AutoQuery/Clean等
+            value = value.prepare(self)
+        if isinstance(value, (list, tuple, set)):
+            value = ' '.join(str(item) for item in value)
+        return str(value)
+
+
+class MemoryEngine(BaseEngine):
+    backend = MemorySearchBackend
+    query = MemorySearchQuery
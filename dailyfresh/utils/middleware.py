@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+from utils.redis_batch import RedisBatch
+
+
+class RedisBatchMiddleware(MiddlewareMixin):
+    """给每个请求创建redis批处理对象request.redis
+
+    响应之前发送还没有执行的命令(例如只写不读的浏览记录)，DEBUG时在响应头中返回本次请求的redis命令数和往返次数
+    MiddlewareMixin同时支持同步和异步(sync_capable、async_capable)，异步视图不会被切换成同步执行；
+    异步请求时process_request和process_response在线程池中执行，同步的redis命令不会阻塞事件循环
+    """
+
+    def process_request(self, request):
+        request.redis = RedisBatch()
+
+    def process_response(self, request, response):
+        batch = getattr(request, 'redis', None)
+        if batch is None:
+            return response
+        batch.flush()
+        if settings.DEBUG:
+            response['X-Redis-Commands'] = batch.commands
+            response['X-Redis-Round-Trips'] = batch.round_trips
+        return response
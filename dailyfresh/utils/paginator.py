@@ -0,0 +1,134 @@
+from math import ceil
+from django.db.models import Q
+
+
+class KeysetPage(object):
+    """键集分页的一页数据，提供和django Page对象相同的模板接口"""
+
+    def __init__(self, object_list, number, has_next, ordering):
+        self.object_list = object_list
+        self.number = number
+        self._has_next = has_next
+        self.ordering = ordering
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self.number > 1
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    def cursor(self, obj):
+        """对象在排序字段上的值，作为游标 12.50_37"""
+        return '_'.join(str(getattr(obj, field.lstrip('-'))) for field in self.ordering)
+
+    @property
+    def next_cursor(self):
+        """下一页的游标:本页最后一个对象"""
+        return self.cursor(self.object_list[-1]) if self.object_list else ''
+
+    @property
+    def previous_cursor(self):
+        """上一页的游标:本页第一个对象"""
+        return self.cursor(self.object_list[0]) if self.object_list else ''
+
+
+class KeysetPaginator(object):
+    """键集(seek)分页
+
+    根据上一页最后一个对象的(排序字段, id)直接定位到下一页，不需要COUNT(*)和OFFSET；
+    ordering的最后一个字段必须唯一(一般是id)，才能保证翻页不重复不遗漏。
+    count用来计算页码，可以传入缓存的近似值。
+    """
+
+    def __init__(self, queryset, ordering, per_page, count=0):
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = ordering
+        self.per_page = per_page
+        self.count = count
+
+    @property
+    def num_pages(self):
+        """总页数(近似值)"""
+        return max(1, int(ceil(self.count / self.per_page)))
+
+    def parse_cursor(self, cursor):
+        """游标 -> 排序字段的值的列表，游标不合法时返回None"""
+        if not cursor:
+            return None
+        parts = cursor.split('_')
+        if len(parts) != len(self.ordering):
+            return None
+        values = []
+        try:
+            for field, part in zip(self.ordering, parts):
+                model_field = self.queryset.model._meta.get_field(field.lstrip('-'))
+                values.append(model_field.to_python(part))
+        except Exception as e:
+            return None
+        return values
+
+    def seek_filter(self, values, forward=True):
+        """排在游标之后(forward=True)或之前的对象的过滤条件
+
+        ordering=('price', 'id'), values=(p, i) ->
+        price > p or (price = p and id > i)
+        """
+        query = Q()
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            condition = Q(**{'%s__%s' % (name, lookup): values[i]})
+            for prev_field, prev_value in zip(self.ordering[:i], values[:i]):
+                condition &= Q(**{prev_field.lstrip('-'): prev_value})
+            query |= condition
+        return query
+
+    def page(self, number, after=None, before=None):
+        """获取第number页
+
+        after: 上一页最后一个对象的游标(点击下一页)
+        before: 下一页第一个对象的游标(点击上一页)
+        都没有时退回到OFFSET查询
+        """
+
+        after = self.parse_cursor(after)
+        before = self.parse_cursor(before)
+
+        if after is not None:
+            # 多取一条，用来判断是否还有下一页
+            rows = list(self.queryset.filter(self.seek_filter(after))[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+        elif before is not None:
+            # 反向排序取游标之前的数据，再倒过来
+            reverse_ordering = [field[1:] if field.startswith('-') else '-' + field for field in self.ordering]
+            rows = list(self.queryset.filter(self.seek_filter(before, forward=False))
+                        .order_by(*reverse_ordering)[:self.per_page])
+            rows.reverse()
+            has_next = True
+        else:
+            offset = (number - 1) * self.per_page
+            rows = list(self.queryset[offset:offset + self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+
+        if has_next:
+            # 近似的总数偏小时，至少保证能显示下一页的页码
+            self.count = max(self.count, (number + 1) * self.per_page)
+        else:
+            self.count = (number - 1) * self.per_page + len(rows)
+
+        return KeysetPage(rows, number, has_next, self.ordering)
@@ -0,0 +1,78 @@
+from django_redis import get_redis_connection
+
+
+class LazyResult(object):
+    """批处理中的一条redis命令的结果，第一次读取value时才把排队的命令一起发送给redis"""
+
+    _pending = object()
+
+    def __init__(self, batch=None, value=_pending):
+        self._batch = batch
+        self._value = value
+
+    @classmethod
+    def resolved(cls, value):
+        """不需要访问redis的结果(例如未登录用户的购物车数目)"""
+        return cls(value=value)
+
+    @property
+    def value(self):
+        if self._value is self._pending:
+            self._batch.flush()
+        if isinstance(self._value, Exception):
+            raise self._value
+        return self._value
+
+
+class RedisBatch(object):
+    """请求范围内的redis命令批处理
+
+    命令先排队并返回LazyResult，读取任意一个结果时把所有排队的命令用一个pipeline发送，
+    一个页面中的多条命令只需要一到两次往返；commands和round_trips记录了本次请求的命令数和往返次数
+    """
+
+    def __init__(self, conn=None):
+        self.conn = conn or get_redis_connection('default')
+        self.pending = []  # [(命令, 参数, LazyResult), ...]
+        self.commands = 0
+        self.round_trips = 0
+
+    def call(self, command, *args):
+        """排队一条命令，例如 batch.call('hlen', 'cart_1')"""
+        result = LazyResult(self)
+        self.pending.append((command, args, result))
+        return result
+
+    def eval(self, source, keys, args):
+        """排队执行一个lua脚本(使用EVAL而不是EVALSHA，pipeline中使用EVALSHA需要额外的往返来检查脚本是否存在)"""
+        return self.call('eval', source, len(keys), *(list(keys) + list(args)))
+
+    def flush(self):
+        """把排队的命令一起发送给redis"""
+
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        pipe = self.conn.pipeline(transaction=False)
+        for command, args, result in pending:
+            getattr(pipe, command)(*args)
+        values = pipe.execute(raise_on_error=False)
+        for (command, args, result), value in zip(pending, values):
+            result._value = value
+        self.commands += len(pending)
+        self.round_trips += 1
+
+    def __getattr__(self, command):
+        """batch.hget(key, field) 等价于 batch.call('hget', key, field)"""
+        if command.startswith('_'):
+            raise AttributeError(command)
+        return lambda *args: self.call(command, *args)
+
+
+def get_redis_batch(request):
+    """获取请求的redis批处理对象(由RedisBatchMiddleware创建)，没有时创建一个"""
+
+    batch = getattr(request, 'redis', None)
+    if batch is None:
+        batch = request.redis = RedisBatch()
+    return batch
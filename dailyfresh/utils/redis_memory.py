@@ -0,0 +1,67 @@
+import re
+from collections import Counter
+from django_redis import get_redis_connection
+
+
+# 按键的类别统计redis的内存占用，类别按顺序匹配，第一个匹配的类别生效
+# 通过django缓存(cache.set/cache.lock)保存的键带有前缀 :版本号: ，直接用redis连接保存的键没有前缀
+FAMILIES = [
+    ('cart_total', re.compile(r'^cart_total_\d+$')),
+    ('cart', re.compile(r'^cart_\d+$')),
+    ('history', re.compile(r'^history_\d+$')),
+    ('session', re.compile(r'^:\d+:django\.contrib\.sessions\.cache')),  # django缓存中的会话
+    ('sku_cache', re.compile(r'^goods_sku_\d+$')),
+    ('goods_index', re.compile(r'^goods_(index|facet)_')),  # 排序索引、筛选集合和筛选的临时集合
+    ('search_index', re.compile(r'^(:\d+:)?search_index_')),  # 索引的版本号、待更新队列和更新锁
+    ('search_cache', re.compile(r'^(:\d+:search_|search_cache:)')),  # 搜索结果、筛选计数的缓存和命中统计
+    ('search_suggest', re.compile(r'^search_(suggest_|popular_queries)')),  # 提示词和按天记录的热门搜索词
+    ('page_cache', re.compile(r'^(:\d+:)?(index_page_data|detail_page_data)|^:\d+:(list_sku_count_|list_facets_|goods_types)')),
+    ('django_cache', re.compile(r'^:\d+:')),  # 静态页面的锁等其他django缓存
+]
+
+
+def family(key):
+    for name, pattern in FAMILIES:
+        if pattern.match(key):
+            return name
+    return 'other'
+
+
+def memory_report(match='*', scan_count=1000, samples=5):
+    """扫描所有键，返回{类别: {'keys': 键数, 'bytes': 内存字节数, 'no_ttl': 没有过期时间的键数, 'encodings': Counter}}
+
+    MEMORY USAGE对集合类型只抽样samples个元素估算
+    """
+
+    conn = get_redis_connection('default')
+    report = {}
+    keys = []
+
+    def flush():
+        pipe = conn.pipeline(transaction=False)
+        for key in keys:
+            pipe.memory_usage(key, samples=samples)
+            pipe.object('encoding', key)
+            pipe.ttl(key)
+        results = pipe.execute(raise_on_error=False)
+        for i, key in enumerate(keys):
+            usage, encoding, ttl = results[i * 3:i * 3 + 3]
+            if usage is None or isinstance(usage, Exception):
+                # 扫描之后已经过期或删除
+                continue
+            stats = report.setdefault(family(key.decode(errors='replace')),
+                                      {'keys': 0, 'bytes': 0, 'no_ttl': 0, 'encodings': Counter()})
+            stats['keys'] += 1
+            stats['bytes'] += usage
+            stats['no_ttl'] += ttl == -1
+            if isinstance(encoding, bytes):
+                encoding = encoding.decode()
+            stats['encodings'][encoding] += 1
+        keys.clear()
+
+    for key in conn.scan_iter(match=match, count=scan_count):
+        keys.append(key)
+        if len(keys) >= scan_count:
+            flush()
+    flush()
+    return report